@@ -10,6 +10,7 @@ import os
 from os.path import dirname, join
 import sys
 import re
+import json
 import logging
 
 from xpcom import components, COMException, ServerException, nsError
@@ -27,16 +28,68 @@ except ImportError, ex:
 
 try:
     import dbx_mysqldb
+    import dbx_mysqldb_results
     loaded = True
 except ImportError, ex:
     sys.stderr.write("Failed to load dbx_mysqldb: %s\n" % (ex,))
     loaded = False
 
+def _explorerArgs(db_args):
+    # The explorer only displays values: have the driver leave DECIMAL
+    # and temporal columns as the server's text.
+    db_args = dict(db_args)
+    db_args['display_conversions'] = True
+    return db_args
+
 class KoMySQLDBXTableConnection(dbxlib.KoTableConnector):
     """ This table is now mixed into KoMySQL_DBXTable"""
+    _row_window = None
+    _worker_table = None
+
     def __init__(self):
         dbxlib.KoTableConnector.__init__(self, dbx_mysqldb)
 
+    def _get_row_window(self):
+        if self._row_window is None:
+            # fetch_rows also runs on the read-ahead thread, so look up
+            # everything that goes through XPCOM here, on the main thread.
+            table_name = self._table_name
+            db_args = _explorerArgs(self.find_params_from_connection())
+            if db_args.get('worker_process'):
+                # Read the table into a child process, which formats
+                # each window of rows.
+                import dbx_mysqldb_worker
+                dbx_mysqldb.pythonExecutable()
+                fetch_rows = self._worker_table = dbx_mysqldb_worker.TableWindow(
+                    dbx_mysqldb_worker.getPool(), db_args, self._dbname,
+                    table_name)
+            else:
+                db = self._db
+                def fetch_rows(offset, limit):
+                    return db.getRowsByOffset(table_name, offset, limit)
+            self._row_window = dbx_mysqldb_results.RowWindowCache(fetch_rows)
+        return self._row_window
+
+    #---- Windowed access to the table's rows (koIDBXRowWindow)
+
+    def setVisibleRows(self, firstRow, lastRow):
+        self._get_row_window().setVisibleRange(firstRow, lastRow)
+
+    def getWindowCellText(self, rowNum, columnNum):
+        value = self._get_row_window().getCell(rowNum, columnNum)
+        if value is None:
+            return ""
+        return value
+
+    def invalidateRowWindow(self):
+        if self._worker_table is not None:
+            self._worker_table.reset()
+        if self._row_window is not None:
+            self._row_window.invalidate()
+
+    def getRowWindowStats(self):
+        return json.dumps(self._get_row_window().getStats())
+
     # Interface methods
 
     #---- Data manipulation
@@ -72,6 +125,7 @@ class KoMySQLDBXTableConnection(dbxlib.KoTableConnector):
                 final_res = ("Failed to delete keys:%s, values:%s" %
                             (", ".join(query_names),
                              ", ".join([str(x) for x in query_values])))
+        self.invalidateRowWindow()
         return final_res
         
 
@@ -92,9 +146,9 @@ class KoMySQLDBXConnection(dbxlib.KoDBXConnection):
     def getChildren(self):
         """Return an annotated list of the parts of the connection"""
         log.debug("Asked to get children from %r", self)
-        db_args = dbxlib.params_from_connection(self)
+        db_args = _explorerArgs(dbxlib.params_from_connection(self))
         try:
-            db = dbx_mysqldb.Database(db_args)
+            db = dbx_mysqldb.openDatabase(db_args, uri=self.getURI())
             database_names = [(name, 'database', KoMySQL_DBXDatabase(self, name)) for name in db.listDatabases()]
             names = sorted(database_names, key=lambda item:item[0].lower())
             return names
@@ -127,9 +181,9 @@ class KoMySQL_DBXDatabase(dbxlib.KoDBXConnectionChild):
     def getChildren(self):
         """Return an annotated list of the parts of the connection"""
         log.debug("Asked to get children from %r", self)
-        db_args = self.find_params_from_connection()
+        db_args = _explorerArgs(self.find_params_from_connection())
         try:
-            db = dbx_mysqldb.Database(db_args)
+            db = dbx_mysqldb.openDatabase(db_args, uri=self.getURI())
             table_names = [(name, 'table', KoMySQL_DBXTable(self, name)) for name in db.listAllTableNames(self._dbname)]
             names = sorted(table_names, key=lambda item:item[0].lower())
             return names
@@ -141,7 +195,8 @@ class KoMySQL_DBXDatabase(dbxlib.KoDBXConnectionChild):
         return self._parent.getURI() + "/" + self._dbname
 
 class KoMySQL_DBXTable(dbxlib.KoDBXConnectionChild, KoMySQLDBXTableConnection):
-    _com_interfaces_ = [components.interfaces.koIDBXTableConnector]
+    _com_interfaces_ = [components.interfaces.koIDBXTableConnector,
+                        components.interfaces.koIDBXRowWindow]
 
     isContainer = True
     def __init__(self, parent, table_name):
@@ -166,9 +221,9 @@ class KoMySQL_DBXTable(dbxlib.KoDBXConnectionChild, KoMySQLDBXTableConnection):
     def getChildren(self):
         """Return an annotated list of the parts of the connection"""
         log.debug("Asked to get children from %r", self)
-        db_args = self.find_params_from_connection()
+        db_args = _explorerArgs(self.find_params_from_connection())
         try:
-            db = dbx_mysqldb.Database(db_args)
+            db = dbx_mysqldb.openDatabase(db_args, uri=self.getURI())
             column_names = [(name, 'column', KoMySQL_DBXColumn(self, name)) for name in db.listAllColumnNames(self._dbname, self._table_name)]
             names = sorted(column_names, key=lambda item:item[0].lower())
             return names
@@ -181,8 +236,9 @@ class KoMySQL_DBXTable(dbxlib.KoDBXConnectionChild, KoMySQLDBXTableConnection):
 
     def __getattr__(self, attr):
         if attr == "_db":
-            db_args = self.find_params_from_connection()
-            self._db = dbx_mysqldb.Database(db_args, self._dbname)
+            db_args = _explorerArgs(self.find_params_from_connection())
+            self._db = dbx_mysqldb.openDatabase(db_args, self._dbname,
+                                                uri=self.getURI())
             return self._db
         #Hardwired parent.
         return dbxlib.KoDBXConnectionChild.__getattr__(self, attr)
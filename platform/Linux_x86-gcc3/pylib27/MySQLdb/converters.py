@@ -37,6 +37,7 @@ from constants import FIELD_TYPE, FLAG
 from times import *
 import types
 import array
+from inspect import getmro
 
 try:
     set
@@ -88,25 +89,21 @@ def Instance2Str(o, d):
     method produces acceptable output, then you don't need to add the
     class to conversions; it will be handled by the default
     converter. If the exact class is not found in d, it will use the
-    first class it can find for which o is an instance.
+    converter of its nearest base class (in method resolution order)
+    that has one.
 
     """
 
     if d.has_key(o.__class__):
         return d[o.__class__](o, d)
-    cl = filter(lambda x,o=o:
-                type(x) is types.ClassType
-                and isinstance(o, x), d.keys())
-    if not cl and hasattr(types, 'ObjectType'):
-        cl = filter(lambda x,o=o:
-                    type(x) is types.TypeType
-                    and isinstance(o, x)
-                    and d[x] is not Instance2Str,
-                    d.keys())
-    if not cl:
-        return d[types.StringType](o,d)
-    d[o.__class__] = d[cl[0]]
-    return d[cl[0]](o, d)
+    # The conversion found is stored under the class itself, so the
+    # MRO is only walked once per class and connection.
+    for cl in getmro(o.__class__)[1:]:
+        conv = d.get(cl)
+        if conv is not None and conv is not Instance2Str:
+            d[o.__class__] = conv
+            return conv(o, d)
+    return d[types.StringType](o,d)
 
 def char_array(s):
     return array.array('c', s)
@@ -167,5 +164,16 @@ try:
 except ImportError:
     pass
 
+# For clients that only display values: DECIMAL and temporal columns
+# are returned as the server's text, with no Decimal or datetime
+# objects built only to be turned back into strings. Pass it as the
+# conv argument of connect().
+display_conversions = conversions.copy()
+for k in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.DATE,
+          FIELD_TYPE.NEWDATE, FIELD_TYPE.TIME, FIELD_TYPE.DATETIME,
+          FIELD_TYPE.TIMESTAMP):
+    display_conversions.pop(k, None)
+del k
+
 
 
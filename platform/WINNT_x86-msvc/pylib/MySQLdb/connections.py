@@ -138,6 +138,16 @@ class Connection(_mysql.connection):
 
         local_infile
           integer, non-zero enables LOAD LOCAL INFILE; zero disables
+
+        lazy_warnings
+          If True, cursors only count warnings instead of issuing SHOW
+          WARNINGS after each statement; see BaseCursor.fetch_warnings.
+          (keyword only)
+
+        abort_on_close
+          If True, closing a cursor that uses mysql_use_result() with a
+          large unread result kills the query instead of reading the
+          rest of it; see CursorUseResultMixIn. (keyword only)
     
         There are a number of undocumented, non-standard methods. See the
         documentation for the MySQL C API for some hints on what they do.
@@ -166,6 +176,10 @@ class Connection(_mysql.connection):
         kwargs2['conv'] = conv2
 
         self.cursorclass = kwargs2.pop('cursorclass', self.default_cursor)
+        self.lazy_warnings = kwargs2.pop('lazy_warnings', False)
+        self.abort_on_close = kwargs2.pop('abort_on_close', False)
+        self.close_stats = {'aborted': 0, 'rows_read_before_abort': 0}
+        self._connect_args = args, kwargs
         charset = kwargs2.pop('charset', '')
 
         if charset:
@@ -309,6 +323,18 @@ class Connection(_mysql.connection):
         self.query("SET SESSION sql_mode='%s'" % sql_mode)
         self.store_result()
         
+    def abort_query(self):
+        """Kill the statement currently running on this connection
+        by issuing KILL QUERY from a second, short-lived connection
+        made with the same parameters. The connection itself stays
+        open. Non-standard."""
+        args, kwargs = self._connect_args
+        side = self.__class__(*args, **kwargs)
+        try:
+            side.query("KILL QUERY %d" % self.thread_id())
+        finally:
+            side.close()
+
     def show_warnings(self):
         """Return detailed information about warnings as a
         sequence of tuples of (Level, Code, Message). This
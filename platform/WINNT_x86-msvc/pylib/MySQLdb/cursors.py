@@ -13,10 +13,23 @@ restr = (r"\svalues\s*"
         r"(?:\([^\)]*\))"
         r")+\))")
 
-insert_values= re.compile(restr)
+insert_values= re.compile(restr, re.I)
 from _mysql_exceptions import Warning, Error, InterfaceError, DataError, \
      DatabaseError, OperationalError, IntegrityError, InternalError, \
      NotSupportedError, ProgrammingError
+from constants import FIELD_TYPE
+
+# array typecodes used by fetchcolumns() for numeric columns
+column_typecodes = {
+    FIELD_TYPE.TINY: 'l',
+    FIELD_TYPE.SHORT: 'l',
+    FIELD_TYPE.LONG: 'l',
+    FIELD_TYPE.INT24: 'l',
+    FIELD_TYPE.LONGLONG: 'l',
+    FIELD_TYPE.YEAR: 'l',
+    FIELD_TYPE.FLOAT: 'd',
+    FIELD_TYPE.DOUBLE: 'd',
+    }
 
 
 class BaseCursor(object):
@@ -36,6 +49,12 @@ class BaseCursor(object):
     arraysize
         default number of rows fetchmany() will fetch
 
+    lazy_warnings
+        If true, warnings are only counted (in warning_count) instead
+        of being fetched with SHOW WARNINGS after every statement; use
+        fetch_warnings() to get them. Defaults to the connection's
+        lazy_warnings setting. Non-standard extension.
+
     """
 
     from _mysql_exceptions import MySQLError, Warning, Error, InterfaceError, \
@@ -43,6 +62,7 @@ class BaseCursor(object):
          InternalError, ProgrammingError, NotSupportedError
     
     _defer_warnings = False
+    max_executemany_size = 16 * 1024 * 1024
     
     def __init__(self, connection):
         from weakref import proxy
@@ -58,8 +78,11 @@ class BaseCursor(object):
         self.errorhandler = connection.errorhandler
         self._result = None
         self._warnings = 0
+        self._unfetched_warnings = 0
         self._info = None
         self.rownumber = None
+        self.lazy_warnings = getattr(connection, 'lazy_warnings', False)
+        self.warning_count = 0
         
     def __del__(self):
         self.close()
@@ -78,6 +101,11 @@ class BaseCursor(object):
 
     def _warning_check(self):
         from warnings import warn
+        if self._warnings and self.lazy_warnings:
+            self.warning_count = self.warning_count + self._warnings
+            self._unfetched_warnings = self._warnings
+            self._warnings = 0
+            return
         if self._warnings:
             warnings = self._get_db().show_warnings()
             if warnings:
@@ -91,6 +119,21 @@ class BaseCursor(object):
                 self.messages.append((self.Warning, self._info))
                 warn(self._info, self.Warning, 3)
 
+    def fetch_warnings(self):
+        """Fetch the warnings left unfetched by the last statement
+        when lazy_warnings is set, as a sequence of (Level, Code,
+        Message) tuples. They are also appended to messages. Must be
+        called before the next statement, and for cursors that use
+        mysql_use_result(), after the whole result has been fetched.
+        Non-standard extension."""
+        if not self._unfetched_warnings:
+            return ()
+        self._unfetched_warnings = 0
+        warnings = self._get_db().show_warnings()
+        for w in warnings:
+            self.messages.append((self.Warning, w))
+        return warnings
+
     def nextset(self):
         """Advance to the next result set.
 
@@ -109,6 +152,63 @@ class BaseCursor(object):
         self._warning_check()
         return 1
 
+    def fetchcolumns(self, use_numpy=False, block_rows=10000):
+        """Fetch the remaining rows column by column. Returns a list
+        with one sequence per column in description.
+
+        Integer and floating point columns are returned as compact
+        array.array objects (typecodes 'l' and 'd'), or as NumPy
+        arrays if use_numpy is true and NumPy is available. A numeric
+        column holding NULLs or values that don't fit the typecode is
+        returned as a list, as are all other columns.
+
+        Rows are fetched block_rows at a time, so with a cursor that
+        uses mysql_use_result() only one block of row tuples exists at
+        a time. Only tuple rows are supported. Non-standard extension.
+        """
+        from array import array
+        self._check_executed()
+        if self._fetch_type != 0:
+            self.errorhandler(self, NotSupportedError,
+                              "fetchcolumns() requires tuple rows")
+        if not self.description:
+            return []
+        columns = []
+        for d in self.description:
+            typecode = column_typecodes.get(d[1])
+            if typecode:
+                columns.append(array(typecode))
+            else:
+                columns.append([])
+        while 1:
+            rows = self.fetchmany(block_rows)
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                column = columns[i]
+                if type(column) is list:
+                    column.extend(values)
+                    continue
+                n = len(column)
+                try:
+                    column.extend(values)
+                except (TypeError, OverflowError):
+                    # array.extend() keeps the items it added before
+                    # failing, so cut back to n before switching.
+                    column = columns[i] = column.tolist()[:n]
+                    column.extend(values)
+        if use_numpy:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            if numpy is not None:
+                for i, column in enumerate(columns):
+                    if type(column) is not list:
+                        columns[i] = numpy.frombuffer(column,
+                                                      dtype=column.typecode)
+        return columns
+
     def _post_get_result(self): pass
     
     def _do_get_result(self):
@@ -120,6 +220,7 @@ class BaseCursor(object):
         self.description_flags = self._result and self._result.field_flags() or None
         self.lastrowid = db.insert_id()
         self._warnings = db.warning_count()
+        self._unfetched_warnings = 0
         self._info = db.info()
     
     def setinputsizes(self, *args):
@@ -175,6 +276,28 @@ class BaseCursor(object):
         if not self._defer_warnings: self._warning_check()
         return r
 
+    def _get_row_literal(self, db):
+        """Return a function converting one row of executemany() args
+        into SQL literals. int, long, float and str values skip the
+        escape() dispatch when the connection uses the default
+        encoders for them."""
+        from converters import Thing2Str, Long2Int, Float2Str
+        encoders = db.encoders
+        literal = db.literal
+        fast = {str: db.string_literal}
+        if encoders.get(int) is Thing2Str:
+            fast[int] = str
+        if encoders.get(long) is Long2Int:
+            fast[long] = str
+        if encoders.get(float) is Float2Str:
+            fast[float] = '%.15g'.__mod__
+        get = fast.get
+        def row_literal(a):
+            if isinstance(a, (tuple, list)):
+                return tuple([ (get(type(x)) or literal)(x) for x in a ])
+            return literal(a)
+        return row_literal
+
     def executemany(self, query, args):
 
         """Execute a multi-row query.
@@ -192,6 +315,12 @@ class BaseCursor(object):
         REPLACE. Otherwise it is equivalent to looping over args with
         execute().
 
+        Multiple-row statements are sent in batches no larger than
+        max_executemany_size bytes or the server's max_allowed_packet,
+        whichever is smaller, each followed by any suffix of the
+        query such as ON DUPLICATE KEY UPDATE. The rows affected by
+        all batches are added up.
+
         """
         del self.messages[:]
         db = self._get_db()
@@ -207,22 +336,54 @@ class BaseCursor(object):
         p = m.start(1)
         e = m.end(1)
         qv = m.group(1)
-        try:
-            q = [ qv % db.literal(a) for a in args ]
-        except TypeError, msg:
-            if msg.args[0] in ("not enough arguments for format string",
-                               "not all arguments converted"):
-                self.errorhandler(self, ProgrammingError, msg.args[0])
-            else:
-                self.errorhandler(self, TypeError, msg)
-        except:
-            from sys import exc_info
-            exc, value, tb = exc_info()
-            del tb
-            self.errorhandler(self, exc, value)
-        r = self._query('\n'.join([query[:p], ',\n'.join(q), query[e:]]))
-        if not self._defer_warnings: self._warning_check()
+        prefix = query[:p]
+        suffix = query[e:]
+        row_literal = self._get_row_literal(db)
+        max_size = min(self.max_executemany_size,
+                       self._get_max_allowed_packet(db) - 1024)
+        rows = iter(args)
+        pending = None
+        r = 0
+        while 1:
+            q = []
+            size = len(prefix) + len(suffix) + 2
+            if pending is not None:
+                q.append(pending)
+                size = size + len(pending) + 2
+                pending = None
+            try:
+                for a in rows:
+                    v = qv % row_literal(a)
+                    if q and size + len(v) + 2 > max_size:
+                        pending = v
+                        break
+                    q.append(v)
+                    size = size + len(v) + 2
+            except TypeError, msg:
+                if msg.args[0] in ("not enough arguments for format string",
+                                   "not all arguments converted"):
+                    self.errorhandler(self, ProgrammingError, msg.args[0])
+                else:
+                    self.errorhandler(self, TypeError, msg)
+            except:
+                from sys import exc_info
+                exc, value, tb = exc_info()
+                del tb
+                self.errorhandler(self, exc, value)
+            if not q:
+                break
+            r = r + self._query('\n'.join([prefix, ',\n'.join(q), suffix]))
+            if not self._defer_warnings: self._warning_check()
+        self.rowcount = r
         return r
+
+    def _get_max_allowed_packet(self, db):
+        size = getattr(db, '_max_allowed_packet', None)
+        if size is None:
+            db.query("SELECT @@max_allowed_packet")
+            size = int(db.store_result().fetch_row()[0][0])
+            db._max_allowed_packet = size
+        return size
     
     def callproc(self, procname, args=()):
 
@@ -381,9 +542,51 @@ class CursorUseResultMixIn(object):
     in the server and sent row-by-row to client side, i.e. it uses
     mysql_use_result(). You MUST retrieve the entire result set and
     close() the cursor before additional queries can be peformed on
-    the connection."""
+    the connection.
+
+    If batched_iteration is set, iterating over the cursor fetches
+    rows from _mysql in blocks instead of one at a time; see
+    iterbatched().
+
+    If abort_on_close is set (it defaults to the connection's
+    abort_on_close setting), close() reads at most close_drain_rows
+    of an unfinished result; if more remain, the query is killed
+    instead of the rest being transferred."""
 
     _defer_warnings = True
+    batched_iteration = False
+    iter_block_bytes = 256 * 1024
+    max_iter_block_rows = 10000
+    close_drain_rows = 1000
+
+    def __init__(self, connection):
+        super(CursorUseResultMixIn, self).__init__(connection)
+        self.abort_on_close = getattr(connection, 'abort_on_close', False)
+
+    def close(self):
+        """Close the cursor. No further queries will be possible."""
+        if self.connection and self.abort_on_close and self._result:
+            rows = self._fetch_row(self.close_drain_rows)
+            self.rownumber = self.rownumber + len(rows)
+            if len(rows) == self.close_drain_rows:
+                self._abort_result()
+        super(CursorUseResultMixIn, self).close()
+
+    def _abort_result(self):
+        db = self._get_db()
+        try:
+            db.abort_query()
+        except Error:
+            # Fall back to draining the result in close().
+            return
+        # Freeing the result now only reads what the server had
+        # already sent before the KILL QUERY took effect.
+        self._result = None
+        self._executed = None
+        stats = db.close_stats
+        stats['aborted'] = stats['aborted'] + 1
+        stats['rows_read_before_abort'] = (stats['rows_read_before_abort']
+                                           + self.rownumber)
     
     def _get_result(self): return self._get_db().use_result()
 
@@ -416,6 +619,8 @@ class CursorUseResultMixIn(object):
         return r
 
     def __iter__(self):
+        if self.batched_iteration:
+            return self.iterbatched()
         return self
 
     def next(self):
@@ -423,6 +628,37 @@ class CursorUseResultMixIn(object):
         if row is None:
             raise StopIteration
         return row
+
+    def iterbatched(self):
+        """Iterate over the remaining rows, fetching them from _mysql
+        in blocks. The block size starts at arraysize and is then tuned
+        from the width of the rows seen so that a block holds about
+        iter_block_bytes of data. rownumber counts the rows fetched, so
+        it runs ahead of the rows consumed by up to one block.
+        Non-standard extension."""
+        self._check_executed()
+        block_rows = self.arraysize
+        while 1:
+            rows = self._fetch_row(block_rows)
+            if not rows:
+                self._warning_check()
+                return
+            self.rownumber = self.rownumber + len(rows)
+            block_rows = self._iter_block_rows(rows[0])
+            for row in rows:
+                yield row
+
+    def _iter_block_rows(self, row):
+        if isinstance(row, dict):
+            row = row.values()
+        width = 0
+        for value in row:
+            if isinstance(value, basestring):
+                width = width + len(value)
+            else:
+                width = width + 8
+        return max(1, min(self.max_iter_block_rows,
+                          self.iter_block_bytes / max(width, 1)))
     
 
 class CursorTupleRowsMixIn(object):
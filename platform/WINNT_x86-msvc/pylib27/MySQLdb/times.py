@@ -41,7 +41,45 @@ def format_TIMESTAMP(d):
     return d.strftime("%Y-%m-%d %H:%M:%S")
 
 
+# Results tend to repeat dates, so the parsed date parts (and date
+# objects, which are immutable) are memoised by their text. The caches
+# are simply emptied when they grow past _cache_size.
+_cache_size = 4096
+_date_parts_cache = {}
+_date_cache = {}
+
+def _date_parts(s):
+    """Return (year, month, day) for the 'YYYY-MM-DD' text s."""
+    parts = _date_parts_cache.get(s)
+    if parts is None:
+        parts = int(s[:4]), int(s[5:7]), int(s[8:10])
+        if len(_date_parts_cache) >= _cache_size:
+            _date_parts_cache.clear()
+        _date_parts_cache[s] = parts
+    return parts
+
+def _microseconds(frac):
+    # frac is the text after the decimal point, up to 6 digits.
+    return int((frac + '000000')[:6])
+
 def DateTime_or_None(s):
+    # Fast path for the canonical 'YYYY-MM-DD HH:MM:SS[.ffffff]'.
+    n = len(s)
+    if (19 <= n <= 26 and s[4] == '-' and s[7] == '-' and s[10] in ' T'
+        and s[13] == ':' and s[16] == ':' and (n == 19 or s[19] == '.')):
+        try:
+            year, month, day = _date_parts(s[:10])
+            if n > 20:
+                microsecond = _microseconds(s[20:])
+            else:
+                microsecond = 0
+            return datetime(year, month, day, int(s[11:13]), int(s[14:16]),
+                            int(s[17:19]), microsecond)
+        except ValueError:
+            pass
+    return _DateTime_or_None(s)
+
+def _DateTime_or_None(s):
     if ' ' in s:
         sep = ' '
     elif 'T' in s:
@@ -58,15 +96,19 @@ def DateTime_or_None(s):
 def TimeDelta_or_None(s):
     try:
         h, m, s = s.split(':')
-        h, m, s = int(h), int(m), float(s)
-        td = timedelta(hours=abs(h), minutes=m, seconds=int(s),
-                       microseconds=int(math.modf(s)[0] * 1000000))
-        if h < 0:
+        if '.' in s:
+            s, frac = s.split('.', 1)
+            microseconds = _microseconds(frac)
+        else:
+            microseconds = 0
+        td = timedelta(hours=abs(int(h)), minutes=int(m), seconds=int(s),
+                       microseconds=microseconds)
+        if h[:1] == '-':
             return -td
         else:
             return td
     except ValueError:
-        # unpacking or int/float conversion failed
+        # unpacking or int conversion failed
         return None
 
 def Time_or_None(s):
@@ -79,8 +121,32 @@ def Time_or_None(s):
         return None
 
 def Date_or_None(s):
-    try: return date(*[ int(x) for x in s.split('-',2)])
-    except: return None
+    d = _date_cache.get(s)
+    if d is not None:
+        return d
+    try:
+        if len(s) == 10 and s[4] == '-' and s[7] == '-':
+            d = date(*_date_parts(s))
+        else:
+            d = date(*[ int(x) for x in s.split('-',2)])
+    except:
+        return None
+    if len(_date_cache) >= _cache_size:
+        _date_cache.clear()
+    _date_cache[s] = d
+    return d
+
+def parse_column(parser, values):
+    """Parse a sequence of column values with parser (for example
+    DateTime_or_None), passing NULLs (None) through. Returns a list."""
+    result = []
+    append = result.append
+    for v in values:
+        if v is None:
+            append(None)
+        else:
+            append(parser(v))
+    return result
 
 def DateTime2literal(d, c):
     """Format a DateTime object as an ISO timestamp."""
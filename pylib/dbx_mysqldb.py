@@ -4,11 +4,16 @@
 
 """
 Code to work with MySQL databases using the
-MySQLdb library
+MySQLdb library, or dbx_mysqlproto where MySQLdb's
+_mysql can't be loaded
 """
 
-import os, sys, re
+import os, sys, re, time
+import socket as socket_module
 import logging
+import threading
+import zlib
+from collections import OrderedDict
 from contextlib import contextmanager
 
 log = logging.getLogger("dbx_mysqldb")
@@ -16,18 +21,21 @@ log = logging.getLogger("dbx_mysqldb")
 log.setLevel(logging.INFO)
 
 import dbxlib
+import dbx_mysqlproto
 try:
     import MySQLdb
-    loaded = True
-    disabled_reason = None
 except ImportError, ex:
-    sys.stderr.write("dbx_mysqldb.py: Failed to load MySQL: %s\n" % (ex,))
-    log.exception("Failed to load MySQL")
-    import missingAdaptor
-    MySQLdb = missingAdaptor.MissingAdaptor()
-    MySQLdb.adaptorName = 'MySQL'
-    loaded = False
-    disabled_reason = "Couldn't find database adapter MySQLdb: %s" % (ex,)
+    # No usable _mysql: every connection uses dbx_mysqlproto.
+    log.info("Failed to load MySQLdb, using dbx_mysqlproto: %s", ex)
+    MySQLdb = None
+loaded = True
+disabled_reason = None
+
+# Both drivers raise these: dbx_mysqlproto uses MySQLdb's classes, from
+# _mysql_exceptions, whenever that can be imported.
+from dbx_mysqlproto import Error as DriverError, \
+     OperationalError as DriverOperationalError, \
+     DatabaseError as DriverDatabaseError
 
 #TODO: Lots of this is in common with postgres, so fold it
 
@@ -74,6 +82,25 @@ class Connection(object):
         self.db = dbname
         self.password = args.get('password')
         self.hasPassword = args.get('hasPassword', False)
+        # Have the driver leave DECIMAL and temporal columns as text,
+        # for callers that only display values (the explorer).
+        self.display_conversions = args.get('display_conversions', False)
+        # 'python' to use dbx_mysqlproto instead of MySQLdb's _mysql.
+        self.driver = args.get('driver') or (MySQLdb is None and 'python'
+                                             or None)
+        # With the python driver, run the explorer's repeated queries
+        # as server-side prepared statements (see Database._execute).
+        self.prepared_statements = args.get('prepared_statements', False)
+        # Talk to a server on this machine through its Unix socket.
+        self.auto_socket = args.get('auto_socket', True)
+        # Protocol compression: 'off', 'on', or 'auto' to let
+        # _compression decide from the transfers seen so far.
+        compress = args.get('compress', 'off')
+        if compress is True:
+            compress = 'on'
+        elif not compress:
+            compress = 'off'
+        self.compress = compress
 
     def getConnectionParameters(self):
         """
@@ -91,10 +118,284 @@ class Connection(object):
         val = getattr(self, 'socket', None)
         if val:
             parts['unix_socket'] = val
+        elif self.auto_socket and self.host in _local_host_names:
+            val = _localServerSocket(parts, self.driver)
+            if val:
+                # libmysqlclient only uses the socket for 'localhost'.
+                # The server then authenticates the login as
+                # user@localhost rather than user@127.0.0.1, which can
+                # be a different account; if it's refused,
+                # _openConnection goes back to TCP.
+                parts['tcp_host'] = parts.get('host')
+                parts['host'] = 'localhost'
+                parts['unix_socket'] = val
+        if self.display_conversions:
+            try:
+                from MySQLdb.converters import display_conversions
+            except ImportError:
+                pass
+            else:
+                parts['conv'] = display_conversions
+        if self.compress == 'on' or (self.compress == 'auto'
+                                     and _compression.shouldCompress(self.serverKey())):
+            if self.driver == 'python':
+                log.debug("Connection: dbx_mysqlproto can't compress")
+            else:
+                parts['compress'] = 1
+        if self.driver:
+            parts['driver'] = self.driver
         return parts
 
+    def serverKey(self):
+        return (self.host, self.socket or self.port)
+
     def getConnectionDisplayValues(self):
         return "%s@%s" % (self.user, self.host)
+
+def _payloadSize(rows, sample_limit):
+    """ Return (size, sample): about how many bytes rows took in the
+    text protocol, and up to sample_limit bytes of their values.
+    """
+    size = 0
+    sample = []
+    sample_size = 0
+    for row in rows:
+        for value in row:
+            if value is None:
+                size += 1
+                continue
+            if not isinstance(value, str):
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                else:
+                    value = str(value)
+            size += len(value) + 1
+            if sample_size < sample_limit:
+                sample.append(value)
+                sample_size += len(value)
+    return size, "".join(sample)[:sample_limit]
+
+class CompressionAdvisor(object):
+    """ Decides, per server, whether connections with compress='auto'
+    should ask for protocol compression.  It times a round trip on the
+    first connection, then records the size and time of bulk
+    transfers; zlib on a sample of each says how well the data would
+    compress.  Compression pays off when the time saved sending fewer
+    bytes at the measured throughput is more than the time the server
+    spends compressing them.
+    """
+    # Don't decide on less data than this.
+    min_sample_bytes = 256 * 1024
+    # About how fast a server compresses result data.
+    compress_rate = 30 * 1024 * 1024
+    sample_limit = 64 * 1024
+
+    def __init__(self):
+        self._servers = {}
+        self._lock = threading.Lock()
+
+    def _server(self, key):
+        # Called with self._lock held.
+        server = self._servers.get(key)
+        if server is None:
+            server = self._servers[key] = {
+                'round_trip': None,
+                'bytes': 0,
+                'seconds': 0.0,
+                'compressed_bytes': 0,
+                'raw_sample': 0,
+                'zipped_sample': 0,
+                }
+        return server
+
+    def needsRoundTrip(self, key):
+        with self._lock:
+            return self._server(key)['round_trip'] is None
+
+    def recordRoundTrip(self, key, seconds):
+        with self._lock:
+            server = self._server(key)
+            if server['round_trip'] is None or seconds < server['round_trip']:
+                server['round_trip'] = seconds
+
+    def recordTransfer(self, key, rows, seconds, compressed):
+        """ Note that rows took seconds to arrive, on a compressed
+        connection or not.
+        """
+        size, sample = _payloadSize(rows, self.sample_limit)
+        zipped = sample and len(zlib.compress(sample, 1)) or 0
+        with self._lock:
+            server = self._server(key)
+            server['raw_sample'] += len(sample)
+            server['zipped_sample'] += zipped
+            if compressed:
+                server['compressed_bytes'] += size
+            else:
+                # Throughput is measured net of the round trip.
+                server['bytes'] += size
+                server['seconds'] += max(seconds - (server['round_trip'] or 0), 0)
+
+    def _ratio(self, server):
+        if not server['raw_sample']:
+            return 1.0
+        return float(server['zipped_sample']) / server['raw_sample']
+
+    def _shouldCompress(self, server):
+        if server['bytes'] < self.min_sample_bytes or server['seconds'] <= 0:
+            return False
+        throughput = server['bytes'] / server['seconds']
+        return (1 - self._ratio(server)) / throughput > 1.0 / self.compress_rate
+
+    def shouldCompress(self, key):
+        with self._lock:
+            server = self._servers.get(key)
+            return server is not None and self._shouldCompress(server)
+
+    def getStats(self, key):
+        """ Return the measurements for the server.  bytes_saved
+        estimates what compression saved on compressed connections;
+        possible_savings, what it would have saved on the others.
+        """
+        with self._lock:
+            server = self._server(key)
+            ratio = self._ratio(server)
+            throughput = None
+            if server['seconds'] > 0:
+                throughput = server['bytes'] / server['seconds']
+            return {'round_trip': server['round_trip'],
+                    'throughput': throughput,
+                    'compression_ratio': ratio,
+                    'bytes_received': server['bytes'] + server['compressed_bytes'],
+                    'bytes_saved': int(server['compressed_bytes'] * (1 - ratio)),
+                    'possible_savings': int(server['bytes'] * (1 - ratio)),
+                    'compressing': self._shouldCompress(server)}
+
+_compression = CompressionAdvisor()
+
+def _openConnection(params, driver=None):
+    """ Connect with params.  If they name a socket found by
+    _localServerSocket (and so hold the 'tcp_host' it replaced) and
+    the connection through it fails, forget the socket and connect
+    over TCP instead.
+    """
+    params = dict(params)
+    tcp_host = params.pop('tcp_host', None)
+    if driver == 'python' or MySQLdb is None:
+        connect = dbx_mysqlproto.connect
+    else:
+        connect = MySQLdb.connect
+    try:
+        return apply(connect, (), params)
+    except DriverOperationalError, ex:
+        if tcp_host is None:
+            raise
+        log.info("_openConnection: can't use socket %s, using TCP: %s",
+                 params['unix_socket'], ex)
+    del params['unix_socket']
+    params['host'] = tcp_host
+    _forgetLocalSocket(params)
+    return apply(connect, (), params)
+
+# Finding the Unix socket of a local server
+
+_local_host_names = ('localhost', '127.0.0.1')
+
+# Where the common packagings put the socket.
+_socket_candidates = [
+    '/var/run/mysqld/mysqld.sock',
+    '/run/mysqld/mysqld.sock',
+    '/var/lib/mysql/mysql.sock',
+    '/tmp/mysql.sock',
+    '/usr/local/var/mysql/mysql.sock',
+    '/opt/local/var/run/mysql5/mysqld.sock',
+    '/Applications/MAMP/tmp/mysql/mysql.sock',
+    ]
+
+_option_files = ['/etc/my.cnf', '/etc/mysql/my.cnf', '/usr/local/etc/my.cnf',
+                 '~/.my.cnf']
+
+# (host, port, user) => socket path, or None if there's no usable one.
+_local_sockets = {}
+_local_sockets_lock = threading.Lock()
+
+def _optionFileSockets():
+    """ Return the socket settings from the [client] and [mysqld]
+    groups of the usual option files.  Parsed by hand: option files
+    have bare keys and !include lines that ConfigParser rejects.
+    """
+    sockets = []
+    for path in _option_files:
+        path = os.path.expanduser(path)
+        try:
+            f = open(path)
+        except IOError:
+            continue
+        try:
+            group = None
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    group = line.strip('[]').strip().lower()
+                elif group in ('client', 'mysqld', 'mysql'):
+                    m = re.match(r'socket\s*=\s*(.*)', line)
+                    if m:
+                        sockets.append(m.group(1).strip().strip('"\''))
+        finally:
+            f.close()
+    return sockets
+
+def _localSocketKey(params):
+    return (params.get('host'), params.get('port') or 3306, params.get('user'))
+
+def _forgetLocalSocket(params):
+    """ Stop using the socket found for the TCP parameters params."""
+    with _local_sockets_lock:
+        _local_sockets.pop(_localSocketKey(params), None)
+
+def _localServerSocket(params, driver=None):
+    """ Return the path of a Unix socket for the server the TCP
+    parameters params lead to, or None.  A candidate socket is only
+    used if the server behind it says it listens on the same port.
+    The answer is cached for the process.
+    """
+    if not hasattr(socket_module, 'AF_UNIX'):
+        return None
+    port = params.get('port') or 3306
+    key = _localSocketKey(params)
+    with _local_sockets_lock:
+        if key in _local_sockets:
+            return _local_sockets[key]
+    found = None
+    seen = set()
+    for path in _optionFileSockets() + _socket_candidates:
+        if path in seen or not os.path.exists(path):
+            continue
+        seen.add(path)
+        socket_params = dict(params)
+        socket_params['host'] = 'localhost'
+        socket_params['unix_socket'] = path
+        socket_params['connect_timeout'] = 2
+        try:
+            conn = _openConnection(socket_params, driver)
+            try:
+                cu = conn.cursor()
+                cu.execute("select @@port")
+                server_port = int(cu.fetchone()[0])
+                cu.close()
+            finally:
+                conn.close()
+        except DriverError, ex:
+            log.debug("_localServerSocket: can't use %s: %s", path, ex)
+            continue
+        if server_port == int(port):
+            found = path
+            break
+        log.debug("_localServerSocket: %s is the server on port %d",
+                  path, server_port)
+    log.info("_localServerSocket: %s:%s => %s", key[0], port, found)
+    with _local_sockets_lock:
+        _local_sockets[key] = found
+    return found
         
 class ColumnInfo(object):
     def __init__(self, name, type, nullable, default_value,
@@ -140,22 +441,513 @@ class ColumnInfo(object):
     def id_from_name(self, prettyName):
         return self.prettyName_to_attrName.get(prettyName, prettyName)
 
-class OperationalError(MySQLdb.OperationalError):
+def _formatInt(value):
+    if value is None:
+        return ""
+    try:
+        return "%d" % value
+    except TypeError:
+        log.error("Can't append value as int: %r", value)
+        return "%r" % value
+
+def _formatFloat(value):
+    if value is None:
+        return ""
+    return "%g" % value
+
+def _formatString(value):
+    return value
+
+def _formatText(value):
+    if value is None:
+        return ""
+    return str(value)
+
+def _formatSet(value):
+    if value is None:
+        return ""
+    return ",".join(sorted(value))
+
+def _formatBlob(value):
+    # To get the data of a blob:
+    # len(value) => size, str(value) => str repr,
+    # but how would we know how to represent it?
+    if value is None:
+        log.info("blob data is: None")
+        value = ""
+    return "<BLOB: %d chars>" % (len(value),)
+
+_unformatted = object()
+
+# FIELD_TYPE class => _fieldTypes dict
+_field_types = {}
+
+# The character set number of binary strings.
+_BINARY_CHARSET = 63
+
+def _driverConstants(driver):
+    """ Return the FIELD_TYPE and FLAG classes of driver's module. """
+    if driver == 'python' or MySQLdb is None:
+        return dbx_mysqlproto.FIELD_TYPE, dbx_mysqlproto.FLAG
+    from MySQLdb.constants import FIELD_TYPE, FLAG
+    return FIELD_TYPE, FLAG
+
+def _fieldTypes(driver=None):
+    """ Return a dict mapping driver's FIELD_TYPE codes to the
+    (type name, formatter) used for result columns of that type.
+    """
+    FIELD_TYPE = _driverConstants(driver)[0]
+    field_types = _field_types.get(FIELD_TYPE)
+    if field_types is None:
+        field_types = _field_types[FIELD_TYPE] = {
+            FIELD_TYPE.TINY: ('int', _formatInt),
+            FIELD_TYPE.SHORT: ('int', _formatInt),
+            FIELD_TYPE.LONG: ('int', _formatInt),
+            FIELD_TYPE.INT24: ('int', _formatInt),
+            FIELD_TYPE.LONGLONG: ('int', _formatInt),
+            FIELD_TYPE.YEAR: ('int', _formatInt),
+            FIELD_TYPE.FLOAT: ('float', _formatFloat),
+            FIELD_TYPE.DOUBLE: ('float', _formatFloat),
+            FIELD_TYPE.DECIMAL: ('decimal', _formatText),
+            FIELD_TYPE.NEWDECIMAL: ('decimal', _formatText),
+            FIELD_TYPE.DATE: ('date', _formatText),
+            FIELD_TYPE.NEWDATE: ('date', _formatText),
+            FIELD_TYPE.TIME: ('time', _formatText),
+            FIELD_TYPE.DATETIME: ('datetime', _formatText),
+            FIELD_TYPE.TIMESTAMP: ('timestamp', _formatText),
+            FIELD_TYPE.VARCHAR: ('varchar', _formatString),
+            FIELD_TYPE.VAR_STRING: ('varchar', _formatString),
+            FIELD_TYPE.STRING: ('char', _formatString),
+            FIELD_TYPE.ENUM: ('enum', _formatString),
+            FIELD_TYPE.SET: ('set', _formatSet),
+            FIELD_TYPE.TINY_BLOB: ('text', _formatString),
+            FIELD_TYPE.MEDIUM_BLOB: ('text', _formatString),
+            FIELD_TYPE.LONG_BLOB: ('text', _formatString),
+            FIELD_TYPE.BLOB: ('text', _formatString),
+            FIELD_TYPE.NULL: ('null', _formatText),
+            }
+    return field_types
+
+class LazyRow(object):
+    """ A fetched row that formats a cell for display only when the cell
+    is read, and remembers the result.  The grid shows a few dozen rows
+    at a time, so most cells of a large result are never formatted.
+    Behaves as a read-only sequence of strings.
+    """
+    __slots__ = ('_formatters', '_values', '_cells')
+
+    def __init__(self, formatters, values):
+        self._formatters = formatters
+        self._values = values
+        self._cells = None
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(len(self._values)))]
+        cells = self._cells
+        if cells is None:
+            cells = self._cells = [_unformatted] * len(self._values)
+        cell = cells[idx]
+        if cell is _unformatted:
+            cell = cells[idx] = self._formatters[idx](self._values[idx])
+        return cell
+
+    def __iter__(self):
+        for idx in xrange(len(self._values)):
+            yield self[idx]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "LazyRow(%r)" % (list(self),)
+
+    def getRawValue(self, idx):
+        """ Return the cell's value as the driver returned it."""
+        return self._values[idx]
+
+class RowCache(object):
+    """ An LRU cache of converted rows, keyed by
+    (table name, primary key values as text, convert_blob_values).
+    Entries older than ttl seconds are treated as misses.  Writes drop
+    all of a table's entries: under a case-insensitive collation the
+    key text a statement names needn't match the text rows are cached
+    under.
+    """
+    def __init__(self, max_size=1000, ttl=30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            entry = self._entries.pop(cache_key, None)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            # Re-insert to mark it most recently used.
+            self._entries[cache_key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, cache_key, str_items):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(cache_key, None)
+            self._entries[cache_key] = (time.time(), str_items)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidateTable(self, table_name=None):
+        """ Drop the entries of table_name, or all entries if it's None."""
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+                return
+            for cache_key in self._entries.keys():
+                if cache_key[0] == table_name:
+                    del self._entries[cache_key]
+
+    def getStats(self):
+        with self._lock:
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+def _keyText(value):
+    # Key values come back from the UI as text, but from the
+    # database typed, so compare them as strings.
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class ConnectionPool(object):
+    """ Idle MySQLdb connections kept for reuse by Database.connect,
+    up to max_idle per set of connection parameters.  A connection idle
+    for more than ping_after seconds is pinged before it's handed out.
+    """
+    def __init__(self, max_idle=4, ping_after=60.0):
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _key(self, params):
+        # The conversions dict isn't hashable, but is a module global.
+        return tuple(sorted([(k, v) for k, v in params.items()
+                             if k != 'conv'])) + (id(params.get('conv')),)
+
+    def get(self, params):
+        key = self._key(params)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                conn, last_used = idle.pop()
+            if time.time() - last_used < self.ping_after:
+                return conn
+            try:
+                conn.ping()
+                return conn
+            except DriverError:
+                self.discard(conn)
+        params = dict(params)
+        return _openConnection(params, params.pop('driver', None))
+
+    def put(self, params, conn):
+        key = self._key(params)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.time()))
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except DriverError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            idle_lists = self._idle.values()
+            self._idle = {}
+        for idle in idle_lists:
+            for conn, last_used in idle:
+                self.discard(conn)
+
+_pool = ConnectionPool()
+
+class MetadataBatch(object):
+    """ Queue up metadata queries and send them to the server as a single
+    multi-statement packet, one round trip in all.  The connection is
+    opened with CLIENT.MULTI_STATEMENTS | MULTI_RESULTS, and the result
+    sets come back in order, reached with cursor.nextset().
+
+    Only use this for SELECTs built by this module: the statements are
+    joined with ';' so none of them may contain one.
+    """
+    def __init__(self):
+        self._queries = []
+
+    def __len__(self):
+        return len(self._queries)
+
+    def add(self, query):
+        """ Queue query, returning the index of its rows in run()'s result.
+        """
+        if ';' in query:
+            raise Exception("Unsafe metadata query: %s" % (query,))
+        self._queries.append(query)
+        return len(self._queries) - 1
+
+    def run(self, cu):
+        """ Run the queued queries on cursor cu, and return a list holding
+        the rows of each one.  The queue is emptied.
+        """
+        queries, self._queries = self._queries, []
+        if not queries:
+            return []
+        cu.execute(";\n".join(queries))
+        results = [list(cu.fetchall())]
+        # Read every result set, or the connection is left out of sync.
+        while cu.nextset():
+            if len(results) < len(queries):
+                results.append(list(cu.fetchall()))
+        if len(results) != len(queries):
+            raise DatabaseError("Expected %d result sets, got %d"
+                                % (len(queries), len(results)))
+        return results
+
+
+class _DescribedColumnInfoBlock(list):
+    """ A list of ColumnInfo built from a cursor's description, carrying
+    the cell formatters chosen from the FIELD_TYPE codes.
+    """
+    def __init__(self):
+        list.__init__(self)
+        self.formatters = []
+
+class _CustomQueryCursor(object):
+    """ The cursor connect() hands dbxlib's runCustomQuery.  Rows come
+    back as LazyRows formatted by the result's own description, so
+    custom queries and joins get the same cells as table views without
+    any information_schema lookups.
+    """
+    def __init__(self, db, cursor):
+        self._db = db
+        self._cursor = cursor
+        self._col_info_block = None
+        # (seconds, rows) of the current result, for the compression
+        # advisor.  The cursor is buffered, so the time is the time
+        # execute() or nextset() took to read the whole result.  Only
+        # kept when the advisor is used: it holds a second reference
+        # to every row.
+        self._transfer = None
+        self._measure = db.connection.compress != 'off'
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, args=None):
+        self.recordTransfer()
+        self._col_info_block = None
+        started = time.time()
+        res = self._cursor.execute(query, args)
+        if self._measure:
+            self._transfer = (time.time() - started, [])
+        return res
+
+    def nextset(self):
+        self.recordTransfer()
+        self._col_info_block = None
+        started = time.time()
+        res = self._cursor.nextset()
+        if self._measure:
+            self._transfer = (time.time() - started, [])
+        return res
+
+    def recordTransfer(self):
+        """ Report the rows fetched from the current result."""
+        if self._transfer is not None:
+            seconds, rows = self._transfer
+            self._transfer = None
+            if rows:
+                self._db._recordTransfer(self._cursor, rows, seconds)
+
+    def _convertRows(self, rows):
+        cursor = self._cursor
+        if not rows:
+            self.recordTransfer()
+            return rows
+        if not cursor.description:
+            return rows
+        if self._transfer is not None:
+            self._transfer[1].extend(rows)
+        if self._col_info_block is None:
+            self._col_info_block = self._db.getColumnInfoFromCursor(cursor)
+        col_info_block = self._col_info_block
+        convert = self._db._convert
+        return [convert(col_info_block, row) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            self.recordTransfer()
+            return None
+        return self._convertRows([row])[0]
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self._cursor.arraysize
+        return self._convertRows(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        rows = self._convertRows(self._cursor.fetchall())
+        self.recordTransfer()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+class _FetchedCursor(object):
+    """ The cursor connect() hands dbxlib's runCustomQuery during
+    replayCustomQuery.  execute() doesn't run anything: it starts over
+    on the results already fetched, whose rows are lists or a
+    dbx_mysqldb_worker.WorkerResult.
+    """
+    arraysize = 1
+
+    def __init__(self, results):
+        self._results = results
+        self._index = -1
+        self._rows = []
+        self._pos = 0
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, query, args=None):
+        self._index = -1
+        self.nextset()
+        return self.rowcount
+
+    def nextset(self):
+        self._index += 1
+        self._pos = 0
+        if self._index >= len(self._results):
+            self.description, self._rows = None, []
+            return None
+        (self.description, self.rowcount, self.lastrowid,
+         self._rows) = self._results[self._index]
+        return 1
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        pass
+
+class OperationalError(DriverOperationalError):
     pass
 
-class DatabaseError(MySQLdb.DatabaseError):
+class DatabaseError(DriverDatabaseError):
     pass
 
+# Errors raised in the worker and broker processes come back as
+# (kind, args); only MySQL errors are raised again as ours.
+
+def errorKind(ex):
+    if isinstance(ex, DriverOperationalError):
+        return 'OperationalError'
+    elif isinstance(ex, DriverError):
+        return 'DatabaseError'
+    return ex.__class__.__name__
+
+def raiseRemoteError(kind, args, other_class):
+    if kind == 'OperationalError':
+        raise OperationalError(*args)
+    elif kind == 'DatabaseError':
+        raise DatabaseError(*args)
+    raise other_class("%s: %s" % (kind, ", ".join([str(arg) for arg in args])))
+
+_python_executable = None
+
+def pythonExecutable():
+    """ The Python to run the worker and broker scripts with.  Inside
+    Komodo, sys.executable is Komodo itself, so use the Python that
+    Komodo ships; elsewhere sys.executable is Python.
+    """
+    global _python_executable
+    if _python_executable is None:
+        try:
+            from xpcom import components
+        except ImportError:
+            _python_executable = sys.executable
+        else:
+            koDirs = components.classes["@activestate.com/koDirs;1"].\
+                     getService(components.interfaces.koIDirs)
+            _python_executable = koDirs.pythonExe
+    return _python_executable
+
 class Database(dbxlib.CommonDatabase):
     # args should be: host, username=None, password=None, port=None
     handles_prepared_stmts = False
     def __init__(self, args, dbname=None):
         self._dbname = dbname
         self.connection = Connection(dbname, args)
+        # Set while a thread runs custom SQL through dbxlib, which opens
+        # its connection with a plain connect(): custom SQL may change
+        # session state (USE, SET ...), so that connection isn't pooled.
+        self._custom_sql = threading.local()
+        # With worker_process, custom queries run in a child process
+        # (dbx_mysqldb_worker) given these args.
+        self._worker_args = None
+        if args.get('worker_process'):
+            self._worker_args = dict([(k, v) for k, v in args.items()
+                                      if k != 'worker_process'])
         self._init_db()
 
     def _init_db(self):
         self.col_info_from_table_name = {}
+        self._raw_row_converters = {}
+        self._cell_formatters = {}
+        self._primary_key_columns = {}
+        self._row_cache = RowCache()
 
     def _qualifyTableName(self, table_name):
         # MySQL doesn't use quotes.
@@ -168,28 +960,97 @@ class Database(dbxlib.CommonDatabase):
         return self.connection.getConnectionDisplayValues()
         
     @contextmanager
-    def connect(self, commit=False, cu=None):
+    def connect(self, commit=False, cu=None, reuse=True):
         """ See dbx_sqlite3.py::connect docstring for full story
         @param commit {bool} 
         @param cu {sqlite3.Cursor}
+        @param reuse {bool} false if the body may leave session state
+                            behind, so the connection mustn't be pooled
         """
+        replay = getattr(self._custom_sql, 'replay', None)
         if cu is not None:
             yield cu
+        elif replay is not None:
+            # replayCustomQuery: dbxlib reads results already fetched.
+            self._custom_sql.replay = None
+            try:
+                yield replay
+            finally:
+                self._custom_sql.replay = replay
         else:
             params = self.connection.getConnectionParameters()
+            compressed = bool(params.get('compress'))
             try:
-                conn = apply(MySQLdb.connect, (), params)
+                conn = _pool.get(params)
             except:
-                log.exception("Failed to connect to mysql, with params:%s", params)
+                log.exception("Failed to connect to mysql, with params:%s",
+                              dict([(k, v) for k, v in params.items()
+                                    if k != 'conv']))
                 raise
+            if (self.connection.compress == 'auto'
+                and _compression.needsRoundTrip(self.connection.serverKey())):
+                started = time.time()
+                conn.ping()
+                _compression.recordRoundTrip(self.connection.serverKey(),
+                                             time.time() - started)
+            # The pool is keyed on the parameters, so this holds for
+            # whichever pooled connection came back.
+            conn._dbx_compressed = compressed
             cu = conn.cursor()
+            custom_sql = getattr(self._custom_sql, 'active', False)
+            custom_cu = None
+            # Only connections that come back in a known state are reused.
+            reuse, body_reuse = False, reuse
             try:
-                yield cu
+                if custom_sql:
+                    custom_cu = _CustomQueryCursor(self, cu)
+                    # Only the query's own cursor is wrapped: lookups
+                    # made while its rows are converted get plain ones.
+                    self._custom_sql.active = False
+                    try:
+                        yield custom_cu
+                    finally:
+                        self._custom_sql.active = True
+                else:
+                    yield cu
+                reuse = body_reuse and not custom_sql
             finally:
-                if commit:
-                    conn.commit()
-                cu.close()
-                conn.close()
+                if custom_cu is not None:
+                    custom_cu.recordTransfer()
+                try:
+                    if commit:
+                        conn.commit()
+                    else:
+                        # End the read snapshot before the next user.
+                        conn.rollback()
+                    cu.close()
+                except DriverError:
+                    reuse = False
+                if reuse:
+                    _pool.put(params, conn)
+                else:
+                    _pool.discard(conn)
+
+    def streamingCursor(self, cu):
+        """ Return an unbuffered cursor (SSCursor) on cu's connection,
+        for whichever driver the connection uses.
+        """
+        if self.connection.driver == 'python':
+            import dbx_mysqlproto
+            return cu.connection.cursor(dbx_mysqlproto.SSCursor)
+        import MySQLdb.cursors
+        return cu.connection.cursor(MySQLdb.cursors.SSCursor)
+
+    def _execute(self, cu, query, args=()):
+        """ cu.execute(query, args), or, with the prepared_statements
+        connection argument and a driver that has them (dbx_mysqlproto),
+        the same through a prepared statement, which the pooled
+        connection keeps for the next call with the same query.
+        """
+        if (self.connection.prepared_statements
+            and hasattr(cu, 'execute_prepared')):
+            return cu.execute_prepared(query, args)
+        return cu.execute(query, args)
 
     # get metadata about the database and tables
 
@@ -202,55 +1063,57 @@ class Database(dbxlib.CommonDatabase):
                 cu.execute(query)
                 names = [row[0] for row in cu.fetchall()]
                 return names
-        except MySQLdb.OperationalError, ex:
+        except DriverOperationalError, ex:
             raise OperationalError(ex)
-        except MySQLdb.DatabaseError, ex:
+        except DriverDatabaseError, ex:
             raise DatabaseError(ex)
                 
     def listAllTablePartsByType(self, typeName):
         try:
             query = """select table_name
                        from information_schema.tables
-                       where table_type = '%s'
-                         and table_schema = '%s' """ % (typeName,
-                                                        self._dbname)
+                       where table_type = %s
+                         and table_schema = %s"""
             with self.connect() as cu:
-                cu.execute(query)
+                self._execute(cu, query, (typeName, self._dbname))
                 names = [row[0] for row in cu.fetchall()]
                 return names
-        except MySQLdb.OperationalError, ex:
+        except DriverOperationalError, ex:
             raise OperationalError(ex)
-        except MySQLdb.DatabaseError, ex:
+        except DriverDatabaseError, ex:
             raise DatabaseError(ex)
         
     def listAllTableNames(self, dbname):
         try:
             query = """select table_name
                        from information_schema.tables
-                       where table_type = '%s'
-                         and table_schema = '%s' """ % ('BASE TABLE',
-                                                        dbname)
+                       where table_type = 'BASE TABLE'
+                         and table_schema = %s"""
             with self.connect() as cu:
-                cu.execute(query)
+                self._execute(cu, query, (dbname,))
                 names = [row[0] for row in cu.fetchall()]
                 return names
-        except MySQLdb.OperationalError, ex:
+        except DriverOperationalError, ex:
             raise OperationalError(ex)
-        except MySQLdb.DatabaseError, ex:
+        except DriverDatabaseError, ex:
             raise DatabaseError(ex)
         
     def listAllColumnNames(self, dbname, table_name):
+        if (dbname == self._dbname
+            and table_name in self.col_info_from_table_name):
+            return [col_info.name for col_info
+                    in self.col_info_from_table_name[table_name]]
         try:
             query = ("select column_name from information_schema.columns "
-                     + "where table_schema = '%s' "
-                     + " and table_name = '%s'") % (dbname, table_name)
+                     + "where table_schema = %s "
+                     + " and table_name = %s")
             with self.connect() as cu:
-                cu.execute(query)
+                self._execute(cu, query, (dbname, table_name))
                 names = [row[0] for row in cu.fetchall()]
                 return names
-        except MySQLdb.OperationalError, ex:
+        except DriverOperationalError, ex:
             raise OperationalError(ex)
-        except MySQLdb.DatabaseError, ex:
+        except DriverDatabaseError, ex:
             raise DatabaseError(ex)
 
     def listAllIndexNames(self):
@@ -261,15 +1124,10 @@ class Database(dbxlib.CommonDatabase):
 
     #TODO: Add views
     
-    def _save_table_info(self, table_name):
+    def _tableInfoQueries(self, table_name):
         if ';' in table_name:
             raise Exception("Unsafe table_name: %s" % (table_name,))
-        import pprint
-        if table_name in self.col_info_from_table_name:
-            log.debug("_save_table_info: #1 returning %s", pprint.pformat(self.col_info_from_table_name[table_name]))
-            return self.col_info_from_table_name[table_name]
         # First determine which columns are indexed
-        indexed_columns = {}
         index_query = ("select column_name "
                        + "from information_schema.columns "
                        + "where table_name='%s' and table_schema = '%s' "
@@ -279,100 +1137,349 @@ class Database(dbxlib.CommonDatabase):
                       + "from information_schema.columns "
                       + "where table_name='%s' and table_schema = '%s' "
                       + "ORDER BY ordinal_position") % (table_name, self._dbname)
-        with self.connect() as cu:
-            cu.execute(index_query)
-            log.debug("save_table_info: index_query: %s", index_query)
-            for row in cu.fetchall():
-                log.debug("save_table_info: index_query: got row: %s", row)
-                indexed_columns[row[0]] = True
-                
-            cu.execute(main_query)
-            col_info = []
-            log.debug("save_table_info: main_query: rowcount: %d", cu.rowcount)
-            for row in cu.fetchall():
-                log.debug("save_table_info: appending raw row: %s", row)
-                lrow = list(row)
-                lrow.append(indexed_columns.get(row[0], False))
-                log.debug("save_table_info: appending row: %s", lrow)
-                col_info.append(ColumnInfo(*lrow))
-        self.col_info_from_table_name[table_name] = col_info
+        return index_query, main_query
+
+    def _tableInfoFromRows(self, index_rows, main_rows):
+        indexed_columns = {}
+        for row in index_rows:
+            log.debug("save_table_info: index_query: got row: %s", row)
+            indexed_columns[row[0]] = True
+        col_info = []
+        for row in main_rows:
+            log.debug("save_table_info: appending raw row: %s", row)
+            lrow = list(row)
+            lrow.append(indexed_columns.get(row[0], False))
+            log.debug("save_table_info: appending row: %s", lrow)
+            col_info.append(ColumnInfo(*lrow))
+        return col_info
+
+    def _save_table_info(self, table_name):
+        import pprint
+        if table_name in self.col_info_from_table_name:
+            log.debug("_save_table_info: #1 returning %s", pprint.pformat(self.col_info_from_table_name[table_name]))
+            return self.col_info_from_table_name[table_name]
+        self.prefetchTableInfo([table_name])
+        col_info = self.col_info_from_table_name[table_name]
         log.debug("_save_table_info: #2 table_name: %s, returning %s", table_name,
                   pprint.pformat(col_info))
         return col_info
 
+    def _primaryKeyColumns(self, table_name):
+        """ Return the (index, name) of each primary key column.  The row
+        cache is keyed on these.
+        """
+        columns = self._primary_key_columns.get(table_name)
+        if columns is None:
+            columns = [(idx, col_info.name) for idx, col_info
+                       in enumerate(self._save_table_info(table_name))
+                       if col_info.is_primary_key]
+            self._primary_key_columns[table_name] = columns
+        return columns
+
+    def prefetchTableInfo(self, table_names):
+        """ Load the column info of all the given tables that aren't cached
+        yet, in a single round trip to the server.
+        """
+        batch = MetadataBatch()
+        pending = []
+        for table_name in table_names:
+            if (table_name in self.col_info_from_table_name
+                or table_name in [name for name, idx in pending]):
+                continue
+            index_query, main_query = self._tableInfoQueries(table_name)
+            log.debug("save_table_info: index_query: %s", index_query)
+            idx = batch.add(index_query)
+            batch.add(main_query)
+            pending.append((table_name, idx))
+        if not pending:
+            return
+        with self.connect() as cu:
+            results = batch.run(cu)
+        for table_name, idx in pending:
+            self.col_info_from_table_name[table_name] = \
+                self._tableInfoFromRows(results[idx], results[idx + 1])
+
     def _typeForMySQL(self, typeName):
         return typeName in ('date', 'datetime', 'point')
     
-    def _convert(self, col_info_block, row_data):
-        """ Convert each item into a string.  Then return an array of items.
+    def _cellFormatter(self, col_info):
+        """ Return the function that turns a value of this column into
+        the string the grid shows.
         """
-        new_row_data = []
-        idx = 0
-        for value in row_data:
-            col_info = col_info_block[idx]
-            type = col_info.type.lower()
-            log.debug("_convert: value: %s, type:%s", value, type)
-            if type == u'int':
-                if value is None:
-                    new_row_data.append("")
+        type = col_info.type.lower()
+        if type == u'int':
+            return _formatInt
+        elif type == u'float':
+            return _formatFloat
+        elif (type in (u'string', u'text', u'enum')
+              or 'varchar' in type
+              or type.startswith('char')
+              or type.startswith('character')):
+            return _formatString
+        elif self._typeForMySQL(type):
+            return str
+        elif type in ('decimal', 'numeric', 'time', 'timestamp'):
+            return _formatText
+        elif type == 'blob':
+            return _formatBlob
+        else:
+            log.debug("  unrecognized type: %s", type)
+            if not _unrec_types.has_key(type):
+                log.info("While converting MySQL values: column %s has an unrecognized type of %s", col_info.column_name, type)
+                _unrec_types[type] = 1
+            return repr
+
+    def getColumnInfoFromCursor(self, cu):
+        """ Return a ColumnInfo block for the result cu holds, built from
+        cu.description and cu.description_flags, so custom queries and
+        joins need no information_schema lookups.  _convert formats rows
+        for these blocks by the driver's FIELD_TYPE and FLAG codes.
+        runCustomQuery's rows and the worker's results are converted
+        this way.
+        """
+        FLAG = _driverConstants(self.connection.driver)[1]
+        field_types = _fieldTypes(self.connection.driver)
+        flags_list = cu.description_flags or [0] * len(cu.description)
+        # Only dbx_mysqlproto reports the character sets.
+        charsets = getattr(cu, 'description_charsets', None)
+        col_info_block = _DescribedColumnInfoBlock()
+        formatters = col_info_block.formatters
+        for idx, (desc, flags) in enumerate(zip(cu.description, flags_list)):
+            name, type_code, display_size, internal_size = desc[:4]
+            type_name, formatter = field_types.get(type_code,
+                                                   ('unknown', repr))
+            if type_name in ('text', 'char', 'varchar'):
+                # BLOB, BINARY and VARBINARY rather than text.  The
+                # BINARY flag is also set for text in a _bin collation,
+                # so without the character set, it's only believed for
+                # the BLOB types.
+                if charsets:
+                    is_binary = charsets[idx] == _BINARY_CHARSET
                 else:
-                    try:
-                        new_row_data.append("%d" % value)
-                    except TypeError:
-                        log.error("Can't append value as int: %r", value)
-                        new_row_data.append("%r" % value)
-            elif type == u'float':
-                new_row_data.append("%g" % value)
-            elif (type in (u'string', u'text', u'enum')
-                  or 'varchar' in type
-                  or type.startswith('char')
-                  or type.startswith('character')):
-                new_row_data.append(value)
-            elif self._typeForMySQL(type):
-                new_row_data.append(str(value))
-            elif type == 'blob':
-                # To get the data of a blob:
-                # len(value) => size, str(value) => str repr,
-                # but how would we know how to represent it?
-                if value is None:
-                    log.info("blob data is: None")
-                    value = ""
-                new_row_data.append("<BLOB: %d chars>" % (len(value),))
-            else:
-                log.debug("  unrecognized type: %s", type)
-                if not _unrec_types.has_key(type):
-                    log.info("While converting MySQL values: column %s has an unrecognized type of %s", col_info.column_name, type)
-                    _unrec_types[type] = 1
-                new_row_data.append('%r' % value)
-            idx += 1
-        return new_row_data
+                    is_binary = type_name == 'text' and flags & FLAG.BINARY
+                if is_binary:
+                    type_name, formatter = 'blob', _formatBlob
+            col_info_block.append(ColumnInfo(name, type_name,
+                                             not (flags & FLAG.NOT_NULL),
+                                             None, internal_size,
+                                             flags & FLAG.PRI_KEY))
+            formatters.append(formatter)
+        return col_info_block
+
+    def _cellFormatters(self, col_info_block):
+        if isinstance(col_info_block, _DescribedColumnInfoBlock):
+            return col_info_block.formatters
+        # Keyed by id, holding on to the block so the id stays unique.
+        entry = self._cell_formatters.get(id(col_info_block))
+        if entry is None:
+            entry = (col_info_block,
+                     [self._cellFormatter(col_info) for col_info in col_info_block])
+            self._cell_formatters[id(col_info_block)] = entry
+        return entry[1]
+
+    def _convert(self, col_info_block, row_data):
+        """ Return the row as a LazyRow: each item is converted into a
+        string the first time it's asked for.
+        """
+        return LazyRow(self._cellFormatters(col_info_block), row_data)
 
     def _convertAndJoin(self, names, sep):
         # Return a string of form <<"name1 = ? <sep> name2 = ? ...">>
         return sep.join([("%s = %%s" % name) for name in names])
             
+    def _rawRowConverter(self, table_name, convert_blob_values=True):
+        """ Return a function that turns a fetched row into the list of
+        strings getRawRow hands back.  Built once per table.
+        """
+        cache_key = (table_name, bool(convert_blob_values))
+        converter = self._raw_row_converters.get(cache_key)
+        if converter is not None:
+            return converter
+        if convert_blob_values:
+            col_info_block = self._save_table_info(table_name)
+            blob_indices = frozenset([idx for idx, col_info
+                                      in enumerate(col_info_block)
+                                      if columnTypeIsBlob(col_info.type)])
+        else:
+            blob_indices = frozenset()
+        def converter(row):
+            str_items = []
+            for idx, item in enumerate(row):
+                if item is None:
+                    str_items.append("")
+                elif idx in blob_indices:
+                    str_items.append("<BLOB: %d chars>" % (len(item),))
+                else:
+                    str_items.append(str(item))
+            return str_items
+        self._raw_row_converters[cache_key] = converter
+        return converter
+
     # GENERIC?
     def getRawRow(self, table_name, key_names, key_values, convert_blob_values=True):
+        cache_key = self._rowCacheKey(table_name, key_names, key_values,
+                                      convert_blob_values)
+        if cache_key is not None:
+            str_items = self._row_cache.get(cache_key)
+            if str_items is not None:
+                return len(str_items), list(str_items)
         fixed_table_name = self._qualifyTableName(table_name)
         key_names_str = self._convertAndJoin(key_names, " AND ")
         query = "select * from %s where %s" %  (fixed_table_name, key_names_str)
         with self.connect() as cu:
-            cu.execute(query, key_values)
+            self._execute(cu, query, key_values)
             row = cu.fetchone()
-        str_items = []
-        if convert_blob_values:
-            col_info_block = self._save_table_info(table_name)
-        idx = 0
-        for item in row:
-            if item is None:
-                str_items.append("")
-            elif convert_blob_values and columnTypeIsBlob(col_info_block[idx].type):
-                str_items.append("<BLOB: %d chars>" % (len(item),))
-            else:
-                str_items.append(str(item))
-            idx += 1
+        str_items = self._rawRowConverter(table_name, convert_blob_values)(row)
+        if row is not None:
+            self._cacheRow(table_name, row, convert_blob_values, str_items)
         return len(str_items), str_items
 
+    def _rowCacheKey(self, table_name, key_names, key_values,
+                     convert_blob_values):
+        """ Return the row cache key of the row whose key_names columns
+        hold key_values, or None if key_names aren't the primary key.
+        """
+        pk_columns = self._primaryKeyColumns(table_name)
+        value_from_name = dict(zip([name.lower() for name in key_names],
+                                   key_values))
+        if not pk_columns or len(value_from_name) != len(pk_columns):
+            return None
+        key_text = []
+        for idx, name in pk_columns:
+            if name.lower() not in value_from_name:
+                return None
+            key_text.append(_keyText(value_from_name[name.lower()]))
+        return (table_name, tuple(key_text), bool(convert_blob_values))
+
+    def _cacheRow(self, table_name, row, convert_blob_values, str_items):
+        # row is the row as fetched; the key comes from its own primary
+        # key columns, whatever columns it was looked up by.
+        pk_columns = self._primaryKeyColumns(table_name)
+        if pk_columns:
+            key_text = tuple([_keyText(row[idx]) for idx, name in pk_columns])
+            self._row_cache.put((table_name, key_text, bool(convert_blob_values)),
+                                tuple(str_items))
+
+    def _recordTransfer(self, cu, rows, seconds):
+        """ Tell the compression advisor that rows took seconds to
+        arrive on cu's connection.
+        """
+        if self.connection.compress != 'off':
+            compressed = getattr(cu.connection, '_dbx_compressed', False)
+            _compression.recordTransfer(self.connection.serverKey(), rows,
+                                        seconds, compressed)
+
+    def getCompressionStats(self):
+        """ Return the compression setting and what's been measured
+        for this server (see CompressionAdvisor.getStats).
+        """
+        stats = _compression.getStats(self.connection.serverKey())
+        stats['setting'] = self.connection.compress
+        return stats
+
+    def getRowCacheStats(self):
+        """ Return the row cache's size and hit/miss/eviction counters."""
+        return self._row_cache.getStats()
+
+    def getRawRows(self, table_name, key_names, list_of_key_values,
+                   convert_blob_values=True, chunk_size=500):
+        """ Fetch the rows identified by each entry in list_of_key_values,
+        using one connection and a chunked "in" query per chunk_size keys.
+
+        Returns a list parallel to list_of_key_values, holding the same
+        list of strings getRawRow returns for each row, or None when no
+        row has that key.
+        """
+        if not list_of_key_values:
+            return []
+        cache_keys = [self._rowCacheKey(table_name, key_names, key_values,
+                                        convert_blob_values)
+                      for key_values in list_of_key_values]
+        results = [cache_key is not None and self._row_cache.get(cache_key)
+                   or None for cache_key in cache_keys]
+        missing = [key_values for key_values, str_items
+                   in zip(list_of_key_values, results) if str_items is None]
+        if not missing:
+            return [list(str_items) for str_items in results]
+        fixed_table_name = self._qualifyTableName(table_name)
+        converter = self._rawRowConverter(table_name, convert_blob_values)
+        num_keys = len(key_names)
+        keys_str = ", ".join(key_names)
+        if num_keys == 1:
+            key_placeholder = "%s"
+        else:
+            key_placeholder = "(%s)" % (", ".join(["%s"] * num_keys),)
+            keys_str = "(%s)" % (keys_str,)
+        # Each row comes back tagged with the position of the requested
+        # key it matched, so the server's collation and type rules decide
+        # the match, not a comparison of strings here.
+        # Identical requests share one lookup.
+        pending = []
+        seen = {}
+        for idx, str_items in enumerate(results):
+            if str_items is None:
+                key_values = tuple(list_of_key_values[idx])
+                if key_values not in seen:
+                    seen[key_values] = len(pending)
+                    pending.append(key_values)
+        found = {}
+        with self.connect() as cu:
+            # Bulk path: don't follow each chunk with SHOW WARNINGS.
+            cu.lazy_warnings = True
+            while pending:
+                unmatched = []
+                for i in range(0, len(pending), chunk_size):
+                    chunk = pending[i:i + chunk_size]
+                    args = []
+                    for key_values in chunk:
+                        args.extend(key_values)
+                    query = "select case %s end, %s.* from %s where %s in (%s)" % (
+                        " ".join(["when %s = %s then %d" % (keys_str, key_placeholder, n)
+                                  for n in range(len(chunk))]),
+                        fixed_table_name, fixed_table_name, keys_str,
+                        ", ".join([key_placeholder] * len(chunk)))
+                    started = time.time()
+                    self._execute(cu, query, args + args)
+                    rows = cu.fetchall()
+                    self._recordTransfer(cu, rows, time.time() - started)
+                    for row in rows:
+                        str_items = found[chunk[int(row[0])]] = converter(row[1:])
+                        self._cacheRow(table_name, row[1:], convert_blob_values,
+                                       str_items)
+                    unmatched.extend([key_values for key_values in chunk
+                                      if key_values not in found])
+                # A row that equals several requested keys (say 'a' and
+                # 'A' under a case-insensitive collation) is only tagged
+                # with the first; look the others up again.
+                if len(unmatched) == len(pending):
+                    break
+                pending = unmatched
+        for idx, str_items in enumerate(results):
+            if str_items is not None:
+                results[idx] = list(str_items)
+            else:
+                results[idx] = found.get(tuple(list_of_key_values[idx]))
+        return results
+
+    def getRowsByOffset(self, table_name, offset, limit):
+        """ Return up to limit rows of table_name starting at row offset,
+        converted for display.  Rows are ordered by the primary key, when
+        there is one, so successive pages don't overlap.
+        """
+        col_info_block = self._save_table_info(table_name)
+        key_names = [col_info.name for col_info in col_info_block
+                     if col_info.is_primary_key]
+        query = "select * from %s" % (self._qualifyTableName(table_name),)
+        if key_names:
+            query += " order by %s" % (", ".join(key_names),)
+        query += " limit %s, %s"
+        with self.connect() as cu:
+            started = time.time()
+            self._execute(cu, query, (offset, limit))
+            rows = cu.fetchall()
+            self._recordTransfer(cu, rows, time.time() - started)
+        return [self._convert(col_info_block, row) for row in rows]
+
     #TODO: Generic?
     def _getRowIdentifier(self, table_name, row_to_delete):
         table_name = self._qualifyTableName(table_name)
@@ -397,51 +1504,120 @@ class Database(dbxlib.CommonDatabase):
         return condition, key_values
 
     def deleteRowByKey(self, table_name, key_names, key_values):
-        table_name = self._qualifyTableName(table_name)
+        fixed_table_name = self._qualifyTableName(table_name)
         condition = " and ".join(["%s = %%s" % kname for kname in key_names])
         with self.connect(commit=True) as cu:
             try:
-                cu.execute("delete from %s where %s" % (table_name, condition), key_values)
+                self._execute(cu, "delete from %s where %s" % (fixed_table_name, condition),
+                              key_values)
             except:
                 log.exception("mysql deleteRowByKey failed")
                 res = False
             else:
                 res = True
+        self._row_cache.invalidateTable(table_name)
         return res
 
     def insertRowByNamesAndValues(self, table_name, target_names, target_values):
-        table_name = self._qualifyTableName(table_name)
-        cmd = "insert into %s (%s) values (%s)" % (     table_name,
+        fixed_table_name = self._qualifyTableName(table_name)
+        cmd = "insert into %s (%s) values (%s)" % (     fixed_table_name,
                                                    ", ".join(target_names),
                                                    ", ".join(['%s'] * len(target_names)))
         with self.connect(commit=True) as cu:
             cu.execute(cmd, target_values)
-            return True
+        self._row_cache.invalidateTable(table_name)
+        return True
 
     def runCustomQuery(self, resultsManager, query):
+        if self._worker_args is not None:
+            try:
+                self._runCustomQueryInWorker(resultsManager, query)
+            finally:
+                self._row_cache.invalidateTable()
+            return
+        # dbxlib runs the query on a cursor from self.connect(), which
+        # sees this flag: the cursor converts rows by their description,
+        # and the connection isn't pooled afterwards.
+        self._custom_sql.active = True
+        try:
+            try:
+                dbxlib.CommonDatabase.runCustomQuery(self, resultsManager, query)
+            except TypeError, ex:
+                # '%' chars need to be escaped with MySQL (might be fixed one day)
+                if 'not enough arguments for format string' in str(ex):
+                    dbxlib.CommonDatabase.runCustomQuery(self, resultsManager,
+                                                         query.replace("%", "%%"))
+        finally:
+            self._custom_sql.active = False
+            # Arbitrary SQL: any cached row may be stale now.
+            self._row_cache.invalidateTable()
+
+    def fetchCustomQuery(self, query):
+        """ Run query and fetch every result it returns, for
+        replayCustomQuery to hand to a results manager later, likely on
+        another thread.  Returns a list of (description, rowcount,
+        lastrowid, rows), one per result.
+        """
+        results = []
+        self._custom_sql.active = True
+        try:
+            with self.connect(commit=True) as cu:
+                cu.execute(query)
+                while True:
+                    rows = cu.description and cu.fetchall() or []
+                    results.append((cu.description, cu.rowcount,
+                                    cu.lastrowid, rows))
+                    if not cu.nextset():
+                        break
+        finally:
+            self._custom_sql.active = False
+            self._row_cache.invalidateTable()
+        return results
+
+    def _runCustomQueryInWorker(self, resultsManager, query):
+        # The rows stay in the worker until dbxlib fetches them.
+        import dbx_mysqldb_worker
+        result = dbx_mysqldb_worker.getPool().openQuery(self._worker_args,
+                                                        self._dbname, query)
+        if not isinstance(result, dbx_mysqldb_worker.WorkerResult):
+            self.replayCustomQuery(resultsManager, query,
+                                   [(None, result, None, [])])
+            return
+        try:
+            self.replayCustomQuery(resultsManager, query,
+                                   [(result.description, result.row_count,
+                                     None, result)])
+        finally:
+            result.close()
+
+    def replayCustomQuery(self, resultsManager, query, results):
+        """ runCustomQuery for results from fetchCustomQuery, or held
+        in a worker process: nothing is sent to the server.  AsyncDatabase fetches on a worker thread
+        and replays on the main thread, as resultsManager is an XPCOM
+        object.
+        """
+        self._custom_sql.replay = _FetchedCursor(results)
         try:
             dbxlib.CommonDatabase.runCustomQuery(self, resultsManager, query)
-        except TypeError, ex:
-            # '%' chars need to be escaped with MySQL (might be fixed one day)
-            if 'not enough arguments for format string' in str(ex):
-                dbxlib.CommonDatabase.runCustomQuery(self, resultsManager,
-                                                     query.replace("%", "%%"))
+        finally:
+            self._custom_sql.replay = None
 
     def updateRow(self, table_name, target_names, target_values,
                                       key_names, key_values):
-        table_name = self._qualifyTableName(table_name)
+        fixed_table_name = self._qualifyTableName(table_name)
         target_names_str = self._convertAndJoin(target_names, ",")
         key_names_str = self._convertAndJoin(key_names, " AND ")
-        cmd = "update %s set %s where %s" % (table_name, target_names_str,
+        cmd = "update %s set %s where %s" % (fixed_table_name, target_names_str,
                                              key_names_str)
         args = tuple(target_values + key_values)
         with self.connect(commit=True) as cu:
             try:
-                cu.execute(cmd, args)
+                self._execute(cu, cmd, args)
                 res = True
             except Exception, ex:
                 log.exception("dbx_psycopg::updateRow failed")
                 res = False
+        self._row_cache.invalidateTable(table_name)
         return res
 
     # Custom query methods -- these use callbacks into the
@@ -451,19 +1627,165 @@ class Database(dbxlib.CommonDatabase):
     # runCustomQuery is in the parent class.
 
     def executeCustomAction(self, action):
-        with self.connect(commit=True) as cu:
+        with self.connect(commit=True, reuse=False) as cu:
             try:
                 cu.execute(action)
                 res = True
             except Exception, ex:
                 log.exception("dbx_psycopg::executeCustomAction failed")
                 res = False
+        # Arbitrary SQL: any cached row may be stale now.
+        self._row_cache.invalidateTable()
         return res
 
+    # Chunked DML -- apply a large DELETE or UPDATE in primary-key ordered
+    # batches, one transaction per batch, so no single statement holds
+    # row locks on the whole set or floods the replicas' relay logs.
+
+    def executeChunkedAction(self, table_name, condition, set_clause=None,
+                             batch_size=1000, target_latency=0.5,
+                             sleep_time=0, replica_args=None,
+                             max_replica_lag=None, max_replica_wait=600):
+        """ Delete (or update, when set_clause is given) the rows of
+        table_name matching condition, batch_size primary keys at a time.
+
+        The batch size is adapted so each batch takes about target_latency
+        seconds.  If replica_args (same form as the args given to Database)
+        and max_replica_lag are supplied, work pauses while the replica's
+        Seconds_Behind_Master exceeds max_replica_lag.  If the replica
+        doesn't catch up within max_replica_wait seconds, or isn't
+        replicating, OperationalError is raised; the batches done so far
+        stay committed.
+
+        @param condition {str} SQL condition, e.g. "created < '2010-01-01'"
+        @param set_clause {str} e.g. "archived = 1", or None to delete
+        Returns the number of rows affected.
+        """
+        col_info_block = self._save_table_info(table_name)
+        key_names = [col_info.name for col_info in col_info_block
+                     if col_info.is_primary_key]
+        if not key_names:
+            raise DatabaseError("Table %s has no primary key, can't chunk"
+                                % (table_name,))
+        fixed_table_name = self._qualifyTableName(table_name)
+        # The queries below go through cursor.execute's % formatting.
+        condition = "(%s)" % (condition.replace("%", "%%"),)
+        if set_clause:
+            dml = "update %s set %s where %s and " % (
+                fixed_table_name, set_clause.replace("%", "%%"), condition)
+        else:
+            dml = "delete from %s where %s and " % (fixed_table_name,
+                                                   condition)
+        keys_str = ", ".join(key_names)
+        if len(key_names) == 1:
+            after_key = "%s > %%s" % (keys_str,)
+            key_placeholder = "%s"
+        else:
+            after_key = "(%s) > (%s)" % (keys_str,
+                                         ", ".join(["%s"] * len(key_names)))
+            key_placeholder = "(%s)" % (", ".join(["%s"] * len(key_names)),)
+        min_batch_size = 10
+        max_batch_size = max(batch_size * 10, 10000)
+        last_key = None
+        total = 0
+        replica_cu = None
+        replica_conn = None
+        try:
+            if replica_args is not None and max_replica_lag is not None:
+                replica_params = Connection(None, replica_args).getConnectionParameters()
+                replica_conn = _openConnection(replica_params,
+                                               replica_params.pop('driver', None))
+                replica_cu = replica_conn.cursor()
+            with self.connect() as cu:
+                cu.lazy_warnings = True
+                while True:
+                    if replica_cu is not None:
+                        self._waitForReplica(replica_cu, max_replica_lag,
+                                             max_replica_wait)
+                    if last_key is None:
+                        select = "select %s from %s where %s order by %s limit %d" % (
+                            keys_str, fixed_table_name, condition, keys_str,
+                            batch_size)
+                    else:
+                        select = "select %s from %s where %s and %s order by %s limit %d" % (
+                            keys_str, fixed_table_name, condition, after_key,
+                            keys_str, batch_size)
+                    cu.execute(select, last_key or ())
+                    keys = cu.fetchall()
+                    if not keys:
+                        break
+                    args = []
+                    for key in keys:
+                        args.extend(key)
+                    query = "%s(%s) in (%s)" % (dml, keys_str,
+                                                ", ".join([key_placeholder] * len(keys)))
+                    start = time.time()
+                    cu.execute(query, args)
+                    cu.connection.commit()
+                    elapsed = time.time() - start
+                    total += cu.rowcount
+                    last_key = keys[-1]
+                    log.debug("executeChunkedAction: %d keys in %.3fs, %d rows so far",
+                              len(keys), elapsed, total)
+                    if cu.warning_count:
+                        log.debug("executeChunkedAction: %d warnings so far",
+                                  cu.warning_count)
+                    if len(keys) < batch_size:
+                        break
+                    if elapsed > target_latency:
+                        batch_size = max(min_batch_size,
+                                         int(batch_size * target_latency / elapsed))
+                    elif elapsed < target_latency / 2:
+                        batch_size = min(max_batch_size, batch_size * 2)
+                    if sleep_time:
+                        time.sleep(sleep_time)
+        except (OperationalError, DatabaseError):
+            raise
+        except DriverOperationalError, ex:
+            raise OperationalError(ex)
+        except DriverDatabaseError, ex:
+            raise DatabaseError(ex)
+        finally:
+            self._row_cache.invalidateTable(table_name)
+            if replica_conn is not None:
+                replica_cu.close()
+                replica_conn.close()
+        return total
+
+    def _waitForReplica(self, cu, max_replica_lag, max_wait,
+                        poll_interval=1.0):
+        deadline = time.time() + max_wait
+        while True:
+            cu.execute("show slave status")
+            row = cu.fetchone()
+            if row is None:
+                # Not a replica: nothing to wait for.
+                return
+            names = [d[0] for d in cu.description]
+            lag = row[names.index('Seconds_Behind_Master')]
+            if lag is None:
+                # The replication threads are stopped; it won't catch up.
+                raise OperationalError("executeChunkedAction: the replica isn't replicating")
+            if lag <= max_replica_lag:
+                return
+            if time.time() >= deadline:
+                raise OperationalError("executeChunkedAction: replica still %s seconds behind after %s seconds"
+                                       % (lag, max_wait))
+            log.info("executeChunkedAction: replica lag is %s, waiting", lag)
+            time.sleep(poll_interval)
+
     def getIndexInfo(self, indexName, res):
         XXX # Implement!
         
     def getTriggerInfo(self, triggerName, res):
         XXX # Implement!
 
-
+def openDatabase(args, dbname=None, uri=None):
+    """ Return a Database for args and dbname; with the use_broker
+    connection argument, one whose calls go through the shared broker
+    process (see dbx_mysqldb_broker), with uri naming the connection.
+    """
+    if args.get('use_broker'):
+        import dbx_mysqldb_broker
+        return dbx_mysqldb_broker.BrokeredDatabase(args, dbname, uri)
+    return Database(args, dbname)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+A non-blocking front end to dbx_mysqldb.Database.
+
+Every call is handed to a bounded pool of worker threads, which make
+the blocking _mysql calls, and returns a Future right away.  The pool
+caps how many calls run against any one server at a time, so a burst
+of tree expansions on one connection can't take every worker while
+queries to other servers wait.
+
+runCustomQuery's results manager is an XPCOM object, so only the query
+runs on a worker; the rows are handed to the results manager on the
+main thread.
+"""
+
+import sys
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger("dbx_mysqldb_async")
+#log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+
+import dbx_mysqldb
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Future(object):
+    """ The result of a call that runs on the executor's workers.
+    Callbacks added with add_done_callback run on the worker thread
+    that finished the call, or right away if it's already done.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._running = False
+        # Streaming calls watch for cancellation while they run.
+        self._streaming = False
+        # A future that must finish before this call can start.
+        self._source = None
+        self._cancelled = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def cancel(self):
+        """ Ask for the call to be cancelled; return whether it will be.
+        A call that hasn't started yet never runs, and a running
+        streaming call stops at the next block.  Any other call that's
+        already running can't be cancelled.
+        """
+        with self._cond:
+            if self._done or (self._running and not self._streaming):
+                return False
+            source = self._source
+            if (source is not None and not source.done()
+                and not source.cancel()):
+                return False
+            self._cancelled = True
+            return True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def running(self):
+        return self._running and not self._done
+
+    def _start(self):
+        """ Mark the call as running, unless it was cancelled first;
+        return whether it should run.
+        """
+        with self._cond:
+            if self._cancelled:
+                return False
+            self._running = True
+            return True
+
+    def done(self):
+        return self._done
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise RuntimeError("Timed out waiting for result")
+
+    def result(self, timeout=None):
+        """ Wait for the call, then return its result or raise its error.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exc_info and self._exc_info[1]
+
+    def add_done_callback(self, fn):
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        self._runCallback(fn)
+
+    def _runCallback(self, fn):
+        try:
+            fn(self)
+        except:
+            log.exception("Future callback failed")
+
+    def _finish(self, result=None, exc_info=None):
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._cond.notifyAll()
+        for fn in callbacks:
+            self._runCallback(fn)
+
+
+class Executor(object):
+    """ A fixed pool of worker threads.  Each job is submitted with the
+    key of the server it talks to, and a worker only takes a job when
+    fewer than max_per_server jobs are running against that server;
+    otherwise the job waits in the queue and later jobs for other
+    servers go ahead of it.
+    """
+    def __init__(self, max_workers=8, max_per_server=3):
+        self.max_workers = max_workers
+        self.max_per_server = max_per_server
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = {}
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, server_key, fn, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Executor has been shut down")
+            self._queue.append((server_key, future, fn, args, kwargs))
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work,
+                                          name="dbx_mysqldb_async worker")
+                worker.setDaemon(True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+        return future
+
+    def _nextJob(self):
+        # Called with self._cond held.
+        for job in self._queue:
+            if self._running.get(job[0], 0) < self.max_per_server:
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._nextJob()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    job = self._nextJob()
+                server_key = job[0]
+                self._running[server_key] = self._running.get(server_key, 0) + 1
+            try:
+                self._run(*job[1:])
+            finally:
+                with self._cond:
+                    self._running[server_key] -= 1
+                    if not self._running[server_key]:
+                        del self._running[server_key]
+                    # A job held back for this server may be runnable now.
+                    self._cond.notifyAll()
+
+    def _run(self, future, fn, args, kwargs):
+        _runFuture(future, fn, *args, **kwargs)
+
+    def getStats(self):
+        with self._cond:
+            return {'workers': len(self._workers),
+                    'queued': len(self._queue),
+                    'running': dict(self._running)}
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            workers = list(self._workers)
+            self._cond.notifyAll()
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+def _runFuture(future, fn, *args, **kwargs):
+    if not future._start():
+        future._finish(exc_info=(CancelledError, CancelledError(), None))
+        return
+    try:
+        result = fn(*args, **kwargs)
+    except:
+        future._finish(exc_info=sys.exc_info())
+    else:
+        future._finish(result)
+
+
+class _Runnable(object):
+    def __init__(self, fn):
+        from xpcom import components
+        self._com_interfaces_ = [components.interfaces.nsIRunnable]
+        self._fn = fn
+
+    def run(self):
+        self._fn()
+
+def callOnMainThread(fn):
+    """ Have Komodo's main thread call fn() soon; call it right away on
+    the main thread, or when there's no XPCOM (outside Komodo).
+    """
+    try:
+        from xpcom import components
+    except ImportError:
+        fn()
+        return
+    thread_manager = components.classes["@mozilla.org/thread-manager;1"].\
+                     getService(components.interfaces.nsIThreadManager)
+    if thread_manager.isMainThread:
+        fn()
+    else:
+        thread_manager.mainThread.dispatch(
+            _Runnable(fn), components.interfaces.nsIEventTarget.DISPATCH_NORMAL)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def getExecutor():
+    """ The executor shared by all AsyncDatabase objects by default.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
+
+
+class AsyncDatabase(object):
+    """ Wraps a dbx_mysqldb.Database; every method returns a Future.
+    """
+    def __init__(self, args, dbname=None, executor=None,
+                 call_on_main_thread=callOnMainThread):
+        self.db = dbx_mysqldb.Database(args, dbname)
+        self.executor = executor or getExecutor()
+        self.call_on_main_thread = call_on_main_thread
+        connection = self.db.connection
+        self.server_key = (connection.host, connection.port,
+                           connection.socket, connection.user)
+
+    def _submit(self, fn, *args, **kwargs):
+        return self.executor.submit(self.server_key, fn, *args, **kwargs)
+
+    def listDatabases(self):
+        return self._submit(self.db.listDatabases)
+
+    def listAllTableNames(self, dbname):
+        return self._submit(self.db.listAllTableNames, dbname)
+
+    def listAllColumnNames(self, dbname, table_name):
+        return self._submit(self.db.listAllColumnNames, dbname, table_name)
+
+    def getRawRow(self, table_name, key_names, key_values,
+                  convert_blob_values=True):
+        return self._submit(self.db.getRawRow, table_name, key_names,
+                            key_values, convert_blob_values)
+
+    def runCustomQuery(self, resultsManager, query):
+        """ Run query on a worker, then give its results to
+        resultsManager on the main thread.  The future is done once
+        resultsManager has them.
+        """
+        future = Future()
+        fetching = future._source = self._submit(self.db.fetchCustomQuery,
+                                                 query)
+        def deliver():
+            _runFuture(future, self.db.replayCustomQuery, resultsManager,
+                       query, fetching.result())
+        def fetched(fetching):
+            if fetching.exception() is not None:
+                future._finish(exc_info=fetching._exc_info)
+            else:
+                self.call_on_main_thread(deliver)
+        fetching.add_done_callback(fetched)
+        return future
+
+    def executeQuery(self, query, args=None):
+        """ Run query; the future's result is (description, rows).
+        """
+        return self._submit(self._executeQuery, query, args)
+
+    def _executeQuery(self, query, args):
+        # Custom SQL may change session state, so don't pool the connection.
+        with self.db.connect(reuse=False) as cu:
+            cu.execute(query, args)
+            return cu.description, cu.fetchall()
+
+    def streamQuery(self, query, on_rows, args=None, batch_size=1000):
+        """ Run query with an unbuffered cursor, calling on_rows(rows) on
+        a worker thread for each block of at most batch_size rows, as the
+        server sends them.  The future's result is the number of rows
+        read.  Cancelling the future stops the query at the next block.
+        """
+        # _streamQuery watches its own future for cancellation.
+        holder = []
+        future = self._submit(self._streamQuery, query, on_rows, args,
+                              batch_size, holder)
+        future._streaming = True
+        holder.append(future)
+        return future
+
+    def _streamQuery(self, query, on_rows, args, batch_size, holder):
+        def cancelled():
+            return holder and holder[0].cancelled()
+        count = 0
+        with self.db.connect(reuse=False) as cu:
+            ss = self.db.streamingCursor(cu)
+            # If cancelled, kill the query instead of reading the rest.
+            ss.abort_on_close = True
+            try:
+                ss.execute(query, args)
+                while not cancelled():
+                    rows = ss.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    on_rows(rows)
+            finally:
+                ss.close()
+        return count
@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+A per-user broker process that owns the MySQL connection pool and the
+schema and row caches, so every Komodo process (and window) talking to
+the same server shares them instead of each opening its own.
+
+The broker listens on a Unix socket; BrokeredDatabase sends it
+dbx_mysqldb.Database calls, keyed by the connection's dbexplorer:// URI.
+The first client starts the broker, which exits after idle_timeout
+seconds without clients.  If the broker can't be reached, the calls
+run in the calling process as before.  Unix socket support is needed,
+so on Windows everything stays local.
+
+Requests carry passwords, so the socket lives in a directory only its
+user can enter; the client checks the directory and the socket before
+connecting, and both ends check the peer's uid where the platform can
+tell.  Messages are JSON, so a reply can't make the client run code.
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+import stat
+import SocketServer
+import json
+import logging
+from hashlib import sha1
+
+log = logging.getLogger("dbx_mysqldb_broker")
+#log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+
+import dbx_mysqldb
+
+# The Database methods run in the broker.  Everything else (notably
+# runCustomQuery, which writes into a local results manager) runs locally.
+brokered_methods = frozenset([
+    'listDatabases', 'listAllTablePartsByType', 'listAllTableNames',
+    'listAllColumnNames', 'listAllIndexNames', 'listAllTriggerNames',
+    'prefetchTableInfo', 'getRawRow', 'getRawRows', 'getRowsByOffset',
+    'getRowCacheStats', 'getCompressionStats', 'updateRow', 'deleteRowByKey',
+    'insertRowByNamesAndValues', 'executeCustomAction',
+    'executeChunkedAction',
+    ])
+
+def defaultSocketPath():
+    uid = hasattr(os, 'getuid') and os.getuid() or 0
+    return os.path.join(tempfile.gettempdir(), "dbx_mysqldb-%d" % (uid,),
+                        "broker.sock")
+
+def _checkPrivate(path, is_socket):
+    """ Raise socket.error unless path belongs to this user and, for the
+    directory, can't be entered by anyone else.
+    """
+    st = os.lstat(path)
+    if st.st_uid != os.getuid():
+        raise socket.error(errno.EACCES, "%s is owned by uid %d" % (path, st.st_uid))
+    if is_socket:
+        if not stat.S_ISSOCK(st.st_mode):
+            raise socket.error(errno.EACCES, "%s isn't a socket" % (path,))
+    elif not stat.S_ISDIR(st.st_mode) or st.st_mode & 077:
+        raise socket.error(errno.EACCES,
+                           "%s isn't a private directory (mode %o)"
+                           % (path, st.st_mode & 0777))
+
+def _makePrivateDir(path):
+    try:
+        os.mkdir(path, 0700)
+    except OSError, ex:
+        if ex.errno != errno.EEXIST:
+            raise socket.error(ex.errno, str(ex))
+    _checkPrivate(path, False)
+
+# SO_PEERCRED, for Linux: struct ucred is (pid, uid, gid).
+if sys.platform.startswith('linux'):
+    _SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+else:
+    _SO_PEERCRED = None
+
+def _checkPeer(sock):
+    if _SO_PEERCRED is None:
+        # The private directory is all there is to go on.
+        return
+    creds = sock.getsockopt(socket.SOL_SOCKET, _SO_PEERCRED,
+                            struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    if uid != os.getuid():
+        raise socket.error(errno.EACCES, "Peer is uid %d" % (uid,))
+
+# JSON only has one kind of string and no tuples, so str, tuple and
+# dict values are tagged: {"s": <str as latin-1>}, {"t": [...]} and
+# {"d": [[key, value], ...]}.
+
+def _encode(value):
+    if isinstance(value, str):
+        return {'s': value.decode('latin-1')}
+    elif isinstance(value, tuple):
+        return {'t': [_encode(item) for item in value]}
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    elif isinstance(value, dict):
+        return {'d': [[_encode(k), _encode(v)] for k, v in value.items()]}
+    elif value is None or isinstance(value, (unicode, bool, int, long, float)):
+        return value
+    raise TypeError("Can't send %r to the broker" % (value,))
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    elif isinstance(value, dict):
+        if 's' in value:
+            return value['s'].encode('latin-1')
+        elif 't' in value:
+            return tuple([_decode(item) for item in value['t']])
+        return dict([(_decode(k), _decode(v)) for k, v in value['d']])
+    return value
+
+def _send(sock, obj):
+    data = json.dumps(_encode(obj))
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 65536))
+        if not chunk:
+            raise EOFError("Broker connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return ''.join(chunks)
+
+def _recv(sock):
+    length = struct.unpack('!I', _recv_exactly(sock, 4))[0]
+    try:
+        return _decode(json.loads(_recv_exactly(sock, length)))
+    except (ValueError, KeyError, TypeError, UnicodeError), ex:
+        raise EOFError("Bad message from broker peer: %s" % (ex,))
+
+
+#---- The broker
+
+def _portable(value):
+    # LazyRows hold formatter functions; send the cells instead.
+    if isinstance(value, dbx_mysqldb.LazyRow):
+        return list(value)
+    elif isinstance(value, list):
+        return [_portable(item) for item in value]
+    elif isinstance(value, tuple):
+        return tuple([_portable(item) for item in value])
+    elif isinstance(value, dict):
+        return dict([(k, _portable(v)) for k, v in value.items()])
+    return value
+
+def _errorArg(arg):
+    # Exception args may hold MySQLdb exceptions; send their text.
+    if isinstance(arg, (int, long, basestring)):
+        return arg
+    return str(arg)
+
+class _BrokerHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        try:
+            _checkPeer(self.request)
+        except socket.error, ex:
+            log.warn("broker: refusing connection: %s", ex)
+            return
+        server.clientCount(1)
+        try:
+            while True:
+                try:
+                    request = _recv(self.request)
+                except (EOFError, socket.error):
+                    return
+                try:
+                    reply = ('ok', _portable(server.dispatch(*request)))
+                except Exception, ex:
+                    log.debug("broker: %s failed", request[3], exc_info=True)
+                    reply = ('error', dbx_mysqldb.errorKind(ex),
+                             tuple([_errorArg(arg) for arg in ex.args]))
+                _send(self.request, reply)
+        finally:
+            server.clientCount(-1)
+
+class Broker(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout=600):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._databases = {}
+        self._uris = {}
+        self._lock = threading.Lock()
+        self._clients = 0
+        self._last_active = time.time()
+        old_umask = os.umask(077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, _BrokerHandler)
+        finally:
+            os.umask(old_umask)
+
+    def clientCount(self, delta):
+        with self._lock:
+            self._clients += delta
+            self._last_active = time.time()
+
+    def _database(self, uri, db_args, dbname):
+        # The password is part of the key: a client only gets a Database
+        # opened with the credentials it sent.
+        key = (sha1(repr(sorted(db_args.items()))).hexdigest(), dbname)
+        with self._lock:
+            db = self._databases.get(key)
+            if db is None:
+                db = self._databases[key] = dbx_mysqldb.Database(db_args, dbname)
+                self._uris[key] = uri
+            return db
+
+    def dispatch(self, uri, db_args, dbname, method, args, kwargs):
+        if method == 'invalidate':
+            db = self._database(uri, db_args, dbname)
+            db._init_db()
+            return None
+        elif method == 'getBrokerStats':
+            return self.getStats()
+        if method not in brokered_methods:
+            raise dbx_mysqldb.DatabaseError("Method %r isn't brokered" % (method,))
+        db = self._database(uri, db_args, dbname)
+        return getattr(db, method)(*args, **kwargs)
+
+    def getStats(self):
+        with self._lock:
+            uris = {}
+            for key, uri in self._uris.items():
+                uris[uri] = uris.get(uri, 0) + 1
+            return {'pid': os.getpid(),
+                    'clients': self._clients,
+                    'databases': len(self._databases),
+                    'uris': uris}
+
+    def _watchIdle(self):
+        while True:
+            time.sleep(min(30, self.idle_timeout))
+            with self._lock:
+                idle = (not self._clients
+                        and time.time() - self._last_active > self.idle_timeout)
+            if idle:
+                log.info("broker: idle, exiting")
+                self.shutdown()
+                return
+
+    def serve(self):
+        watcher = threading.Thread(target=self._watchIdle)
+        watcher.setDaemon(True)
+        watcher.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            dbx_mysqldb._pool.clear()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+#---- The client side
+
+class BrokerLost(dbx_mysqldb.OperationalError):
+    pass
+
+class BrokerError(Exception):
+    pass
+
+class BrokerClient(object):
+    """ Talks to the broker at path, starting it if needed.  Each
+    thread gets its own socket.
+    """
+    # After failing to reach the broker, don't try again for this long.
+    retry_after = 60.0
+    start_timeout = 3.0
+
+    def __init__(self, path=None, python=None):
+        self.path = path or defaultSocketPath()
+        self.python = python
+        self._local = threading.local()
+        self._failed_at = None
+
+    def _connect(self):
+        _makePrivateDir(os.path.dirname(self.path))
+        if os.path.lexists(self.path):
+            _checkPrivate(self.path, True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            _checkPeer(sock)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _startBroker(self):
+        script = os.path.abspath(__file__)
+        if script.endswith(('.pyc', '.pyo')):
+            script = script[:-1]
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p])
+        devnull = open(os.devnull, 'r+')
+        try:
+            subprocess.Popen([self.python or dbx_mysqldb.pythonExecutable(),
+                              script, self.path],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid, env=env)
+        finally:
+            devnull.close()
+        deadline = time.time() + self.start_timeout
+        while True:
+            try:
+                return self._connect()
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            try:
+                sock = self._connect()
+            except socket.error, ex:
+                if ex.args[0] not in (errno.ENOENT, errno.ECONNREFUSED):
+                    raise
+                sock = self._startBroker()
+            self._local.sock = sock
+        return sock
+
+    def available(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            return False
+        return (self._failed_at is None
+                or time.time() - self._failed_at > self.retry_after)
+
+    def _dropSocket(self):
+        self._failed_at = time.time()
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def call(self, uri, db_args, dbname, method, *args, **kwargs):
+        """ Run db.method(*args, **kwargs) in the broker.  Raises
+        EnvironmentError (socket.error, or OSError if the broker couldn't
+        be started) if the request couldn't be sent, so the caller may
+        run it elsewhere, and BrokerLost if the broker went away after
+        it was sent, when it may or may not have run.
+        """
+        request = (uri, db_args, dbname, method, args, kwargs)
+        try:
+            sock = self._socket()
+            _send(sock, request)
+        except EnvironmentError:
+            self._dropSocket()
+            raise
+        try:
+            reply = _recv(sock)
+        except (socket.error, EOFError), ex:
+            self._dropSocket()
+            raise BrokerLost("Lost the broker during %s: %s" % (method, ex))
+        self._failed_at = None
+        if reply[0] == 'ok':
+            return reply[1]
+        kind, error_kind, args = reply
+        dbx_mysqldb.raiseRemoteError(error_kind, args, BrokerError)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def getClient():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = BrokerClient()
+        return _client
+
+
+class BrokeredDatabase(object):
+    """ Stands in for a dbx_mysqldb.Database, sending the calls in
+    brokered_methods to the broker and running everything else, or
+    everything when the broker is unavailable, on a local Database.
+    """
+    def __init__(self, args, dbname=None, uri=None, client=None):
+        self._args = args
+        self._dbname = dbname
+        self._uri = uri
+        self._client = client or getClient()
+        self._local_db = None
+
+    def _local(self):
+        if self._local_db is None:
+            self._local_db = dbx_mysqldb.Database(self._args, self._dbname)
+        return self._local_db
+
+    def _call(self, method, *args, **kwargs):
+        if self._client.available():
+            try:
+                return self._client.call(self._uri, self._args, self._dbname,
+                                         method, *args, **kwargs)
+            except EnvironmentError, ex:
+                # The request never reached the broker, so running it
+                # here can't run it twice.  A BrokerLost is raised as is.
+                log.warn("Broker unavailable, running %s locally: %s",
+                         method, ex)
+        return getattr(self._local(), method)(*args, **kwargs)
+
+    def runCustomQuery(self, resultsManager, query):
+        try:
+            return self._local().runCustomQuery(resultsManager, query)
+        finally:
+            # The query may have changed anything the broker has cached.
+            self.invalidateBroker()
+
+    def invalidateBroker(self):
+        if self._client.available():
+            try:
+                self._client.call(self._uri, self._args, self._dbname,
+                                  'invalidate')
+            except (EnvironmentError, BrokerLost):
+                pass
+
+    def __getattr__(self, attr):
+        if attr in brokered_methods:
+            def method(*args, **kwargs):
+                return self._call(attr, *args, **kwargs)
+            return method
+        return getattr(self._local(), attr)
+
+
+def main(argv):
+    path = len(argv) > 1 and argv[1] or defaultSocketPath()
+    _makePrivateDir(os.path.dirname(path))
+    if os.path.lexists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            # Left behind by a broker that died.
+            os.remove(path)
+        else:
+            log.info("broker: already running at %s", path)
+            return
+        finally:
+            probe.close()
+    try:
+        broker = Broker(path)
+    except socket.error, ex:
+        # Another broker won the race to start.
+        log.info("broker: not starting: %s", ex)
+        return
+    broker.serve()
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    main(sys.argv)
@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Client-side work on MySQL results the explorer has already fetched,
+so looking at them again doesn't mean re-running the query.
+"""
+
+import os
+import logging
+import mmap
+import tempfile
+import threading
+import time
+import cPickle
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+log = logging.getLogger("dbx_mysqldb_results")
+#log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from MySQLdb.constants import FIELD_TYPE
+except ImportError:
+    # The same codes, without needing _mysql.
+    from dbx_mysqlproto import FIELD_TYPE
+_numeric_type_codes = frozenset([
+    FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.TINY,
+    FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24,
+    FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR, FIELD_TYPE.FLOAT,
+    FIELD_TYPE.DOUBLE])
+
+def _numericValues(values):
+    """ Return (numbers, skipped): the values of a fetched column that
+    are numbers, or text that parses as one, and how many weren't.
+    NULLs and "" (how the grid shows NULL) count as skipped.
+    """
+    numbers = []
+    skipped = 0
+    for value in values:
+        if isinstance(value, (int, long, float)):
+            numbers.append(value)
+            continue
+        if value is None or value == "":
+            skipped += 1
+            continue
+        try:
+            numbers.append(float(value))
+        except (TypeError, ValueError):
+            skipped += 1
+    return numbers, skipped
+
+def _percentile(sorted_values, q):
+    # Linear interpolation between closest ranks, as numpy.percentile.
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    frac = pos - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * frac
+
+class ColumnSummary(object):
+    """ Running summary statistics of one column.  Feed it a whole
+    column, or successive batches of a streamed one, with update(),
+    then read the numbers with getSummary().
+
+    A column can be a list (as in fetched rows, or the strings the
+    grid shows), an array.array or a NumPy array (as from
+    cursor.fetchcolumns()).  NumPy is used when it's installed.
+    """
+    def __init__(self, keep_values=True):
+        # keep_values=False saves memory but gives no percentiles.
+        self.keep_values = keep_values
+        self.count = 0
+        self.skipped = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self._chunks = []
+        self._sorted = None
+
+    def update(self, values):
+        if numpy is not None:
+            if isinstance(values, numpy.ndarray):
+                numbers = values
+            elif isinstance(values, array):
+                numbers = numpy.frombuffer(values, dtype=values.typecode)
+            else:
+                numbers, skipped = _numericValues(values)
+                self.skipped += skipped
+                numbers = numpy.array(numbers, dtype=float)
+            if not len(numbers):
+                return
+            self._add(len(numbers), numbers.sum(), numbers.min(), numbers.max())
+            if self.keep_values:
+                self._chunks.append(numbers)
+        else:
+            if isinstance(values, array):
+                numbers = values
+            else:
+                numbers, skipped = _numericValues(values)
+                self.skipped += skipped
+            if not len(numbers):
+                return
+            self._add(len(numbers), sum(numbers), min(numbers), max(numbers))
+            if self.keep_values:
+                self._chunks.append(array('d', numbers))
+        self._sorted = None
+
+    def _add(self, count, total, minimum, maximum):
+        self.count += count
+        self.total += total
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = minimum
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = maximum
+
+    def percentiles(self, qs):
+        """ Return the values at each percentile in qs (0 to 100)."""
+        if not self.keep_values:
+            raise ValueError("ColumnSummary was made with keep_values=False")
+        if not self.count:
+            return [None] * len(qs)
+        if self._sorted is None:
+            if numpy is not None:
+                self._sorted = numpy.sort(numpy.concatenate(self._chunks))
+            else:
+                values = array('d')
+                for chunk in self._chunks:
+                    values.extend(chunk)
+                self._sorted = sorted(values)
+            # Keep one copy of the values, not two.
+            self._chunks = [self._sorted]
+        if numpy is not None:
+            return [float(x) for x in numpy.percentile(self._sorted, qs)]
+        return [_percentile(self._sorted, q) for q in qs]
+
+    def getSummary(self, qs=(25, 50, 75)):
+        if self.count:
+            avg = float(self.total) / self.count
+        else:
+            avg = None
+        summary = {'count': self.count,
+                   'skipped': self.skipped,
+                   'sum': self.total,
+                   'min': self.minimum,
+                   'max': self.maximum,
+                   'avg': avg}
+        if self.keep_values:
+            summary['percentiles'] = dict(zip(qs, self.percentiles(qs)))
+        return summary
+
+class ResultSummary(object):
+    """ Summaries of some columns of a result, updated with each batch
+    of rows as it arrives, or with the columns from fetchcolumns().
+    """
+    def __init__(self, column_indices, keep_values=True):
+        self.column_indices = list(column_indices)
+        self.summaries = dict([(idx, ColumnSummary(keep_values))
+                               for idx in self.column_indices])
+
+    def updateRows(self, rows):
+        if not rows:
+            return
+        for idx in self.column_indices:
+            self.summaries[idx].update([row[idx] for row in rows])
+
+    def updateColumns(self, columns):
+        for idx in self.column_indices:
+            self.summaries[idx].update(columns[idx])
+
+    def getSummary(self, qs=(25, 50, 75)):
+        return dict([(idx, summary.getSummary(qs))
+                     for idx, summary in self.summaries.items()])
+
+_inf = float('inf')
+
+def _numericSortKey(value):
+    # NULLs (shown as "") first, then numbers, then text that doesn't
+    # parse as a number.
+    if value is None or value == "":
+        return -_inf
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _inf
+
+def _sortKey(value):
+    # None sorts before everything else.
+    return value
+
+class _ColumnIndex(object):
+    """ The rows of one column in ascending key order (stable), with
+    the keys in the same order for binary searches.
+    """
+    def __init__(self, rows, column, key_function):
+        if key_function is _sortKey:
+            keys = [row[column] for row in rows]
+        else:
+            keys = [key_function(row[column]) for row in rows]
+        self.order = array('l', sorted(xrange(len(keys)), key=keys.__getitem__))
+        self.keys = [keys[i] for i in self.order]
+        self._reversed_order = None
+
+    def reversedOrder(self):
+        """ Descending order, with equal keys still in fetch order."""
+        if self._reversed_order is None:
+            keys = self.keys
+            order = self.order
+            result = array('l')
+            end = len(order)
+            while end > 0:
+                start = end - 1
+                key = keys[start]
+                while start > 0 and keys[start - 1] == key:
+                    start -= 1
+                result.extend(order[start:end])
+                end = start
+            self._reversed_order = result
+        return self._reversed_order
+
+class ResultSet(object):
+    """ A fetched result that can be sorted and filtered client-side.
+
+    rows is any sequence of rows that supports len() and indexing,
+    description is the cursor.description of the query.  Sorting and
+    range filters on a column use an index of that column, built the
+    first time it is needed and reused afterwards.
+
+    The rows in the current view (filtered, then sorted) are read with
+    len() and getRow(); the underlying rows are never modified.
+    """
+    def __init__(self, rows, description):
+        self.rows = rows
+        self.description = description
+        self._indexes = {}
+        # Row numbers in the view, or None for all rows in fetch order.
+        self._view = None
+        self._sort_column = None
+        self._sort_reverse = False
+        self._filtered = False
+
+    def __len__(self):
+        if self._view is None:
+            return len(self.rows)
+        return len(self._view)
+
+    def getRow(self, view_idx):
+        if self._view is None:
+            return self.rows[view_idx]
+        return self.rows[self._view[view_idx]]
+
+    def getRowNumbers(self):
+        """ Return the row numbers of the view in display order."""
+        if self._view is None:
+            return xrange(len(self.rows))
+        return self._view
+
+    def _keyFunction(self, column):
+        if (self.description
+            and self.description[column][1] in _numeric_type_codes):
+            return _numericSortKey
+        return _sortKey
+
+    def _index(self, column):
+        index = self._indexes.get(column)
+        if index is None:
+            index = _ColumnIndex(self.rows, column, self._keyFunction(column))
+            self._indexes[column] = index
+        return index
+
+    def sort(self, column, reverse=False):
+        """ Sort the view by column.  Rows with equal values keep their
+        relative order in either direction.
+        """
+        index = self._index(column)
+        if reverse:
+            order = index.reversedOrder()
+        else:
+            order = index.order
+        if self._view is not None:
+            shown = bytearray(len(self.rows))
+            for row_num in self._view:
+                shown[row_num] = 1
+            order = array('l', [row_num for row_num in order if shown[row_num]])
+        self._view = order
+        self._sort_column = column
+        self._sort_reverse = reverse
+
+    def _restrict(self, row_nums):
+        # Keep the rows of the view that are in row_nums, in view order.
+        self._filtered = True
+        if self._view is None:
+            self._view = array('l', sorted(row_nums))
+            if self._sort_column is not None:
+                self.sort(self._sort_column, self._sort_reverse)
+            return
+        keep = bytearray(len(self.rows))
+        for row_num in row_nums:
+            keep[row_num] = 1
+        self._view = array('l', [row_num for row_num in self._view
+                                 if keep[row_num]])
+
+    def filter(self, column, predicate):
+        """ Keep the rows of the view for which predicate(value) is true."""
+        rows = self.rows
+        self._restrict([row_num for row_num in self.getRowNumbers()
+                        if predicate(rows[row_num][column])])
+
+    def filterRange(self, column, low=None, high=None):
+        """ Keep the rows of the view whose value in column is between
+        low and high inclusive; None leaves that end open.  Uses the
+        column's index, so it costs a binary search plus the matches.
+        """
+        index = self._index(column)
+        key_function = self._keyFunction(column)
+        start = 0
+        end = len(index.keys)
+        if low is not None:
+            start = bisect_left(index.keys, key_function(low))
+        else:
+            # Open ranges still leave out NULLs.
+            start = bisect_right(index.keys, key_function(None))
+        if high is not None:
+            end = bisect_right(index.keys, key_function(high))
+        if not self._filtered and self._sort_column == column:
+            # The view is this index: the matches are a slice of it.
+            self._filtered = True
+            if self._sort_reverse:
+                num_rows = len(index.order)
+                self._view = index.reversedOrder()[num_rows - end:num_rows - start]
+            else:
+                self._view = index.order[start:end]
+            return
+        self._restrict(index.order[start:end])
+
+    def filterEquals(self, column, value):
+        self.filterRange(column, value, value)
+
+    def clearFilters(self):
+        self._view = None
+        self._filtered = False
+        if self._sort_column is not None:
+            self.sort(self._sort_column, self._sort_reverse)
+
+class SpillingRowStore(object):
+    """ Append-only row storage that keeps the first memory_limit bytes
+    of rows in a list and writes the rest to a temporary file, so a
+    very large result can be held with bounded memory.
+
+    The file holds each spilled row pickled back to back; a second file
+    holds the row offsets as 8-byte little-endian integers.  Both are read through
+    mmap, so random access (a grid scrolling anywhere in the result)
+    costs one page fault rather than a read of everything before it.
+    Rows come back as tuples; it supports len() and indexing, so it can
+    be the rows of a ResultSet.
+    """
+    # Offsets are buffered and written in blocks of this many.
+    _offset_block = 4096
+    _offset_struct = struct.Struct('<Q')
+
+    def __init__(self, memory_limit=64 * 1024 * 1024, dir=None):
+        self.memory_limit = memory_limit
+        self._dir = dir
+        self._rows = []
+        self._memory_used = 0
+        self._num_spilled = 0
+        self._data_file = None
+        self._index_file = None
+        self._data_size = 0
+        self._pending_offsets = []
+        self._data_map = None
+        self._index_map = None
+
+    def __len__(self):
+        return len(self._rows) + self._num_spilled
+
+    def append(self, row):
+        if self._data_file is None:
+            self._rows.append(row)
+            self._memory_used += self._rowSize(row)
+            if self._memory_used > self.memory_limit:
+                self._startSpilling()
+            return
+        data = cPickle.dumps(tuple(row), cPickle.HIGHEST_PROTOCOL)
+        self._data_file.write(data)
+        self._pending_offsets.append(self._data_size)
+        self._data_size += len(data)
+        self._num_spilled += 1
+        if len(self._pending_offsets) >= self._offset_block:
+            self._flushOffsets()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def _rowSize(self, row):
+        # A rough estimate: the strings plus a word per value.
+        size = 64
+        for value in row:
+            if isinstance(value, basestring):
+                size += len(value) + 40
+            else:
+                size += 24
+        return size
+
+    def _startSpilling(self):
+        log.debug("SpillingRowStore: spilling after %d rows", len(self._rows))
+        self._data_file = tempfile.TemporaryFile(prefix="dbx_mysql_rows",
+                                                 dir=self._dir)
+        self._index_file = tempfile.TemporaryFile(prefix="dbx_mysql_index",
+                                                  dir=self._dir)
+
+    def _flushOffsets(self):
+        if self._pending_offsets:
+            self._index_file.write(struct.pack('<%dQ' % len(self._pending_offsets),
+                                               *self._pending_offsets))
+            del self._pending_offsets[:]
+
+    def _maps(self):
+        # Map whatever has been written since the last call.
+        num_mapped = self._index_map is not None and len(self._index_map) / 8 or 0
+        if num_mapped < self._num_spilled:
+            self._flushOffsets()
+            self._data_file.flush()
+            self._index_file.flush()
+            self._closeMaps()
+            self._data_map = mmap.mmap(self._data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            self._index_map = mmap.mmap(self._index_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        return self._data_map, self._index_map
+
+    def _offset(self, index_map, spilled_idx):
+        return self._offset_struct.unpack_from(index_map, spilled_idx * 8)[0]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        num_in_memory = len(self._rows)
+        if idx < num_in_memory:
+            return self._rows[idx]
+        spilled_idx = idx - num_in_memory
+        if not 0 <= spilled_idx < self._num_spilled:
+            raise IndexError("row index out of range")
+        data_map, index_map = self._maps()
+        start = self._offset(index_map, spilled_idx)
+        if spilled_idx + 1 < self._num_spilled:
+            end = self._offset(index_map, spilled_idx + 1)
+        else:
+            end = self._data_size
+        return cPickle.loads(data_map[start:end])
+
+    def _closeMaps(self):
+        if self._data_map is not None:
+            self._data_map.close()
+            self._index_map.close()
+            self._data_map = self._index_map = None
+
+    def close(self):
+        """ Release the rows and delete the spill files."""
+        self._closeMaps()
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = self._index_file = None
+        self._rows = []
+        self._num_spilled = 0
+
+def fetchIntoStore(cursor, store=None, batch_size=1000):
+    """ Read the rest of cursor's result into a SpillingRowStore
+    (a new one unless store is given) and return the store.  Use a
+    cursor that streams (MySQLdb.cursors.SSCursor); a buffered cursor
+    already holds the whole result in memory.
+    """
+    if store is None:
+        store = SpillingRowStore()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        store.extend(rows)
+    return store
+
+class RowWindowCache(object):
+    """ Pages of rows around the part of a result that is on screen.
+
+    fetch_rows(offset, limit) returns up to limit rows starting at row
+    offset; it is called with whole pages.  Call setVisibleRange() as
+    the view scrolls: the page beyond the visible rows, in the
+    direction of scrolling, is fetched on a background thread, and
+    pages farthest from the visible rows are dropped once there are
+    more than max_pages.  getStats() reports the hit rate and fetch
+    latencies.
+    """
+    def __init__(self, fetch_rows, page_size=200, max_pages=10,
+                 prefetch=True):
+        self._fetch_rows = fetch_rows
+        self.page_size = page_size
+        self.max_pages = max(max_pages, 3)
+        self.prefetch = prefetch
+        self._pages = {}
+        self._pending = {}
+        # Bumped by invalidate(), so pages fetched before it are dropped.
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._first_visible = 0
+        self._last_visible = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self._fetch_count = 0
+        self._fetch_time = 0.0
+        self._max_fetch_time = 0.0
+
+    def getRow(self, row_idx):
+        """ Return row row_idx, or None if the result has fewer rows."""
+        page_num, offset = divmod(row_idx, self.page_size)
+        rows = self._getPage(page_num)
+        if offset < len(rows):
+            return rows[offset]
+        return None
+
+    def getCell(self, row_idx, column_idx):
+        row = self.getRow(row_idx)
+        if row is None:
+            return None
+        return row[column_idx]
+
+    def _getPage(self, page_num):
+        with self._lock:
+            rows = self._pages.get(page_num)
+            if rows is not None:
+                self.hits += 1
+                return rows
+            pending = self._pending.get(page_num)
+        if pending is not None:
+            # Being prefetched: waiting beats fetching it twice.
+            pending.wait()
+            with self._lock:
+                rows = self._pages.get(page_num)
+                if rows is not None:
+                    self.hits += 1
+                    return rows
+        with self._lock:
+            self.misses += 1
+        return self._fetchPage(page_num)
+
+    def _fetchPage(self, page_num):
+        with self._lock:
+            generation = self._generation
+        start = time.time()
+        rows = self._fetch_rows(page_num * self.page_size, self.page_size)
+        elapsed = time.time() - start
+        with self._lock:
+            self._fetch_count += 1
+            self._fetch_time += elapsed
+            self._max_fetch_time = max(self._max_fetch_time, elapsed)
+            if generation == self._generation:
+                self._pages[page_num] = rows
+                self._evict()
+        return rows
+
+    def _prefetch(self, page_num):
+        try:
+            self._fetchPage(page_num)
+        except Exception:
+            log.exception("RowWindowCache: prefetching page %d failed", page_num)
+        finally:
+            with self._lock:
+                event = self._pending.pop(page_num, None)
+            if event is not None:
+                event.set()
+
+    def setVisibleRange(self, first_row, last_row):
+        scrolling_up = first_row < self._first_visible
+        self._first_visible = first_row
+        self._last_visible = last_row
+        if scrolling_up:
+            page_num = first_row // self.page_size - 1
+        else:
+            page_num = last_row // self.page_size + 1
+        with self._lock:
+            self._evict()
+            if (not self.prefetch or page_num < 0
+                or page_num in self._pages or page_num in self._pending):
+                return
+            self._pending[page_num] = threading.Event()
+            self.prefetches += 1
+        thread = threading.Thread(target=self._prefetch, args=(page_num,),
+                                  name="dbx_mysql row prefetch")
+        thread.setDaemon(True)
+        thread.start()
+
+    def _evict(self):
+        # Called with the lock held.
+        if len(self._pages) <= self.max_pages:
+            return
+        center = (self._first_visible + self._last_visible) // 2 // self.page_size
+        by_distance = sorted(self._pages.keys(),
+                             key=lambda page_num: abs(page_num - center))
+        for page_num in by_distance[self.max_pages:]:
+            del self._pages[page_num]
+
+    def invalidate(self):
+        """ Forget every page, e.g. after the rows were changed.  Pages
+        still being fetched are not kept when they arrive.
+        """
+        with self._lock:
+            self._generation += 1
+            self._pages.clear()
+
+    def getStats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': lookups and float(self.hits) / lookups or 0.0,
+                    'prefetches': self.prefetches,
+                    'pages': len(self._pages),
+                    'fetches': self._fetch_count,
+                    'avg_fetch_time': (self._fetch_count
+                                       and self._fetch_time / self._fetch_count
+                                       or 0.0),
+                    'max_fetch_time': self._max_fetch_time}
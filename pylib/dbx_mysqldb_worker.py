@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Run MySQL queries in child processes, so fetching, converting and
+holding a big result neither blocks Komodo nor grows its memory.
+
+A WorkerPool starts copies of this script, which read pickled requests
+from stdin and answer on stdout.  A result stays in its worker, in a
+dbx_mysqldb_results.SpillingRowStore; the IDE asks for one window of
+rows at a time and gets them back already formatted for the grid.
+Windows are handed over through a file both processes map into memory,
+so only a few bytes go through the pipe; a window too big for the
+buffer is sent through the pipe instead.
+
+With the worker_process connection argument, dbx_mysqldb runs custom
+queries this way, and the table view reads its rows through a
+TableWindow.
+"""
+
+import os
+import sys
+import mmap
+import tempfile
+import threading
+import subprocess
+import cPickle
+import logging
+
+log = logging.getLogger("dbx_mysqldb_worker")
+#log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _pythonPath():
+    return os.pathsep.join([p for p in sys.path if p])
+
+def _scriptPath():
+    path = os.path.abspath(__file__)
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return path
+
+
+#---- The IDE side
+
+class WorkerProcess(object):
+    """ One child process, used by one request at a time.
+    """
+    def __init__(self, python=None, buffer_size=4 * 1024 * 1024):
+        self.buffer_size = buffer_size
+        fd, self._buffer_path = tempfile.mkstemp(prefix="dbx_mysql_shm")
+        os.write(fd, '\0' * buffer_size)
+        os.close(fd)
+        self._buffer_file = open(self._buffer_path, 'r+b')
+        self._buffer = mmap.mmap(self._buffer_file.fileno(), buffer_size)
+        if python is None:
+            import dbx_mysqldb
+            python = dbx_mysqldb.pythonExecutable()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = _pythonPath()
+        self._proc = subprocess.Popen([python, '-u',
+                                       _scriptPath(), self._buffer_path],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, env=env)
+        self.lock = threading.Lock()
+
+    def isAlive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def call(self, op, *args):
+        """ Run op in the child and return its result.  Errors raised in
+        the child are raised again here, as dbx_mysqldb's OperationalError
+        or DatabaseError where they were MySQL errors.
+        """
+        with self.lock:
+            if not self.isAlive():
+                raise WorkerError("Worker process has exited")
+            try:
+                cPickle.dump((op, args), self._proc.stdin, 2)
+                self._proc.stdin.flush()
+                reply = cPickle.load(self._proc.stdout)
+            except (EOFError, IOError, cPickle.UnpicklingError), ex:
+                self.close()
+                raise WorkerError("Lost the worker process: %s" % (ex,))
+            kind = reply[0]
+            if kind == 'ok':
+                return reply[1]
+            elif kind == 'buffer':
+                return cPickle.loads(self._buffer[:reply[1]])
+        kind, error_kind, args = reply
+        import dbx_mysqldb
+        dbx_mysqldb.raiseRemoteError(error_kind, args, WorkerError)
+
+    def close(self):
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                try:
+                    cPickle.dump(('quit', ()), self._proc.stdin, 2)
+                    self._proc.stdin.close()
+                    self._proc.wait()
+                except (IOError, OSError):
+                    pass
+            self._proc = None
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer_file.close()
+            self._buffer = None
+            try:
+                os.remove(self._buffer_path)
+            except OSError:
+                pass
+
+
+class WorkerResult(object):
+    """ A query result held by a worker.  getWindow fits the
+    fetch_rows argument of dbx_mysqldb_results.RowWindowCache; slicing
+    fetches the window too.
+    """
+    def __init__(self, worker, handle, description, row_count):
+        self._worker = worker
+        self._handle = handle
+        self.description = description
+        self.column_names = [d[0] for d in description]
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.row_count)
+            return self.getWindow(start, max(0, stop - start))[::step]
+        if idx < 0:
+            idx += self.row_count
+        if not 0 <= idx < self.row_count:
+            raise IndexError("row index out of range")
+        return self.getWindow(idx, 1)[0]
+
+    def getWindow(self, offset, limit):
+        """ Return rows offset.. offset+limit-1 as lists of cell strings.
+        """
+        return self._worker.call('getWindow', self._handle, offset, limit)
+
+    def close(self):
+        if self._handle is not None and self._worker.isAlive():
+            self._worker.call('close', self._handle)
+        self._handle = None
+
+
+class WorkerPool(object):
+    """ Up to size worker processes, started as needed.  A call goes to
+    an idle worker if there is one; a result keeps using the worker
+    that holds it.
+    """
+    def __init__(self, size=2, python=None):
+        self.size = size
+        self.python = python
+        self._workers = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.isAlive()]
+            for worker in self._workers:
+                if not worker.lock.locked():
+                    return worker
+            if len(self._workers) < self.size:
+                worker = WorkerProcess(self.python)
+                self._workers.append(worker)
+                return worker
+            self._next = (self._next + 1) % len(self._workers)
+            return self._workers[self._next]
+
+    def openQuery(self, db_args, dbname, query):
+        """ Run query in a worker, keeping the rows there.  Returns a
+        WorkerResult, or the number of rows affected if the statement
+        returned no result set.
+        """
+        worker = self._worker()
+        handle, description, row_count = worker.call('openQuery', db_args,
+                                                     dbname, query)
+        if handle is None:
+            return row_count
+        return WorkerResult(worker, handle, description, row_count)
+
+    def openTable(self, db_args, dbname, table_name):
+        """ Like openQuery, for all the rows of a table; the cells are
+        formatted from the table's column info.
+        """
+        worker = self._worker()
+        handle, description, row_count = worker.call('openTable', db_args,
+                                                     dbname, table_name)
+        return WorkerResult(worker, handle, description, row_count)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+
+class TableWindow(object):
+    """ The fetch_rows of a RowWindowCache showing a whole table: the
+    table is read into a worker with openTable the first time rows are
+    wanted, and again after reset().
+    """
+    def __init__(self, pool, db_args, dbname, table_name):
+        self._pool = pool
+        self._db_args = db_args
+        self._dbname = dbname
+        self._table_name = table_name
+        self._result = None
+        self._lock = threading.Lock()
+
+    def __call__(self, offset, limit):
+        with self._lock:
+            if self._result is None:
+                self._result = self._pool.openTable(self._db_args, self._dbname,
+                                                    self._table_name)
+            return self._result.getWindow(offset, limit)
+
+    def reset(self):
+        """ Drop the rows read so far, after the table has changed. """
+        with self._lock:
+            if self._result is not None:
+                self._result.close()
+                self._result = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def getPool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+
+#---- The worker side
+
+def _picklableArg(arg):
+    if isinstance(arg, (int, long, basestring)):
+        return arg
+    return str(arg)
+
+class _Worker(object):
+    # Rows beyond this much memory go to the store's spill file.
+    store_memory_limit = 16 * 1024 * 1024
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._databases = {}
+        self._results = {}
+        self._next_handle = 1
+
+    def _database(self, db_args, dbname):
+        import dbx_mysqldb
+        # This is the worker: its Database runs everything itself.
+        db_args = dict([(k, v) for k, v in db_args.items()
+                        if k != 'worker_process'])
+        key = (tuple(sorted(db_args.items())), dbname)
+        db = self._databases.get(key)
+        if db is None:
+            db = self._databases[key] = dbx_mysqldb.Database(db_args, dbname)
+        return db
+
+    def _store(self, db, query, col_info_block=None):
+        import dbx_mysqldb_results
+        with db.connect(reuse=False) as cu:
+            ss = db.streamingCursor(cu)
+            try:
+                ss.execute(query)
+                if ss.description is None:
+                    return None, [], ss.rowcount
+                if col_info_block is None:
+                    col_info_block = db.getColumnInfoFromCursor(ss)
+                store = dbx_mysqldb_results.SpillingRowStore(
+                    memory_limit=self.store_memory_limit)
+                dbx_mysqldb_results.fetchIntoStore(ss, store)
+            finally:
+                ss.close()
+        handle = self._next_handle
+        self._next_handle += 1
+        self._results[handle] = (db, col_info_block, store)
+        return handle, tuple(ss.description), len(store)
+
+    def openQuery(self, db_args, dbname, query):
+        return self._store(self._database(db_args, dbname), query)
+
+    def openTable(self, db_args, dbname, table_name):
+        db = self._database(db_args, dbname)
+        col_info_block = db._save_table_info(table_name)
+        return self._store(db, "select * from %s" % db._qualifyTableName(table_name),
+                           col_info_block)
+
+    def getWindow(self, handle, offset, limit):
+        db, col_info_block, store = self._results[handle]
+        return [list(db._convert(col_info_block, store[idx]))
+                for idx in xrange(offset, min(offset + limit, len(store)))]
+
+    def close(self, handle):
+        db, col_info_block, store = self._results.pop(handle)
+        store.close()
+
+    def reply(self, value):
+        data = cPickle.dumps(value, 2)
+        if len(data) <= len(self._buffer):
+            self._buffer[:len(data)] = data
+            return ('buffer', len(data))
+        return ('ok', value)
+
+    def serve(self, infile, outfile):
+        while True:
+            try:
+                op, args = cPickle.load(infile)
+            except EOFError:
+                break
+            if op == 'quit':
+                break
+            try:
+                reply = self.reply(getattr(self, op)(*args))
+            except Exception, ex:
+                log.debug("worker: %s failed", op, exc_info=True)
+                import dbx_mysqldb
+                reply = ('error', dbx_mysqldb.errorKind(ex),
+                         tuple([_picklableArg(arg) for arg in ex.args]))
+            cPickle.dump(reply, outfile, 2)
+            outfile.flush()
+
+
+def main(argv):
+    infile, outfile = sys.stdin, sys.stdout
+    # Keep stray prints off the reply pipe.
+    sys.stdout = sys.stderr
+    if sys.platform == "win32":
+        import msvcrt
+        msvcrt.setmode(infile.fileno(), os.O_BINARY)
+        msvcrt.setmode(outfile.fileno(), os.O_BINARY)
+    buffer_file = open(argv[1], 'r+b')
+    buffer = mmap.mmap(buffer_file.fileno(), os.path.getsize(argv[1]))
+    _Worker(buffer).serve(infile, outfile)
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    main(sys.argv)
@@ -0,0 +1,1529 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+A MySQL driver written in Python, speaking the client/server protocol
+directly, for when the platform's _mysql extension isn't usable.
+
+Connections use non-blocking sockets driven by a select() based Loop.
+Each Connection makes a Loop of its own unless it's given one.  A
+caller driving several connections from one thread can give them the
+same Loop, start queries with Connection.query_async() and run the
+loop with Loop.wait(), to keep queries running on all of them at once.
+dbx_mysqldb doesn't: its pooled connections are used by whichever
+thread takes them, one blocking call at a time.
+
+The blocking Connection and cursor classes follow MySQLdb's
+(connect(), Cursor, SSCursor, DictCursor) and raise the same exception
+classes, so dbx_mysqldb can use either.
+
+Supported: protocol 4.1 handshake, mysql_native_password
+authentication, COM_QUERY with text result sets, multiple statements
+and result sets, OK/ERR/EOF packets, and server-side prepared
+statements (COM_STMT_PREPARE, COM_STMT_EXECUTE) with binary result
+rows, through Cursor.execute_prepared().  Not supported: SSL,
+compression, LOAD DATA LOCAL, server-side cursors (COM_STMT_FETCH),
+and the caching_sha2_password and sha256_password plugins.
+"""
+
+import errno
+import datetime
+import re
+import select
+import socket
+import struct
+import time
+import logging
+from collections import deque, OrderedDict
+from decimal import Decimal
+from hashlib import sha1
+
+log = logging.getLogger("dbx_mysqlproto")
+#log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+
+try:
+    from _mysql_exceptions import Warning, Error, InterfaceError, DataError, \
+         DatabaseError, OperationalError, IntegrityError, InternalError, \
+         NotSupportedError, ProgrammingError
+except ImportError:
+    class Error(StandardError): pass
+    class Warning(StandardError): pass
+    class InterfaceError(Error): pass
+    class DatabaseError(Error): pass
+    class DataError(DatabaseError): pass
+    class OperationalError(DatabaseError): pass
+    class IntegrityError(DatabaseError): pass
+    class InternalError(DatabaseError): pass
+    class ProgrammingError(DatabaseError): pass
+    class NotSupportedError(DatabaseError): pass
+
+# From MySQLdb.constants, which can't be imported without _mysql.
+class FIELD_TYPE:
+    DECIMAL = 0
+    TINY = 1
+    SHORT = 2
+    LONG = 3
+    FLOAT = 4
+    DOUBLE = 5
+    NULL = 6
+    TIMESTAMP = 7
+    LONGLONG = 8
+    INT24 = 9
+    DATE = 10
+    TIME = 11
+    DATETIME = 12
+    YEAR = 13
+    NEWDATE = 14
+    VARCHAR = 15
+    BIT = 16
+    NEWDECIMAL = 246
+    ENUM = 247
+    SET = 248
+    TINY_BLOB = 249
+    MEDIUM_BLOB = 250
+    LONG_BLOB = 251
+    BLOB = 252
+    VAR_STRING = 253
+    STRING = 254
+    GEOMETRY = 255
+
+class FLAG:
+    NOT_NULL = 1
+    PRI_KEY = 2
+    UNSIGNED = 32
+    BINARY = 128
+    SET = 2048
+
+class CLIENT:
+    LONG_PASSWORD = 1
+    FOUND_ROWS = 2
+    LONG_FLAG = 4
+    CONNECT_WITH_DB = 8
+    PROTOCOL_41 = 512
+    TRANSACTIONS = 8192
+    SECURE_CONNECTION = 32768
+    MULTI_STATEMENTS = 65536
+    MULTI_RESULTS = 131072
+    PLUGIN_AUTH = 524288
+
+_SERVER_MORE_RESULTS_EXISTS = 8
+
+_COM_QUIT = '\x01'
+_COM_QUERY = '\x03'
+_COM_PING = '\x0e'
+_COM_STMT_PREPARE = '\x16'
+_COM_STMT_EXECUTE = '\x17'
+_COM_STMT_CLOSE = '\x19'
+
+_MAX_PACKET = 0xffffff
+
+# Character set names to collation ids for the handshake, and to the
+# Python codec for decoding.
+_charsets = {
+    'latin1': (8, 'latin1'),
+    'utf8': (33, 'utf8'),
+    'utf8mb4': (45, 'utf8'),
+    'binary': (63, None),
+    }
+_BINARY_CHARSET = 63
+
+_string_types = (FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING,
+                 FIELD_TYPE.ENUM, FIELD_TYPE.SET, FIELD_TYPE.TINY_BLOB,
+                 FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB)
+
+# Client error numbers, as used by libmysqlclient.
+CR_CONNECTION_ERROR = 2002
+CR_CONN_HOST_ERROR = 2003
+CR_SERVER_GONE_ERROR = 2006
+CR_SERVER_LOST = 2013
+CR_MALFORMED_PACKET = 2027
+
+# Server error numbers mapped the way _mysql maps them.
+_programming_errors = (1007, 1064, 1102, 1103, 1110, 1111, 1112, 1113,
+                       1146, 1149, 1179)
+_integrity_errors = (1048, 1062, 1169, 1171, 1451, 1452)
+_not_supported_errors = (1196, 1235, 1286, 1289)
+
+def _errorClass(errnum):
+    if errnum in _programming_errors:
+        return ProgrammingError
+    elif errnum in _integrity_errors:
+        return IntegrityError
+    elif errnum in _not_supported_errors:
+        return NotSupportedError
+    elif errnum < 1000:
+        return InternalError
+    return OperationalError
+
+
+# Decoding values from text result rows
+
+def _date(s):
+    try:
+        y, m, d = s.split('-')
+        return datetime.date(int(y), int(m), int(d))
+    except ValueError:
+        return None
+
+def _time_parts(s):
+    if '.' in s:
+        s, frac = s.split('.')
+        microseconds = int((frac + '000000')[:6])
+    else:
+        microseconds = 0
+    h, m, s = s.split(':')
+    return int(h), int(m), int(s), microseconds
+
+def _datetime(s):
+    if ' ' not in s:
+        return _date(s)
+    try:
+        d, t = s.split(' ', 1)
+        y, m, dd = d.split('-')
+        hh, mm, ss, us = _time_parts(t)
+        return datetime.datetime(int(y), int(m), int(dd), hh, mm, ss, us)
+    except ValueError:
+        return None
+
+def _timedelta(s):
+    try:
+        negative = s.startswith('-')
+        h, m, sec, us = _time_parts(s.lstrip('-'))
+        td = datetime.timedelta(hours=h, minutes=m, seconds=sec,
+                                microseconds=us)
+    except ValueError:
+        return None
+    if negative:
+        return -td
+    return td
+
+decoders = {
+    FIELD_TYPE.TINY: int,
+    FIELD_TYPE.SHORT: int,
+    FIELD_TYPE.LONG: long,
+    FIELD_TYPE.INT24: int,
+    FIELD_TYPE.LONGLONG: long,
+    FIELD_TYPE.YEAR: int,
+    FIELD_TYPE.FLOAT: float,
+    FIELD_TYPE.DOUBLE: float,
+    FIELD_TYPE.DECIMAL: Decimal,
+    FIELD_TYPE.NEWDECIMAL: Decimal,
+    FIELD_TYPE.DATE: _date,
+    FIELD_TYPE.DATETIME: _datetime,
+    FIELD_TYPE.TIMESTAMP: _datetime,
+    FIELD_TYPE.TIME: _timedelta,
+    }
+
+
+# Decoding values from binary result rows.  Each value is turned into
+# the text the server would have sent for it in a text result, then
+# given to the same converter, so execute_prepared() returns what
+# execute() would; integer and floating point columns skip the text
+# when their converter is int, long or float.
+
+_binary_int_formats = {
+    FIELD_TYPE.TINY: 'b',
+    FIELD_TYPE.SHORT: 'h',
+    FIELD_TYPE.YEAR: 'h',
+    FIELD_TYPE.INT24: 'i',
+    FIELD_TYPE.LONG: 'i',
+    FIELD_TYPE.LONGLONG: 'q',
+    }
+_binary_temporal_types = (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE,
+                          FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP)
+
+def _fraction(decimals, microseconds):
+    if 0 < decimals <= 6:
+        return '.' + ('%06d' % (microseconds,))[:decimals]
+    return ''
+
+def _binary_decoder(field_type, flags, decimals, conv):
+    """ Return a function taking a binary row payload and an offset and
+    returning (value, new offset) for a column of field_type.
+    """
+    fmt = _binary_int_formats.get(field_type)
+    if fmt is not None:
+        if flags & FLAG.UNSIGNED:
+            fmt = fmt.upper()
+        unpack, size = struct.Struct('<' + fmt).unpack_from, struct.calcsize(fmt)
+        if conv in (int, long):
+            return lambda data, pos: (conv(unpack(data, pos)[0]), pos + size)
+        format_value = str
+    elif field_type == FIELD_TYPE.DOUBLE:
+        unpack, size = struct.Struct('<d').unpack_from, 8
+        if conv is float:
+            return lambda data, pos: (unpack(data, pos)[0], pos + 8)
+        format_value = repr
+    elif field_type == FIELD_TYPE.FLOAT:
+        # FLOAT is single precision: give the digits the server would.
+        unpack, size = struct.Struct('<f').unpack_from, 4
+        format_value = lambda value: '%.7g' % (value,)
+    elif field_type in _binary_temporal_types:
+        date_only = field_type in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE)
+        def decode(data, pos):
+            length = ord(data[pos])
+            parts = [0] * 7
+            if length >= 4:
+                parts[:3] = struct.unpack_from('<HBB', data, pos + 1)
+            if length >= 7:
+                parts[3:6] = struct.unpack_from('<BBB', data, pos + 5)
+            if length >= 11:
+                parts[6] = struct.unpack_from('<I', data, pos + 8)[0]
+            if date_only:
+                value = '%04d-%02d-%02d' % tuple(parts[:3])
+            else:
+                value = ('%04d-%02d-%02d %02d:%02d:%02d' % tuple(parts[:6])
+                         + _fraction(decimals, parts[6]))
+            if conv is not None:
+                value = conv(value)
+            return value, pos + 1 + length
+        return decode
+    elif field_type == FIELD_TYPE.TIME:
+        def decode(data, pos):
+            length = ord(data[pos])
+            negative, days, hours, minutes, seconds, microseconds = \
+                      0, 0, 0, 0, 0, 0
+            if length >= 8:
+                negative, days, hours, minutes, seconds = \
+                          struct.unpack_from('<BIBBB', data, pos + 1)
+            if length >= 12:
+                microseconds = struct.unpack_from('<I', data, pos + 9)[0]
+            value = '%s%02d:%02d:%02d%s' % (negative and '-' or '',
+                                            days * 24 + hours, minutes, seconds,
+                                            _fraction(decimals, microseconds))
+            if conv is not None:
+                value = conv(value)
+            return value, pos + 1 + length
+        return decode
+    else:
+        # Strings, DECIMAL, BIT, ENUM, SET and the rest are sent as text.
+        if conv is None:
+            return _read_lenenc_str
+        def decode(data, pos):
+            value, pos = _read_lenenc_str(data, pos)
+            return conv(value), pos
+        return decode
+    if conv is None:
+        return lambda data, pos: (format_value(unpack(data, pos)[0]), pos + size)
+    return lambda data, pos: (conv(format_value(unpack(data, pos)[0])),
+                              pos + size)
+
+def _binary_row_format(columns):
+    """ Return a struct format for a whole binary row of columns, a list
+    of (field_type, flags, conv), when every column is a fixed-width
+    number that _binary_decoder would hand back unconverted; else None.
+    """
+    fmt = '<'
+    for field_type, flags, conv in columns:
+        if field_type == FIELD_TYPE.DOUBLE and conv is float:
+            fmt += 'd'
+        elif field_type in _binary_int_formats and conv in (int, long):
+            c = _binary_int_formats[field_type]
+            fmt += flags & FLAG.UNSIGNED and c.upper() or c
+        else:
+            return None
+    return fmt
+
+
+# Encoding query parameters
+
+_escape_map = {'\0': '\\0', '\n': '\\n', '\r': '\\r', '\\': '\\\\',
+               "'": "\\'", '"': '\\"', '\x1a': '\\Z'}
+_escape_re = re.compile(r'[\0\n\r\\\'"\x1a]')
+
+def escape_string(s):
+    return _escape_re.sub(lambda m: _escape_map[m.group(0)], s)
+
+def _timedelta_text(td):
+    seconds = td.days * 86400 + td.seconds
+    return "%d:%02d:%02d.%06d" % (seconds // 3600, seconds // 60 % 60,
+                                  seconds % 60, td.microseconds)
+
+def _lenenc(n):
+    if n < 0xfb:
+        return chr(n)
+    elif n < 0x10000:
+        return '\xfc' + struct.pack('<H', n)
+    elif n < 0x1000000:
+        return '\xfd' + struct.pack('<I', n)[:3]
+    return '\xfe' + struct.pack('<Q', n)
+
+_placeholder_re = re.compile(r'%([s%])')
+
+def _placeholders(query):
+    """ query with execute()'s %s placeholders as the server's ?. """
+    return _placeholder_re.sub(lambda m: m.group(1) == 's' and '?' or '%',
+                               query)
+
+_param_null = chr(FIELD_TYPE.NULL) + '\0'
+_param_longlong = chr(FIELD_TYPE.LONGLONG) + '\0'
+_param_double = chr(FIELD_TYPE.DOUBLE) + '\0'
+_param_string = chr(FIELD_TYPE.VAR_STRING) + '\0'
+_pack_longlong = struct.Struct('<q').pack
+_pack_double = struct.Struct('<d').pack
+_longlong_min, _longlong_max = -2 ** 63, 2 ** 63 - 1
+
+def _encode_params(args, encoding):
+    """ The NULL bitmap, types and values of a COM_STMT_EXECUTE.
+    Integers and floats are sent as such, everything else as text.
+    """
+    if not args:
+        return ''
+    nulls = [0] * ((len(args) + 7) // 8)
+    types = []
+    values = []
+    for i, arg in enumerate(args):
+        if arg is None:
+            nulls[i // 8] |= 1 << (i % 8)
+            types.append(_param_null)
+        elif isinstance(arg, str):
+            types.append(_param_string)
+            values.append(_lenenc(len(arg)) + arg)
+        elif (isinstance(arg, (int, long))
+              and _longlong_min <= arg <= _longlong_max):
+            # bool is an int too.
+            types.append(_param_longlong)
+            values.append(_pack_longlong(arg))
+        elif isinstance(arg, float):
+            types.append(_param_double)
+            values.append(_pack_double(arg))
+        else:
+            if isinstance(arg, unicode):
+                arg = arg.encode(encoding or 'utf8')
+            elif isinstance(arg, datetime.datetime):
+                arg = arg.isoformat(' ')
+            elif isinstance(arg, (datetime.date, datetime.time)):
+                arg = arg.isoformat()
+            elif isinstance(arg, datetime.timedelta):
+                arg = _timedelta_text(arg)
+            else:
+                arg = str(arg)
+            types.append(_param_string)
+            values.append(_lenenc(len(arg)) + arg)
+    # new_params_bound_flag: the types follow.
+    return ''.join(map(chr, nulls)) + '\1' + ''.join(types) + ''.join(values)
+
+
+# Packet field readers: each takes the payload and an offset and
+# returns (value, new offset).
+
+def _read_lenenc_int(data, pos):
+    c = ord(data[pos])
+    if c < 0xfb:
+        return c, pos + 1
+    elif c == 0xfb:
+        return None, pos + 1
+    elif c == 0xfc:
+        return struct.unpack('<H', data[pos + 1:pos + 3])[0], pos + 3
+    elif c == 0xfd:
+        return struct.unpack('<I', data[pos + 1:pos + 4] + '\0')[0], pos + 4
+    return struct.unpack('<Q', data[pos + 1:pos + 9])[0], pos + 9
+
+def _read_lenenc_str(data, pos):
+    n, pos = _read_lenenc_int(data, pos)
+    if n is None:
+        return None, pos
+    return data[pos:pos + n], pos + n
+
+def _read_nul_str(data, pos):
+    end = data.index('\0', pos)
+    return data[pos:end], end + 1
+
+def _scramble_native_password(password, salt):
+    """ The mysql_native_password auth response:
+    SHA1(password) XOR SHA1(salt + SHA1(SHA1(password)))
+    """
+    if not password:
+        return ''
+    stage1 = sha1(password).digest()
+    stage2 = sha1(stage1).digest()
+    mix = sha1(salt + stage2).digest()
+    return ''.join([chr(ord(a) ^ ord(b)) for a, b in zip(stage1, mix)])
+
+
+class Result(object):
+    """ One result set, or the OK of a statement without one.  rows
+    grows as row packets arrive; complete is set at the closing EOF.
+    """
+    def __init__(self):
+        self.description = None
+        self.description_flags = None
+        self.description_charsets = None
+        self.rows = []
+        self.affected_rows = 0
+        self.insert_id = 0
+        self.warning_count = 0
+        self.info = ''
+        self.complete = False
+        # For unbuffered results: reading stops while row_limit rows
+        # past the consumed ones are waiting to be fetched.
+        self.row_limit = None
+        self.consumed = 0
+
+
+class Request(object):
+    """ A command sent on a Connection.  results fills in as the
+    server answers; done is set when the command is over, with error
+    set if it failed.  Callbacks run on the thread running the Loop.
+    """
+    def __init__(self):
+        self.results = []
+        self.done = False
+        self.error = None
+        # row_limit is given to each result; if discard is set, rows
+        # are read and dropped.
+        self.row_limit = None
+        self.discard = False
+        # The Statement, for a COM_STMT_PREPARE.
+        self.statement = None
+        self._callbacks = []
+
+    def add_done_callback(self, fn):
+        if self.done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def _finish(self, error=None):
+        if self.done:
+            return
+        self.error = error
+        self.done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except:
+                log.exception("Request callback failed")
+
+
+class Statement(object):
+    """ A statement prepared on the server, as Connection.prepare()
+    returns it.
+    """
+    def __init__(self, stmt_id, param_count):
+        self.stmt_id = stmt_id
+        self.param_count = param_count
+
+
+class Loop(object):
+    """ Drives the sockets of the Connections registered with it.
+    A Loop and its Connections must only be used from one thread.
+    """
+    def __init__(self):
+        self._conns = set()
+
+    def register(self, conn):
+        self._conns.add(conn)
+
+    def unregister(self, conn):
+        self._conns.discard(conn)
+
+    def run_once(self, timeout=None):
+        readers = [c for c in self._conns if c._wants_read()]
+        writers = [c for c in self._conns if c._wants_write()]
+        if not readers and not writers:
+            return
+        try:
+            r, w, x = select.select(readers, writers, [], timeout)
+        except select.error, ex:
+            if ex.args[0] == errno.EINTR:
+                return
+            raise
+        for conn in w:
+            conn._handle_write()
+        for conn in r:
+            if conn in self._conns:
+                conn._handle_read()
+
+    def run_until(self, predicate, timeout=None):
+        """ Run the loop until predicate() is true.  Returns False if
+        timeout seconds pass first.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not predicate():
+            if not self._conns:
+                raise InterfaceError(0, "No connections to wait on")
+            if timeout is None:
+                self.run_once()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.run_once(remaining)
+        return True
+
+    def wait(self, *requests, **kwargs):
+        """ Run the loop until all the given Requests are done.
+        Accepts a timeout keyword, as for run_until.
+        """
+        return self.run_until(lambda: all([r.done for r in requests]),
+                              kwargs.get('timeout'))
+
+
+class Connection(object):
+    """ A connection to a MySQL server.  The constructor blocks until
+    the handshake is over (or connect_timeout passes), running the loop,
+    which may be shared with other connections.
+    """
+    default_cursor = None   # set to Cursor below
+    # Prepared statements kept open per connection; the least recently
+    # used one is closed to make room.
+    max_statements = 64
+
+    def __init__(self, host='localhost', user='', passwd='', db='',
+                 port=3306, unix_socket=None, connect_timeout=None,
+                 conv=None, charset='utf8', use_unicode=False,
+                 client_flag=0, read_timeout=None, loop=None,
+                 lazy_warnings=False, abort_on_close=False, **kwargs):
+        if kwargs:
+            log.debug("Connection: ignoring arguments %s", kwargs.keys())
+        self.loop = loop or Loop()
+        self.host = host
+        self.user = user
+        self.read_timeout = read_timeout
+        self.use_unicode = use_unicode
+        self.charset = charset
+        self.lazy_warnings = lazy_warnings
+        self.abort_on_close = abort_on_close
+        self.close_stats = {'aborted': 0, 'rows_read_before_abort': 0}
+        # For abort_query's second connection.
+        self._connect_args = dict(host=host, user=user, passwd=passwd,
+                                  port=port, unix_socket=unix_socket,
+                                  connect_timeout=connect_timeout,
+                                  charset=charset)
+        self._charset_id, self.encoding = _charsets.get(charset, _charsets['utf8'])
+        self.decoders = conv is None and decoders or conv
+        self._client_flag = (client_flag | CLIENT.LONG_PASSWORD
+                             | CLIENT.LONG_FLAG | CLIENT.PROTOCOL_41
+                             | CLIENT.TRANSACTIONS | CLIENT.SECURE_CONNECTION
+                             | CLIENT.MULTI_STATEMENTS | CLIENT.MULTI_RESULTS
+                             | CLIENT.PLUGIN_AUTH)
+        if db:
+            self._client_flag |= CLIENT.CONNECT_WITH_DB
+        self._inbuf = ''
+        self._partial = ''
+        self._out = []
+        self._seq = 0
+        self._ops = deque()
+        self._current = None
+        self._reading = None
+        self.server_version = None
+        self.server_capabilities = 0
+        self._thread_id = None
+        self._last = Result()
+        self._statements = OrderedDict()
+
+        if unix_socket:
+            family, address = socket.AF_UNIX, unix_socket
+            where = unix_socket
+        else:
+            family, address = socket.AF_INET, (host or 'localhost', int(port or 3306))
+            where = host
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.setblocking(0)
+        if family == socket.AF_INET:
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = self._sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            self._sock.close()
+            raise OperationalError(CR_CONN_HOST_ERROR,
+                                   "Can't connect to MySQL server on %r (%d)"
+                                   % (where, err))
+        self._where = where
+        self._connecting = True
+        self.loop.register(self)
+        request = self._submit(self._handshake, user, passwd or '', db or '')
+        if not self.loop.wait(request, timeout=connect_timeout):
+            self._close_socket()
+            raise OperationalError(CR_CONN_HOST_ERROR,
+                                   "Can't connect to MySQL server on %r (timed out)"
+                                   % (where,))
+        if request.error:
+            self._close_socket()
+            raise request.error
+        self._transactional = self.server_capabilities & CLIENT.TRANSACTIONS
+        if self._transactional:
+            # As MySQLdb does.
+            self.autocommit(False)
+
+    # Socket handling, called by the Loop
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def _wants_read(self):
+        if self._sock is None or self._connecting:
+            return False
+        result = self._reading
+        if result is not None and result.row_limit is not None and not self._ops:
+            # Leave the rest of an unbuffered result on the server until
+            # the cursor catches up.  A queued command needs the result
+            # read to the end, so then it's buffered instead.
+            return len(result.rows) - result.consumed < result.row_limit
+        return True
+
+    def _wants_write(self):
+        return self._sock is not None and (self._connecting or bool(self._out))
+
+    def _handle_write(self):
+        if self._connecting:
+            err = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._lost(OperationalError(CR_CONN_HOST_ERROR,
+                           "Can't connect to MySQL server on %r (%d)"
+                           % (self._where, err)))
+                return
+            self._connecting = False
+            if not self._out:
+                return
+        data = ''.join(self._out)
+        try:
+            sent = self._sock.send(data)
+        except socket.error, ex:
+            if ex.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR):
+                return
+            self._lost(OperationalError(CR_SERVER_GONE_ERROR,
+                                        "MySQL server has gone away (%s)" % (ex,)))
+            return
+        if sent < len(data):
+            self._out = [data[sent:]]
+        else:
+            self._out = []
+
+    def _handle_read(self):
+        try:
+            data = self._sock.recv(65536)
+        except socket.error, ex:
+            if ex.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            self._lost(OperationalError(CR_SERVER_LOST,
+                                        "Lost connection to MySQL server during query"))
+            return
+        self._inbuf += data
+        inbuf = self._inbuf
+        pos = 0
+        while len(inbuf) - pos >= 4:
+            header = inbuf[pos:pos + 4]
+            length = struct.unpack('<I', header[:3] + '\0')[0]
+            if len(inbuf) - pos - 4 < length:
+                break
+            self._seq = (ord(header[3]) + 1) & 0xff
+            payload = inbuf[pos + 4:pos + 4 + length]
+            pos += 4 + length
+            if length == _MAX_PACKET:
+                self._partial += payload
+                continue
+            if self._partial:
+                payload, self._partial = self._partial + payload, ''
+            self._deliver(payload)
+            if self._sock is None:
+                return
+        self._inbuf = inbuf[pos:]
+
+    def _send_packet(self, payload):
+        while True:
+            chunk, payload = payload[:_MAX_PACKET], payload[_MAX_PACKET:]
+            self._out.append(struct.pack('<I', len(chunk))[:3]
+                             + chr(self._seq) + chunk)
+            self._seq = (self._seq + 1) & 0xff
+            if len(chunk) < _MAX_PACKET:
+                break
+
+    # Commands are generators: started with next(), they send their
+    # command, then are sent each packet of the reply until they stop.
+
+    def _submit(self, command, *args):
+        request = Request()
+        if self._sock is None:
+            request._finish(InterfaceError(0, "Connection is closed"))
+            return request
+        self._ops.append((command, args, request))
+        if self._current is None:
+            self._start_next()
+        return request
+
+    def _start_next(self):
+        self._current = None
+        while self._ops and self._sock is not None:
+            command, args, request = self._ops.popleft()
+            gen = command(request, *args)
+            try:
+                gen.next()
+            except StopIteration:
+                request._finish()
+                continue
+            except Error, ex:
+                request._finish(ex)
+                continue
+            self._current = (gen, request)
+            return
+
+    def _deliver(self, payload):
+        if self._current is None:
+            self._lost(InterfaceError(CR_MALFORMED_PACKET,
+                                      "Packet received with no command running"))
+            return
+        gen, request = self._current
+        try:
+            gen.send(payload)
+            return
+        except StopIteration:
+            request._finish()
+        except (IndexError, ValueError, struct.error), ex:
+            self._lost(InterfaceError(CR_MALFORMED_PACKET,
+                                      "Malformed packet: %s" % (ex,)))
+            return
+        except Error, ex:
+            self._lost(ex)
+            return
+        self._start_next()
+
+    def _lost(self, error):
+        """ Fail the running and queued commands, and close the socket.
+        """
+        self._close_socket()
+        self._reading = None
+        pending = []
+        if self._current is not None:
+            pending.append(self._current[1])
+            self._current = None
+        while self._ops:
+            pending.append(self._ops.popleft()[2])
+        for request in pending:
+            request._finish(error)
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self.loop.unregister(self)
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+            self._sock = None
+
+    def _server_error(self, payload):
+        errnum = struct.unpack('<H', payload[1:3])[0]
+        if payload[3:4] == '#':
+            message = payload[9:]
+        else:
+            message = payload[3:]
+        return _errorClass(errnum)(errnum, message)
+
+    def _handshake(self, request, user, passwd, db):
+        payload = yield
+        if payload[0] == '\xff':
+            raise self._server_error(payload)
+        if ord(payload[0]) != 10:
+            raise OperationalError(CR_MALFORMED_PACKET,
+                                   "Unsupported protocol version %d" % ord(payload[0]))
+        self.server_version, pos = _read_nul_str(payload, 1)
+        self._thread_id = struct.unpack('<I', payload[pos:pos + 4])[0]
+        salt = payload[pos + 4:pos + 12]
+        pos += 13
+        capabilities = struct.unpack('<H', payload[pos:pos + 2])[0]
+        pos += 2
+        plugin = 'mysql_native_password'
+        if len(payload) > pos:
+            capabilities |= struct.unpack('<H', payload[pos + 3:pos + 5])[0] << 16
+            salt_len = ord(payload[pos + 5])
+            pos += 16
+            if capabilities & CLIENT.SECURE_CONNECTION:
+                rest = max(13, salt_len - 8)
+                salt += payload[pos:pos + rest].rstrip('\0')
+                pos += rest
+            if capabilities & CLIENT.PLUGIN_AUTH and pos < len(payload):
+                plugin = payload[pos:].split('\0', 1)[0]
+        self.server_capabilities = capabilities
+        flags = self._client_flag & (capabilities | CLIENT.LONG_FLAG)
+        if plugin != 'mysql_native_password':
+            # Ask for mysql_native_password instead; the server sends an
+            # auth switch request if it agrees.
+            plugin = 'mysql_native_password'
+        auth = _scramble_native_password(passwd, salt)
+        response = [struct.pack('<IIB', flags, _MAX_PACKET, self._charset_id),
+                    '\0' * 23, user, '\0', chr(len(auth)), auth]
+        if flags & CLIENT.CONNECT_WITH_DB:
+            response += [db, '\0']
+        if flags & CLIENT.PLUGIN_AUTH:
+            response += [plugin, '\0']
+        self._send_packet(''.join(response))
+        payload = yield
+        if payload[0] == '\xfe':
+            plugin, pos = _read_nul_str(payload, 1)
+            if plugin != 'mysql_native_password':
+                raise NotSupportedError(0, "Authentication plugin %r isn't supported"
+                                        % (plugin,))
+            self._send_packet(_scramble_native_password(passwd,
+                                                        payload[pos:].rstrip('\0')))
+            payload = yield
+        if payload[0] == '\xff':
+            raise self._server_error(payload)
+        if payload[0] != '\0':
+            raise NotSupportedError(0, "Unsupported authentication exchange")
+
+    def _ping(self, request):
+        self._seq = 0
+        self._send_packet(_COM_PING)
+        payload = yield
+        if payload[0] == '\xff':
+            request._finish(self._server_error(payload))
+
+    def _converters(self, field_type, flags, charsetnr):
+        fn = self.decoders.get(field_type)
+        if isinstance(fn, list):
+            # MySQLdb style: [(flag mask, fn), ...]
+            for mask, item in fn:
+                if not mask or flags & mask:
+                    fn = item
+                    break
+            else:
+                fn = None
+        if (fn is None and self.use_unicode and field_type in _string_types
+            and charsetnr != _BINARY_CHARSET and self.encoding):
+            encoding = self.encoding
+            fn = lambda s: s.decode(encoding)
+        return fn
+
+    def _query(self, request, sql):
+        return self._command(request, _COM_QUERY + sql, False)
+
+    def _prepare(self, request, sql):
+        self._seq = 0
+        self._send_packet(_COM_STMT_PREPARE + sql)
+        payload = yield
+        if payload[0] == '\xff':
+            request._finish(self._server_error(payload))
+            return
+        stmt_id, column_count, param_count = struct.unpack('<IHH', payload[1:9])
+        request.statement = Statement(stmt_id, param_count)
+        # The parameter and column definitions, each list followed by an
+        # EOF; the columns are sent again with each result.
+        for count in (param_count, column_count):
+            if count:
+                for i in range(count + 1):
+                    payload = yield
+
+    def _close_statement(self, request, stmt_id):
+        # The server doesn't answer COM_STMT_CLOSE.
+        self._seq = 0
+        self._send_packet(_COM_STMT_CLOSE + struct.pack('<I', stmt_id))
+        return
+        yield
+
+    def _command(self, request, packet, binary):
+        """ Send packet, a COM_QUERY or COM_STMT_EXECUTE, and read its
+        results; binary for a COM_STMT_EXECUTE's binary rows.
+        """
+        self._seq = 0
+        self._send_packet(packet)
+        while True:
+            payload = yield
+            first = payload[0]
+            result = Result()
+            if first == '\xff':
+                # The command is over; the connection is still usable.
+                request._finish(self._server_error(payload))
+                return
+            elif first == '\0':
+                result.affected_rows, pos = _read_lenenc_int(payload, 1)
+                result.insert_id, pos = _read_lenenc_int(payload, pos)
+                status, result.warning_count = struct.unpack('<HH', payload[pos:pos + 4])
+                result.info = payload[pos + 4:]
+                result.complete = True
+                request.results.append(result)
+            elif first == '\xfb':
+                raise NotSupportedError(0, "LOAD DATA LOCAL isn't supported")
+            else:
+                column_count = _read_lenenc_int(payload, 0)[0]
+                description = []
+                description_flags = []
+                description_charsets = []
+                converters = []
+                columns = []
+                for i in range(column_count):
+                    payload = yield
+                    pos = 0
+                    for j in range(4):  # catalog, schema, table, org_table
+                        pos = _read_lenenc_str(payload, pos)[1]
+                    name, pos = _read_lenenc_str(payload, pos)
+                    pos = _read_lenenc_str(payload, pos)[1]  # org_name
+                    pos += 1  # length of the fixed fields
+                    charsetnr, length, field_type, flags, decimals = \
+                        struct.unpack('<HIBHB', payload[pos:pos + 10])
+                    description.append((name, field_type, None, length, length,
+                                        decimals, not (flags & FLAG.NOT_NULL)))
+                    description_flags.append(flags)
+                    description_charsets.append(charsetnr)
+                    conv = self._converters(field_type, flags, charsetnr)
+                    if binary:
+                        columns.append((field_type, flags, conv))
+                        conv = _binary_decoder(field_type, flags, decimals, conv)
+                    converters.append(conv)
+                payload = yield  # EOF after the column definitions
+                result.description = tuple(description)
+                result.description_flags = tuple(description_flags)
+                result.description_charsets = tuple(description_charsets)
+                result.row_limit = request.row_limit
+                request.results.append(result)
+                rows = result.rows
+                count = 0
+                if binary:
+                    # A 0 header, then the NULL bitmap, offset by 2.
+                    values_pos = 1 + (column_count + 9) // 8
+                    no_nulls = '\0' * (values_pos - 1)
+                    null_bits = [(1 + (i + 2) // 8, 1 << ((i + 2) % 8))
+                                 for i in range(column_count)]
+                    row_format = _binary_row_format(columns)
+                    if row_format is not None:
+                        unpack_row = struct.Struct(row_format).unpack_from
+                self._reading = result
+                while True:
+                    payload = yield
+                    first = payload[0]
+                    if first == '\xfe' and len(payload) < 9:
+                        result.warning_count, status = struct.unpack('<HH', payload[1:5])
+                        break
+                    elif first == '\xff':
+                        result.complete = True
+                        self._reading = None
+                        request._finish(self._server_error(payload))
+                        return
+                    count += 1
+                    if request.discard:
+                        continue
+                    row = []
+                    if binary:
+                        pos = values_pos
+                        if payload[1:pos] == no_nulls:
+                            if row_format is not None:
+                                rows.append(unpack_row(payload, pos))
+                                continue
+                            for decode in converters:
+                                value, pos = decode(payload, pos)
+                                row.append(value)
+                        else:
+                            for (byte, bit), decode in zip(null_bits, converters):
+                                if ord(payload[byte]) & bit:
+                                    row.append(None)
+                                else:
+                                    value, pos = decode(payload, pos)
+                                    row.append(value)
+                        rows.append(tuple(row))
+                        continue
+                    pos = 0
+                    for conv in converters:
+                        if payload[pos] == '\xfb':
+                            row.append(None)
+                            pos += 1
+                            continue
+                        value, pos = _read_lenenc_str(payload, pos)
+                        if conv is not None:
+                            value = conv(value)
+                        row.append(value)
+                    rows.append(tuple(row))
+                result.affected_rows = count
+                result.complete = True
+                self._reading = None
+            if not status & _SERVER_MORE_RESULTS_EXISTS:
+                return
+
+    # Public API
+
+    def query_async(self, sql):
+        """ Send sql (several statements are allowed) and return its
+        Request without waiting.
+        """
+        if isinstance(sql, unicode):
+            sql = sql.encode(self.encoding or 'utf8')
+        return self._submit(self._query, sql)
+
+    def prepare(self, sql):
+        """ Return the Statement for sql, preparing it on the server the
+        first time.  sql takes execute()'s %s placeholders.
+        """
+        if isinstance(sql, unicode):
+            sql = sql.encode(self.encoding or 'utf8')
+        statement = self._statements.pop(sql, None)
+        if statement is None:
+            request = self._submit(self._prepare, _placeholders(sql))
+            self._wait(lambda: request.done)
+            if request.error:
+                raise request.error
+            statement = request.statement
+            if len(self._statements) >= self.max_statements:
+                old = self._statements.popitem(last=False)[1]
+                self._submit(self._close_statement, old.stmt_id)
+        # Most recently used last.
+        self._statements[sql] = statement
+        return statement
+
+    def execute_async(self, statement, args=()):
+        """ Run a prepared Statement with args and return its Request
+        without waiting.
+        """
+        if len(args) != statement.param_count:
+            raise ProgrammingError("statement takes %d parameters, got %d"
+                                   % (statement.param_count, len(args)))
+        # No cursor, one iteration.
+        packet = (_COM_STMT_EXECUTE + struct.pack('<IBI', statement.stmt_id, 0, 1)
+                  + _encode_params(args, self.encoding))
+        return self._submit(self._command, packet, True)
+
+    def _wait(self, predicate):
+        if not self.loop.run_until(predicate, self.read_timeout):
+            self._lost(OperationalError(CR_SERVER_LOST,
+                       "Lost connection to MySQL server during query (timed out)"))
+
+    def query(self, sql):
+        """ Run sql and wait for all of its results.
+        """
+        request = self.query_async(sql)
+        self._wait(lambda: request.done)
+        if request.error:
+            raise request.error
+        if request.results:
+            self._last = request.results[-1]
+        return request
+
+    def cursor(self, cursorclass=None):
+        return (cursorclass or self.default_cursor)(self)
+
+    def literal(self, o):
+        """ o as an SQL literal.
+        """
+        if o is None:
+            return 'NULL'
+        elif isinstance(o, bool):
+            return o and '1' or '0'
+        elif isinstance(o, (int, long, Decimal)):
+            return str(o)
+        elif isinstance(o, float):
+            return '%.15g' % (o,)
+        elif isinstance(o, unicode):
+            return "'%s'" % escape_string(o.encode(self.encoding or 'utf8'))
+        elif isinstance(o, str):
+            return "'%s'" % escape_string(o)
+        elif isinstance(o, datetime.datetime):
+            return "'%s'" % (o.isoformat(' '),)
+        elif isinstance(o, (datetime.date, datetime.time)):
+            return "'%s'" % (o.isoformat(),)
+        elif isinstance(o, datetime.timedelta):
+            return "'%s'" % (_timedelta_text(o),)
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            return '(%s)' % ','.join([self.literal(item) for item in o])
+        return "'%s'" % escape_string(str(o))
+
+    def escape_string(self, s):
+        return escape_string(s)
+
+    def autocommit(self, flag):
+        self.query("SET autocommit=%d" % (flag and 1 or 0))
+
+    def commit(self):
+        self.query("COMMIT")
+
+    def rollback(self):
+        self.query("ROLLBACK")
+
+    def ping(self):
+        request = self._submit(self._ping)
+        self._wait(lambda: request.done)
+        if request.error:
+            raise request.error
+
+    def get_server_info(self):
+        return self.server_version
+
+    def thread_id(self):
+        return self._thread_id
+
+    def insert_id(self):
+        return self._last.insert_id
+
+    def affected_rows(self):
+        return self._last.affected_rows
+
+    def warning_count(self):
+        return self._last.warning_count
+
+    def show_warnings(self):
+        """ The warnings of the last statement, as (Level, Code, Message)
+        tuples.
+        """
+        request = self.query("SHOW WARNINGS")
+        return tuple(request.results and request.results[-1].rows or ())
+
+    def abort_query(self):
+        """ Kill the statement running on this connection with KILL QUERY,
+        sent on a second, short-lived connection.
+        """
+        side = Connection(loop=self.loop, **self._connect_args)
+        try:
+            side.query("KILL QUERY %d" % (self._thread_id,))
+        finally:
+            side.close()
+
+    def character_set_name(self):
+        return self.charset
+
+    def close(self):
+        if self._sock is None:
+            return
+        try:
+            # Best effort: a closed socket ends the session anyway.
+            self._sock.send('\x01\0\0\0' + _COM_QUIT)
+        except socket.error:
+            pass
+        self._lost(InterfaceError(0, "Connection is closed"))
+
+
+def connect(*args, **kwargs):
+    """ Open a Connection; takes the same arguments as MySQLdb.connect,
+    and an optional loop to share.
+    """
+    return Connection(*args, **kwargs)
+
+
+# array typecodes used by fetchcolumns() for numeric columns
+column_typecodes = {
+    FIELD_TYPE.TINY: 'l',
+    FIELD_TYPE.SHORT: 'l',
+    FIELD_TYPE.LONG: 'l',
+    FIELD_TYPE.INT24: 'l',
+    FIELD_TYPE.LONGLONG: 'l',
+    FIELD_TYPE.YEAR: 'l',
+    FIELD_TYPE.FLOAT: 'd',
+    FIELD_TYPE.DOUBLE: 'd',
+    }
+
+
+class BaseCursor(object):
+    """ The MySQLdb cursor API over a Connection.  Subclasses pick
+    whether results are read in full at execute time (Cursor) or as
+    rows are fetched (SSCursor), and whether rows are tuples or dicts.
+
+    The MySQLdb extensions dbx_mysqldb uses are here too: lazy_warnings,
+    warning_count and fetch_warnings(), fetchcolumns(), iterbatched(),
+    and, for unbuffered cursors, abort_on_close.  description_charsets
+    holds the character set number of each column (63 is binary),
+    which MySQLdb doesn't report.  An unbuffered cursor
+    keeps at most max_pending_rows rows it hasn't handed out (more if a
+    fetchmany() asks for more); the rest wait on the server.
+    """
+    _buffered = True
+    _dict_rows = False
+    max_pending_rows = 10000
+    batched_iteration = False
+    iter_block_bytes = 256 * 1024
+    max_iter_block_rows = 10000
+    close_drain_rows = 1000
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.description_flags = None
+        self.description_charsets = None
+        self.rowcount = -1
+        self.rownumber = 0
+        self.arraysize = 1
+        self.lastrowid = None
+        self.messages = []
+        self._request = None
+        self._result = None
+        self._result_index = 0
+        self._pos = 0
+        self._counted = None
+        self.lazy_warnings = connection.lazy_warnings
+        self.abort_on_close = connection.abort_on_close
+        self.warning_count = 0
+        self._unfetched_warnings = 0
+
+    def _check_executed(self):
+        if self._request is None:
+            raise ProgrammingError("execute() first")
+
+    def execute(self, query, args=None):
+        if self.connection is None:
+            raise ProgrammingError("cursor closed")
+        if isinstance(query, unicode):
+            query = query.encode(self.connection.encoding or 'utf8')
+        if args is not None:
+            literal = self.connection.literal
+            if isinstance(args, dict):
+                query = query % dict([(k, literal(v)) for k, v in args.items()])
+            else:
+                query = query % tuple([literal(arg) for arg in args])
+        self._drain()
+        return self._start(self.connection.query_async(query))
+
+    def execute_prepared(self, query, args=()):
+        """ Like execute(), with a sequence of args, but run as a
+        server-side prepared statement, which the connection keeps for
+        the next execute_prepared() of the same query.  Rows come back
+        in the binary protocol and are converted to what execute() would
+        return.
+        """
+        if self.connection is None:
+            raise ProgrammingError("cursor closed")
+        self._drain()
+        statement = self.connection.prepare(query)
+        return self._start(self.connection.execute_async(statement, tuple(args)))
+
+    def _start(self, request):
+        del self.messages[:]
+        self._unfetched_warnings = 0
+        self._request = request
+        if not self._buffered:
+            self._request.row_limit = self.max_pending_rows
+        self._result_index = 0
+        self._select_result()
+        return self.rowcount
+
+    def executemany(self, query, args):
+        rowcount = 0
+        for arg in args:
+            rowcount += self.execute(query, arg)
+        self.rowcount = rowcount
+        return rowcount
+
+    def _select_result(self):
+        request, index = self._request, self._result_index
+        if self._buffered:
+            ready = lambda: (request.done or (len(request.results) > index
+                                              and request.results[index].complete))
+        else:
+            ready = lambda: request.done or len(request.results) > index
+        self.connection._wait(ready)
+        if len(request.results) <= index:
+            self._result = None
+            self.description = self.description_flags = None
+            self.description_charsets = None
+            if request.error:
+                raise request.error
+            return False
+        result = self._result = request.results[index]
+        self.connection._last = result
+        self.description = result.description
+        self.description_flags = result.description_flags
+        self.description_charsets = result.description_charsets
+        self.rownumber = self._pos = 0
+        if result.complete:
+            self._completed()
+        else:
+            self.rowcount = -1
+        self.lastrowid = result.insert_id
+        return True
+
+    def _completed(self):
+        # Called once the current result has been read to the end.
+        result = self._result
+        self.rowcount = result.affected_rows
+        if self._counted is not result:
+            self._counted = result
+            self.warning_count += result.warning_count
+            self._unfetched_warnings += result.warning_count
+
+    def fetch_warnings(self):
+        """ Fetch the warnings of the last statement as (Level, Code,
+        Message) tuples, and append them to messages.  For an unbuffered
+        cursor, call this after the whole result has been fetched.
+        """
+        if not self._unfetched_warnings:
+            return ()
+        self._unfetched_warnings = 0
+        warnings = self.connection.show_warnings()
+        for w in warnings:
+            self.messages.append((Warning, w))
+        return warnings
+
+    def nextset(self):
+        self._check_executed()
+        self._result_index += 1
+        if self._select_result():
+            return 1
+        return None
+
+    def _drain(self):
+        # An unbuffered cursor's rows must be read before the next
+        # query; read them without keeping them.
+        request = self._request
+        if request is not None and not request.done:
+            request.discard = True
+            for result in request.results:
+                if not result.complete:
+                    result.row_limit = None
+                    del result.rows[:]
+            self.connection._wait(lambda: request.done)
+
+    def _available(self, n):
+        result = self._result
+        if not self._buffered and not result.complete:
+            if n is None:
+                result.row_limit = None
+                self.connection._wait(lambda: result.complete)
+            else:
+                result.row_limit = max(self.max_pending_rows, n)
+                self.connection._wait(lambda: result.complete
+                                      or len(result.rows) - self._pos >= n)
+                result.row_limit = self.max_pending_rows
+            if result.complete:
+                self._completed()
+        return len(result.rows) - self._pos
+
+    def _take(self, n):
+        result = self._result
+        if result is None or result.description is None:
+            return []
+        if n is None:
+            n = self._available(None)
+        else:
+            n = min(n, self._available(n))
+        rows = result.rows[self._pos:self._pos + n]
+        self._pos += n
+        if not self._buffered:
+            if self._pos > 1000:
+                # Let rows already handed out be freed.
+                del result.rows[:self._pos]
+                self._pos = 0
+            result.consumed = self._pos
+        self.rownumber += len(rows)
+        if self._dict_rows:
+            names = [d[0] for d in self.description]
+            rows = [dict(zip(names, row)) for row in rows]
+        return rows
+
+    def fetchone(self):
+        self._check_executed()
+        rows = self._take(1)
+        return rows and rows[0] or None
+
+    def fetchmany(self, size=None):
+        self._check_executed()
+        return self._take(size or self.arraysize)
+
+    def fetchall(self):
+        self._check_executed()
+        return self._take(None)
+
+    def fetchcolumns(self, use_numpy=False, block_rows=10000):
+        """ Fetch the remaining rows column by column, as MySQLdb's
+        cursor does: integer and floating point columns come back as
+        array.array objects (or NumPy arrays with use_numpy), other
+        columns and numeric ones holding NULLs as lists.
+        """
+        from array import array
+        self._check_executed()
+        if self._dict_rows:
+            raise NotSupportedError("fetchcolumns() requires tuple rows")
+        if not self.description:
+            return []
+        columns = []
+        for d in self.description:
+            typecode = column_typecodes.get(d[1])
+            if typecode:
+                columns.append(array(typecode))
+            else:
+                columns.append([])
+        while True:
+            rows = self.fetchmany(block_rows)
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                column = columns[i]
+                if type(column) is list:
+                    column.extend(values)
+                    continue
+                n = len(column)
+                try:
+                    column.extend(values)
+                except (TypeError, OverflowError):
+                    # array.extend() keeps what it added before failing.
+                    column = columns[i] = column.tolist()[:n]
+                    column.extend(values)
+        if use_numpy:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            if numpy is not None:
+                for i, column in enumerate(columns):
+                    if type(column) is not list:
+                        columns[i] = numpy.frombuffer(column,
+                                                      dtype=column.typecode)
+        return columns
+
+    def iterbatched(self):
+        """ Iterate over the remaining rows, taking them in blocks sized
+        from the width of the rows seen to hold about iter_block_bytes.
+        """
+        self._check_executed()
+        block_rows = self.arraysize
+        while True:
+            rows = self._take(block_rows)
+            if not rows:
+                return
+            block_rows = self._iter_block_rows(rows[0])
+            for row in rows:
+                yield row
+
+    def _iter_block_rows(self, row):
+        if isinstance(row, dict):
+            row = row.values()
+        width = 0
+        for value in row:
+            if isinstance(value, basestring):
+                width += len(value)
+            else:
+                width += 8
+        return max(1, min(self.max_iter_block_rows,
+                          self.iter_block_bytes // max(width, 1)))
+
+    def __iter__(self):
+        if self.batched_iteration:
+            return self.iterbatched()
+        return iter(self.fetchone, None)
+
+    def close(self):
+        connection = self.connection
+        if connection is not None and connection._sock is not None:
+            result = self._result
+            if (self.abort_on_close and not self._buffered
+                and result is not None and not result.complete):
+                rows = self._take(self.close_drain_rows)
+                if len(rows) == self.close_drain_rows and not result.complete:
+                    self._abort(connection)
+            self._drain()
+        self.connection = None
+        self._result = None
+
+    def _abort(self, connection):
+        try:
+            connection.abort_query()
+        except Error:
+            # Drain the result instead.
+            return
+        stats = connection.close_stats
+        stats['aborted'] += 1
+        stats['rows_read_before_abort'] += self.rownumber
+
+
+class Cursor(BaseCursor):
+    pass
+
+class DictCursor(BaseCursor):
+    _dict_rows = True
+
+class SSCursor(BaseCursor):
+    _buffered = False
+
+class SSDictCursor(BaseCursor):
+    _buffered = False
+    _dict_rows = True
+
+Connection.default_cursor = Cursor
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Times fetching DECIMAL, DATE, TIME and DATETIME columns through
+MySQLdb's default conversions, which build Decimal and datetime
+objects, against display_conversions, which leave them as text:
+
+    python test/bench_display_conversions.py [-n ROWS] [-r RUNS] [-p PLATFORM_PYLIB]
+
+The rows come from the stand-in server in mysqlstub, run in a child
+process so it doesn't share this process's interpreter lock.  Each
+run fetches all the rows with a buffered cursor; the best run of each
+is reported.
+"""
+
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def startServer(*args):
+    """ Start mysqlstub in a child process, with the command line
+    arguments args; return (process, host, port).
+    """
+    proc = subprocess.Popen([sys.executable, os.path.join(_here, 'mysqlstub.py')]
+                            + list(args),
+                            stdout=subprocess.PIPE)
+    host, port = proc.stdout.readline().split()
+    return proc, host, int(port)
+
+def _best(MySQLdb, host, port, conv, num_rows, runs):
+    conn = MySQLdb.connect(host=host, port=port, user='test', passwd='secret',
+                           conv=conv)
+    try:
+        best = None
+        for i in range(runs):
+            cu = conn.cursor()
+            start = time.time()
+            cu.execute("select temporal %d" % (num_rows,))
+            rows = cu.fetchall()
+            elapsed = time.time() - start
+            cu.close()
+            assert len(rows) == num_rows
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, rows[-1]
+    finally:
+        conn.close()
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", dest="num_rows", type="int", default=200000,
+                      help="rows per run (default 200,000)")
+    parser.add_option("-r", dest="runs", type="int", default=5,
+                      help="runs of each (default 5)")
+    parser.add_option("-p", dest="pylib",
+                      default=os.path.join(os.path.dirname(_here), "platform",
+                                           "Linux_x86_64-gcc3", "pylib27"),
+                      help="the platform directory holding MySQLdb")
+    opts, args = parser.parse_args(argv[1:])
+    sys.path.insert(0, opts.pylib)
+    import MySQLdb
+    from MySQLdb.converters import conversions, display_conversions
+
+    proc, host, port = startServer()
+    try:
+        print "%d rows of DECIMAL, DATE, TIME, DATETIME; best of %d" % (
+            opts.num_rows, opts.runs)
+        results = []
+        for label, conv in (("conversions", conversions),
+                            ("display", display_conversions)):
+            elapsed, sample = _best(MySQLdb, host, port, conv, opts.num_rows,
+                                    opts.runs)
+            results.append(elapsed)
+            print "%-12s %7.3fs  %6.2f usec/row  e.g. %r" % (
+                label, elapsed, elapsed * 1e6 / opts.num_rows, sample)
+        print "display_conversions takes %.0f%% of the time" % (
+            results[1] * 100 / results[0])
+    finally:
+        proc.kill()
+        proc.wait()
+
+if __name__ == "__main__":
+    main(sys.argv)
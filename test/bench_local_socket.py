@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Times talking to a local server over TCP against its Unix socket, the
+choice dbx_mysqldb makes for localhost connections when it finds the
+server's socket:
+
+    python test/bench_local_socket.py [-n CALLS] [-N ROWS] [-r RUNS]
+
+Three cases: opening and closing a connection (handshake and login), a
+small statement run over and over, like the explorer's lookups, and
+fetching a large result.  The server is mysqlstub in a child process
+(see bench_display_conversions), listening on both; the client is
+dbx_mysqlproto.  The stub's own work is the same either way, so what
+differs is the transport.  The best run of each is reported.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+
+from bench_display_conversions import startServer
+
+
+def _best(runs, fn):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# Each takes the function opening a connection, the count and a list of
+# the connections to close at the end, and returns the function to time.
+
+def _connects(connect, calls, conns):
+    def run():
+        for i in xrange(calls):
+            connect().close()
+    return run
+
+def _lookups(connect, calls, conns):
+    conn = connect()
+    conns.append(conn)
+    cu = conn.cursor()
+    def run():
+        for i in xrange(calls):
+            cu.execute("echo %s", (i,))
+            cu.fetchall()
+    return run
+
+def _rows(connect, num_rows, conns):
+    conn = connect()
+    conns.append(conn)
+    cu = conn.cursor()
+    def run():
+        cu.execute("select rows %s", (num_rows,))
+        assert len(cu.fetchall()) == num_rows
+    return run
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", dest="calls", type="int", default=5000,
+                      help="connections or statements per run (default 5,000)")
+    parser.add_option("-N", dest="num_rows", type="int", default=200000,
+                      help="rows per fetch run (default 200,000)")
+    parser.add_option("-r", dest="runs", type="int", default=5,
+                      help="runs of each (default 5)")
+    opts, args = parser.parse_args(argv[1:])
+    import dbx_mysqlproto
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'mysql.sock')
+    proc, host, port = startServer(path)
+    conns = []
+    try:
+        transports = (
+            ("tcp", lambda: dbx_mysqlproto.connect(host=host, port=port,
+                                                   user='test', passwd='secret')),
+            ("socket", lambda: dbx_mysqlproto.connect(unix_socket=path,
+                                                      user='test',
+                                                      passwd='secret')))
+        print "best of %d" % (opts.runs,)
+        for label, make, count, unit in (
+                ("connect", _connects, opts.calls, "conn"),
+                ("lookup", _lookups, opts.calls, "call"),
+                ("rows", _rows, opts.num_rows, "row")):
+            times = []
+            for transport, connect in transports:
+                elapsed = _best(opts.runs, make(connect, count, conns))
+                times.append(elapsed)
+                print "%-8s %-7s %7.3fs  %7.2f usec/%s" % (
+                    label, transport, elapsed, elapsed * 1e6 / count, unit)
+            print "%-8s the socket takes %.0f%% of the time" % (
+                label, times[1] * 100 / times[0])
+    finally:
+        for conn in conns:
+            conn.close()
+        proc.kill()
+        proc.wait()
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main(sys.argv)
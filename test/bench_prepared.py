@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Times dbx_mysqlproto's text protocol (Cursor.execute) against prepared
+statements with binary rows (Cursor.execute_prepared):
+
+    python test/bench_prepared.py [-n CALLS] [-N ROWS] [-r RUNS]
+
+Two cases: the latency of a small parameterized statement run over and
+over, like the explorer's getRawRow lookups and metadata queries, and
+fetching a large BIGINT result, where binary rows skip parsing numbers
+from text.  The server is mysqlstub in a child process (see
+bench_display_conversions).  Being Python, it takes longer to build a
+binary row than a text one, which a real server doesn't, so besides the
+elapsed time this reports the CPU time of this process alone: the
+client's share.  The best run of each is reported.
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+
+from bench_display_conversions import startServer
+
+
+def _cpu():
+    user, system = os.times()[:2]
+    return user + system
+
+def _best(runs, fn):
+    """ Return the best (elapsed, client CPU) times of runs calls. """
+    best_elapsed = best_cpu = None
+    for i in range(runs):
+        start, start_cpu = time.time(), _cpu()
+        fn()
+        elapsed, cpu = time.time() - start, _cpu() - start_cpu
+        if best_elapsed is None or elapsed < best_elapsed:
+            best_elapsed = elapsed
+        if best_cpu is None or cpu < best_cpu:
+            best_cpu = cpu
+    return best_elapsed, best_cpu
+
+def _lookups(cu, execute, calls):
+    def run():
+        for i in xrange(calls):
+            execute("echo %s %s", ("key", i))
+            cu.fetchall()
+    return run
+
+def _bigints(cu, execute, num_rows):
+    def run():
+        execute("select rows %s", (num_rows,))
+        assert len(cu.fetchall()) == num_rows
+    return run
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", dest="calls", type="int", default=5000,
+                      help="statements per latency run (default 5,000)")
+    parser.add_option("-N", dest="num_rows", type="int", default=200000,
+                      help="rows per fetch run (default 200,000)")
+    parser.add_option("-r", dest="runs", type="int", default=5,
+                      help="runs of each (default 5)")
+    opts, args = parser.parse_args(argv[1:])
+    import dbx_mysqlproto
+
+    proc, host, port = startServer()
+    try:
+        conn = dbx_mysqlproto.connect(host=host, port=port, user='test',
+                                      passwd='secret')
+        cu = conn.cursor()
+        print "best of %d" % (opts.runs,)
+        for label, make, count, unit in (
+                ("lookup", _lookups, opts.calls, "call"),
+                ("bigint rows", _bigints, opts.num_rows, "row")):
+            cpu_times = []
+            for protocol, execute in (("text", cu.execute),
+                                      ("prepared", cu.execute_prepared)):
+                elapsed, cpu = _best(opts.runs, make(cu, execute, count))
+                cpu_times.append(cpu)
+                print "%-12s %-9s %7.3fs %7.2f usec/%s  client CPU %6.2f usec/%s" % (
+                    label, protocol, elapsed, elapsed * 1e6 / count, unit,
+                    cpu * 1e6 / count, unit)
+            print "%-12s prepared takes %.0f%% of the client CPU time" % (
+                label, cpu_times[1] * 100 / cpu_times[0])
+        conn.close()
+    finally:
+        proc.kill()
+        proc.wait()
+
+if __name__ == "__main__":
+    main(sys.argv)
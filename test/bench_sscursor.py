@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Times iterating over an SSCursor row by row (next(), one fetch_row call
+per row) against iterbatched(), which fetches blocks of rows:
+
+    python test/bench_sscursor.py [-n ROWS] [-w WIDTH] [-p PLATFORM_PYLIB]
+
+The cursor is MySQLdb's own SSCursor, but its result is a stand-in
+whose fetch_row() hands out slices of rows built in memory, so what's
+measured is the cursor's per-row overhead, not the network or the
+server.  The real fetch_row is a C call with its own per-call cost, so
+the difference on a real connection is, if anything, larger.
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+class _Connection(object):
+    def errorhandler(self, cursor, errorclass, errorvalue):
+        raise errorclass(errorvalue)
+
+
+class _Result(object):
+    """ Hands out rows like _mysql's result object does. """
+    def __init__(self, row, num_rows):
+        self.row = row
+        self.remaining = num_rows
+
+    def fetch_row(self, maxrows=1, how=0):
+        if maxrows == 0:
+            maxrows = self.remaining
+        maxrows = min(maxrows, self.remaining)
+        self.remaining -= maxrows
+        return (self.row,) * maxrows
+
+
+def _cursor(cursors, conn, row, num_rows):
+    cu = cursors.SSCursor(conn)
+    cu._executed = "select ..."
+    cu._result = _Result(row, num_rows)
+    cu.rownumber = 0
+    return cu
+
+def _time(label, cu, iterate, num_rows):
+    start = time.time()
+    count = 0
+    for row in iterate(cu):
+        count += 1
+    elapsed = time.time() - start
+    assert count == num_rows, (label, count)
+    print "%-14s %8.3fs  %6.3f usec/row" % (label, elapsed,
+                                             elapsed * 1e6 / num_rows)
+    cu.connection = None    # nothing to close
+    return elapsed
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", dest="num_rows", type="int", default=10000000,
+                      help="rows to iterate over (default 10,000,000)")
+    parser.add_option("-w", dest="width", type="int", default=4,
+                      help="columns per row (default 4)")
+    parser.add_option("-p", dest="pylib",
+                      default=os.path.join(os.path.dirname(_here), "platform",
+                                           "Linux_x86_64-gcc3", "pylib27"),
+                      help="the platform directory holding MySQLdb")
+    opts, args = parser.parse_args(argv[1:])
+    sys.path.insert(0, opts.pylib)
+    from MySQLdb import cursors
+
+    conn = _Connection()
+    row = tuple(["value %d" % i for i in range(opts.width)])
+    print "%d rows of %d columns" % (opts.num_rows, opts.width)
+    by_row = _time("next()", _cursor(cursors, conn, row, opts.num_rows),
+                   iter, opts.num_rows)
+    batched = _time("iterbatched()", _cursor(cursors, conn, row, opts.num_rows),
+                    lambda cu: cu.iterbatched(), opts.num_rows)
+    print "iterbatched() takes %.0f%% of the time of next()" % (
+        batched * 100 / by_row)
+
+if __name__ == "__main__":
+    main(sys.argv)
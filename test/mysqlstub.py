@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+A stand-in MySQL server for the tests: it speaks enough of the protocol
+(handshake, mysql_native_password, COM_QUERY, COM_PING, COM_QUIT, and
+COM_STMT_PREPARE, COM_STMT_EXECUTE and COM_STMT_CLOSE with binary
+rows) to answer a fixed set of statements, so the drivers can be tested
+without a real server.  A prepared statement's ? placeholders are
+replaced by the literals of the parameters it's executed with, and the
+result is the statement's.
+
+Statements understood, one or more per query separated by ';':
+
+    SET ..., COMMIT, ROLLBACK   OK
+    select rows <n>             one BIGINT column n with the rows 0..n-1,
+                                streamed; KILL QUERY stops it
+    select types                a few rows of INT, VARCHAR and DATETIME
+    select temporal <n>         n rows of DECIMAL, DATE, TIME and DATETIME
+    select binary               a VARBINARY, a VARCHAR in a _bin collation
+                                and a BLOB
+    echo ...                    one row holding the statement
+    update ...                  OK, 3 rows affected, insert id 7
+    warn                        OK with 2 warnings
+    show warnings               the two warnings
+    kill query <id>             stops connection <id>'s running query
+
+Anything else gets a 1064 syntax error.
+
+Run as a script, it serves until killed and prints "<host> <port>"
+once it's listening, for benchmarks that want the server in another
+process; given a path, it listens on a Unix socket there as well:
+
+    python test/mysqlstub.py [SOCKET_PATH]
+"""
+
+import os
+import sys
+import socket
+import struct
+import threading
+from hashlib import sha1
+
+
+def _lenenc(n):
+    if n < 0xfb:
+        return chr(n)
+    elif n < 0x10000:
+        return '\xfc' + struct.pack('<H', n)
+    return '\xfd' + struct.pack('<I', n)[:3]
+
+def _lenenc_str(s):
+    return _lenenc(len(s)) + s
+
+_SERVER_STATUS_AUTOCOMMIT = 2
+_SERVER_MORE_RESULTS_EXISTS = 8
+
+_TYPE_LONG = 3
+_TYPE_DOUBLE = 5
+_TYPE_NULL = 6
+_TYPE_LONGLONG = 8
+_TYPE_DATE = 10
+_TYPE_TIME = 11
+_TYPE_DATETIME = 12
+_TYPE_NEWDECIMAL = 246
+_TYPE_BLOB = 252
+_TYPE_VAR_STRING = 253
+
+
+def _temporal_row(n):
+    return ('%d.%02d' % (n, n % 100),
+            '2010-%02d-%02d' % (n % 12 + 1, n % 28 + 1),
+            '%02d:%02d:%02d' % (n % 24, n % 60, n % 60),
+            '2010-01-02 03:%02d:%02d' % (n % 60, n % 60))
+
+
+_pack_int = struct.Struct('<i').pack
+_pack_longlong = struct.Struct('<q').pack
+
+def _binary_value(field_type, value):
+    """ value, as the text sent in a text result, in the binary protocol.
+    """
+    if field_type == _TYPE_LONG:
+        return _pack_int(int(value))
+    elif field_type == _TYPE_LONGLONG:
+        return _pack_longlong(int(value))
+    elif field_type in (_TYPE_DATE, _TYPE_DATETIME):
+        parts = [int(part) for part in value.replace(' ', '-').replace(':', '-').split('-')]
+        if not any(parts):
+            return '\0'
+        if field_type == _TYPE_DATE:
+            return '\4' + struct.pack('<HBB', *parts)
+        return '\7' + struct.pack('<HBBBBB', *parts)
+    elif field_type == _TYPE_TIME:
+        hours, minutes, seconds = [int(part) for part in value.lstrip('-').split(':')]
+        return '\x08' + struct.pack('<BIBBB', value.startswith('-'), hours // 24,
+                                     hours % 24, minutes, seconds)
+    return _lenenc_str(value)
+
+def _binary_rows(columns, rows):
+    """ Yield the binary protocol payload of each of rows. """
+    types = [column[1] for column in columns]
+    # A 0 header, then the NULL bitmap, offset by 2.
+    no_nulls = '\0' * (1 + (len(columns) + 9) // 8)
+    for row in rows:
+        if None not in row:
+            yield no_nulls + ''.join([_binary_value(field_type, value)
+                                      for field_type, value in zip(types, row)])
+            continue
+        nulls = [0] * ((len(columns) + 9) // 8)
+        values = []
+        for i, (field_type, value) in enumerate(zip(types, row)):
+            if value is None:
+                nulls[(i + 2) // 8] |= 1 << ((i + 2) % 8)
+            else:
+                values.append(_binary_value(field_type, value))
+        yield '\0' + ''.join(map(chr, nulls)) + ''.join(values)
+
+def _literal(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, str):
+        return "'%s'" % (value.replace('\\', '\\\\').replace("'", "\\'"),)
+    elif isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class _Killed(Exception):
+    pass
+
+
+class Server(object):
+    """ Listens on 127.0.0.1 (port chosen by the system), and on the
+    Unix socket unix_socket if given, and serves each client on its own
+    thread.
+    """
+    salt = 'abcdefghijklmnopqrst'
+
+    def __init__(self, user='test', password='secret', unix_socket=None):
+        self.user = user
+        self.password = password
+        self.unix_socket = unix_socket
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._kills = {}
+        self._sessions = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(20)
+        self.host, self.port = self._sock.getsockname()
+        self._listeners = [self._sock]
+        if unix_socket:
+            unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            unix_sock.bind(unix_socket)
+            unix_sock.listen(20)
+            self._listeners.append(unix_sock)
+        for listener in self._listeners:
+            thread = threading.Thread(target=self._serve, args=(listener,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def close(self):
+        """ Stop listening, and end the sessions still running.
+        """
+        for listener in self._listeners:
+            listener.close()
+        if self.unix_socket:
+            try:
+                os.remove(self.unix_socket)
+            except OSError:
+                pass
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session, thread in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join(5)
+
+    def _serve(self, listener):
+        while True:
+            try:
+                sock, address = listener.accept()
+            except socket.error:
+                return
+            if sock.family == socket.AF_INET:
+                # Each packet is a send of its own; don't let Nagle hold
+                # back the last one of a reply.
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                thread_id = self._next_id
+                self._next_id += 1
+                self._kills[thread_id] = threading.Event()
+            session = _Session(self, sock, thread_id)
+            thread = threading.Thread(target=session.run)
+            thread.setDaemon(True)
+            with self._lock:
+                self._sessions.append((session, thread))
+            thread.start()
+
+    def kill(self, thread_id):
+        with self._lock:
+            event = self._kills.get(thread_id)
+        if event is not None:
+            event.set()
+
+    def killed(self, thread_id):
+        with self._lock:
+            event = self._kills[thread_id]
+        if event.isSet():
+            event.clear()
+            return True
+        return False
+
+
+class _Session(object):
+    def __init__(self, server, sock, thread_id):
+        self.server = server
+        self.sock = sock
+        self.thread_id = thread_id
+        self.seq = 0
+        # Prepared statements: id => query
+        self.statements = {}
+        self.next_statement = 1
+        # Set while a prepared statement runs: rows go out binary.
+        self.binary = False
+
+    def send(self, payload):
+        self.sock.sendall(struct.pack('<I', len(payload))[:3]
+                          + chr(self.seq & 0xff) + payload)
+        self.seq += 1
+
+    def _recv_exactly(self, n):
+        data = ''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def recv(self):
+        header = self._recv_exactly(4)
+        self.seq = ord(header[3]) + 1
+        return self._recv_exactly(struct.unpack('<I', header[:3] + '\0')[0])
+
+    def run(self):
+        try:
+            if self.handshake():
+                self.commands()
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.sock.close()
+
+    def handshake(self):
+        salt = self.server.salt
+        capabilities = 0xffff | (0x000f << 16) | (1 << 19)
+        self.send(''.join([chr(10), '5.7.0-stub\0',
+                           struct.pack('<I', self.thread_id), salt[:8], '\0',
+                           struct.pack('<H', capabilities & 0xffff), chr(33),
+                           struct.pack('<H', _SERVER_STATUS_AUTOCOMMIT),
+                           struct.pack('<H', capabilities >> 16), chr(21),
+                           '\0' * 10, salt[8:], '\0',
+                           'mysql_native_password\0']))
+        packet = self.recv()
+        pos = 32
+        end = packet.index('\0', pos)
+        user = packet[pos:end]
+        pos = end + 1
+        auth = packet[pos + 1:pos + 1 + ord(packet[pos])]
+        stage1 = sha1(self.server.password).digest()
+        mask = sha1(salt + sha1(stage1).digest()).digest()
+        expected = ''.join([chr(ord(a) ^ ord(b)) for a, b in zip(stage1, mask)])
+        if user != self.server.user or auth != expected:
+            self.error(1045, '28000', "Access denied for user '%s'" % (user,))
+            return False
+        self.ok()
+        return True
+
+    def status(self, more):
+        return _SERVER_STATUS_AUTOCOMMIT | (more and _SERVER_MORE_RESULTS_EXISTS or 0)
+
+    def ok(self, more=False, affected=0, insert_id=0, warnings=0):
+        self.send('\0' + _lenenc(affected) + _lenenc(insert_id)
+                  + struct.pack('<HH', self.status(more), warnings))
+
+    def error(self, errnum, state, message):
+        self.send('\xff' + struct.pack('<H', errnum) + '#' + state + message)
+
+    def column(self, name, field_type, flags=0, charsetnr=33):
+        self.send(''.join([_lenenc_str('def'), _lenenc_str('db'),
+                           _lenenc_str('t'), _lenenc_str('t'),
+                           _lenenc_str(name), _lenenc_str(name), '\x0c',
+                           struct.pack('<HIBHB', charsetnr, 20, field_type,
+                                       flags, 0),
+                           '\0\0']))
+
+    def result(self, columns, rows, more=False):
+        self.send(_lenenc(len(columns)))
+        for column in columns:
+            self.column(*column)
+        self.send('\xfe\0\0' + struct.pack('<H', self.status(more)))
+        if self.binary:
+            payloads = _binary_rows(columns, rows)
+        else:
+            payloads = (''.join([value is None and '\xfb' or _lenenc_str(value)
+                                 for value in row])
+                        for row in rows)
+        for payload in payloads:
+            if self.server.killed(self.thread_id):
+                raise _Killed()
+            self.send(payload)
+        self.send('\xfe\0\0' + struct.pack('<H', self.status(more)))
+
+    def prepare(self, query):
+        stmt_id = self.next_statement
+        self.next_statement += 1
+        self.statements[stmt_id] = query
+        param_count = query.count('?')
+        # The result's columns aren't known until it runs.
+        self.send('\0' + struct.pack('<IHHxH', stmt_id, 0, param_count, 0))
+        if param_count:
+            for i in range(param_count):
+                self.column('?', _TYPE_VAR_STRING)
+            self.send('\xfe\0\0' + struct.pack('<H', self.status(False)))
+
+    def execute(self, packet):
+        stmt_id = struct.unpack('<I', packet[:4])[0]
+        query = self.statements.get(stmt_id)
+        if query is None:
+            self.error(1243, 'HY000', "Unknown prepared statement handler")
+            return
+        parts = query.split('?')
+        count = len(parts) - 1
+        pos = 9
+        nulls = packet[pos:pos + (count + 7) // 8]
+        pos += (count + 7) // 8 + 1
+        types = [ord(packet[pos + 2 * i]) for i in range(count)]
+        pos += 2 * count
+        values = []
+        for i, field_type in enumerate(types):
+            if ord(nulls[i // 8]) & (1 << (i % 8)) or field_type == _TYPE_NULL:
+                values.append(None)
+            elif field_type == _TYPE_LONGLONG:
+                values.append(struct.unpack('<q', packet[pos:pos + 8])[0])
+                pos += 8
+            elif field_type == _TYPE_DOUBLE:
+                values.append(struct.unpack('<d', packet[pos:pos + 8])[0])
+                pos += 8
+            else:
+                length = ord(packet[pos])
+                if length == 0xfc:
+                    length = struct.unpack('<H', packet[pos + 1:pos + 3])[0]
+                    pos += 2
+                values.append(packet[pos + 1:pos + 1 + length])
+                pos += 1 + length
+        statement = parts[0] + ''.join([_literal(value) + part for value, part
+                                        in zip(values, parts[1:])])
+        self.binary = True
+        try:
+            self.run_statements([statement])
+        finally:
+            self.binary = False
+
+    def commands(self):
+        while True:
+            packet = self.recv()
+            self.seq = 1
+            command = packet[0]
+            if command == '\x01':      # COM_QUIT
+                return
+            elif command == '\x0e':    # COM_PING
+                self.ok()
+                continue
+            elif command == '\x16':    # COM_STMT_PREPARE
+                self.prepare(packet[1:])
+                continue
+            elif command == '\x19':    # COM_STMT_CLOSE, not answered
+                self.statements.pop(struct.unpack('<I', packet[1:5])[0], None)
+                continue
+            # A KILL QUERY that came in while idle doesn't carry over.
+            self.server.killed(self.thread_id)
+            if command == '\x17':      # COM_STMT_EXECUTE
+                self.execute(packet[1:])
+            else:
+                self.run_statements([s.strip() for s in packet[1:].split(';')])
+
+    def run_statements(self, statements):
+        for i, statement in enumerate(statements):
+            more = i < len(statements) - 1
+            try:
+                if not self.statement(statement.lower(), statement, more):
+                    break
+            except _Killed:
+                self.error(1317, '70100', "Query execution was interrupted")
+                break
+
+    def statement(self, lowered, statement, more):
+        if lowered.startswith('set') or lowered in ('commit', 'rollback'):
+            self.ok(more)
+        elif lowered.startswith('select rows '):
+            count = int(lowered.split()[2])
+            self.result([('n', _TYPE_LONGLONG, 0)],
+                        ((str(n),) for n in xrange(count)), more)
+        elif lowered == 'select types':
+            self.result([('a', _TYPE_LONG, 3), ('b', _TYPE_VAR_STRING, 0),
+                         ('d', _TYPE_DATETIME, 0)],
+                        [('1', "x'y", '2020-01-02 03:04:05'),
+                         ('2', None, '0000-00-00 00:00:00')], more)
+        elif lowered.startswith('select temporal '):
+            count = int(lowered.split()[2])
+            self.result([('amount', _TYPE_NEWDECIMAL, 0), ('day', _TYPE_DATE, 0),
+                         ('at', _TYPE_TIME, 0), ('stamp', _TYPE_DATETIME, 0)],
+                        (_temporal_row(n) for n in xrange(count)), more)
+        elif lowered == 'select binary':
+            # BINARY_FLAG is set on all three; only the character set,
+            # 63 for binary, tells the varbinary from the _bin varchar.
+            self.result([('vb', _TYPE_VAR_STRING, 128, 63),
+                         ('vc', _TYPE_VAR_STRING, 128, 83),
+                         ('bl', _TYPE_BLOB, 144, 63)],
+                        [('\0\1', 'abc', '\xff')], more)
+        elif lowered.startswith('echo'):
+            self.result([('q', _TYPE_VAR_STRING, 0)], [(statement,)], more)
+        elif lowered.startswith('update'):
+            self.ok(more, affected=3, insert_id=7)
+        elif lowered == 'warn':
+            self.ok(more, warnings=2)
+        elif lowered == 'show warnings':
+            self.result([('Level', _TYPE_VAR_STRING, 0),
+                         ('Code', _TYPE_LONG, 0),
+                         ('Message', _TYPE_VAR_STRING, 0)],
+                        [('Warning', '1265', 'Data truncated'),
+                         ('Note', '1051', 'Unknown table')], more)
+        elif lowered.startswith('kill query '):
+            self.server.kill(int(lowered.split()[2]))
+            self.ok(more)
+        else:
+            self.error(1064, '42000', "You have an error in your SQL syntax")
+            return False
+        return True
+
+
+if __name__ == "__main__":
+    server = Server(unix_socket=len(sys.argv) > 1 and sys.argv[1] or None)
+    sys.stdout.write("%s %d\n" % (server.host, server.port))
+    sys.stdout.flush()
+    try:
+        while True:
+            threading.Event().wait(60)
+    except KeyboardInterrupt:
+        server.close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Tests for dbx_mysqldb, run against the stand-in server in mysqlstub.
+They need Komodo's dbxlib on sys.path:
+
+    python test/test_dbx_mysqldb.py
+"""
+
+import os
+import sys
+import unittest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+sys.path.insert(0, _here)
+
+try:
+    import dbxlib
+except ImportError:
+    dbxlib = None
+import mysqlstub
+
+
+def _driverModules():
+    return [name for name in sys.modules
+            if name == '_mysql' or name.startswith(('MySQLdb', 'dbx_mysqldb'))]
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class WithoutMySQLdbTests(unittest.TestCase):
+    """ dbx_mysqldb imported with _mysql blocked, so MySQLdb can't load.
+    """
+    def setUp(self):
+        self.saved_modules = {}
+        for name in _driverModules():
+            self.saved_modules[name] = sys.modules.pop(name)
+        sys.modules['_mysql'] = None
+        import dbx_mysqldb
+        self.dbx_mysqldb = dbx_mysqldb
+        self.server = mysqlstub.Server()
+        self.db = dbx_mysqldb.Database({'host': self.server.host,
+                                        'port': self.server.port,
+                                        'username': 'test',
+                                        'password': 'secret',
+                                        'auto_socket': False}, 'db')
+
+    def tearDown(self):
+        self.dbx_mysqldb._pool.clear()
+        self.server.close()
+        for name in _driverModules():
+            del sys.modules[name]
+        sys.modules.update(self.saved_modules)
+
+    def test_loaded(self):
+        self.assertTrue(self.dbx_mysqldb.MySQLdb is None)
+        self.assertTrue(self.dbx_mysqldb.loaded)
+        self.assertEqual(self.db.connection.driver, 'python')
+
+    def test_query(self):
+        with self.db.connect() as cu:
+            cu.execute("select binary")
+            col_info_block = self.db.getColumnInfoFromCursor(cu)
+            self.assertEqual([c.type for c in col_info_block],
+                             ['blob', 'varchar', 'blob'])
+            rows = cu.fetchall()
+        self.assertEqual(self.db._convert(col_info_block, rows[0])[1], 'abc')
+
+    def test_errors(self):
+        dbx_mysqldb = self.dbx_mysqldb
+        def query():
+            with self.db.connect() as cu:
+                cu.execute("bogus")
+        self.assertRaises(dbx_mysqldb.DriverDatabaseError, query)
+        try:
+            query()
+        except dbx_mysqldb.DriverError, ex:
+            self.assertEqual(dbx_mysqldb.errorKind(ex), 'DatabaseError')
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class PreparedStatementTests(unittest.TestCase):
+    def setUp(self):
+        import dbx_mysqldb
+        self.server = mysqlstub.Server()
+        self.args = {'host': self.server.host, 'port': self.server.port,
+                     'username': 'test', 'password': 'secret',
+                     'driver': 'python', 'auto_socket': False}
+        self.pool = dbx_mysqldb._pool
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.close()
+
+    def run_twice(self, args):
+        import dbx_mysqldb
+        db = dbx_mysqldb.Database(args, 'db')
+        conns = []
+        for i in range(2):
+            with db.connect() as cu:
+                db._execute(cu, "echo %s", ('x',))
+                self.assertEqual(cu.fetchall(), [("echo 'x'",)])
+                conns.append(cu.connection)
+        self.assertTrue(conns[0] is conns[1])
+        return conns[0]._statements
+
+    def test_prepared(self):
+        # Prepared once, on the pooled connection.
+        statements = self.run_twice(dict(self.args, prepared_statements=True))
+        self.assertEqual(statements.keys(), ["echo %s"])
+
+    def test_text(self):
+        self.assertFalse(self.run_twice(self.args))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Tests for dbx_mysqldb_async, run against the stand-in server in
+mysqlstub.  They need Komodo's dbxlib on sys.path:
+
+    python test/test_dbx_mysqldb_async.py
+"""
+
+import os
+import sys
+import Queue
+import threading
+import unittest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+sys.path.insert(0, _here)
+
+try:
+    import dbxlib
+except ImportError:
+    dbxlib = None
+else:
+    import dbx_mysqldb_async
+import mysqlstub
+
+
+class _ResultsManager(object):
+    """ Records the thread of every call made on it or attribute set. """
+    def __init__(self):
+        self.__dict__['threads'] = []
+
+    def __setattr__(self, name, value):
+        self.threads.append(threading.currentThread())
+        self.__dict__[name] = value
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        def method(*args, **kwargs):
+            self.threads.append(threading.currentThread())
+        return method
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class FutureTests(unittest.TestCase):
+    def setUp(self):
+        self.executor = dbx_mysqldb_async.Executor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_cancel_running(self):
+        started, release = threading.Event(), threading.Event()
+        def block():
+            started.set()
+            release.wait(10)
+            return 'ran'
+        future = self.executor.submit('server', block)
+        started.wait(10)
+        queued = self.executor.submit('server', block)
+        self.assertFalse(future.cancel())
+        self.assertTrue(queued.cancel())
+        release.set()
+        self.assertEqual(future.result(10), 'ran')
+        self.assertRaises(dbx_mysqldb_async.CancelledError, queued.result, 10)
+        self.assertFalse(future.cancel())
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class AsyncDatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.server = mysqlstub.Server()
+        self.executor = dbx_mysqldb_async.Executor()
+        self.main_thread_calls = Queue.Queue()
+        self.db = dbx_mysqldb_async.AsyncDatabase(
+            {'host': self.server.host, 'port': self.server.port,
+             'username': 'test', 'password': 'secret', 'driver': 'python',
+             'auto_socket': False},
+            'db', executor=self.executor,
+            call_on_main_thread=self.main_thread_calls.put)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.server.close()
+
+    def test_custom_query_on_main_thread(self):
+        rm = _ResultsManager()
+        future = self.db.runCustomQuery(rm, "select types")
+        # Nothing reaches the results manager until this thread runs it.
+        self.main_thread_calls.get(timeout=10)()
+        self.assertEqual(future.result(10), None)
+        self.assertTrue(rm.threads)
+        self.assertEqual(set(rm.threads), set([threading.currentThread()]))
+
+    def test_streaming_cancel(self):
+        blocks = []
+        started = threading.Event()
+        def on_rows(rows):
+            blocks.append(rows)
+            started.set()
+        future = self.db.streamQuery("select rows 1000000", on_rows,
+                                     batch_size=10)
+        started.wait(10)
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.result(10) < 1000000)
+
+
+if __name__ == "__main__":
+    unittest.main()
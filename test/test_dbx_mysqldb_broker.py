@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Tests for dbx_mysqldb_broker's fallback to a local Database.  They need
+Komodo's dbxlib and MySQLdb on sys.path:
+
+    python test/test_dbx_mysqldb_broker.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+
+try:
+    import dbxlib
+except ImportError:
+    dbxlib = None
+else:
+    import dbx_mysqldb_broker
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class FallbackTests(unittest.TestCase):
+    args = {'host': '127.0.0.1', 'username': 'test', 'password': 'secret'}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.chmod(self.dir, 0700)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def database(self, python):
+        client = dbx_mysqldb_broker.BrokerClient(
+            path=os.path.join(self.dir, 'broker.sock'), python=python)
+        return dbx_mysqldb_broker.BrokeredDatabase(
+            self.args, 'db', 'dbexplorer://127.0.0.1/test', client=client)
+
+    def test_bad_python(self):
+        # The broker can't be started, so the call runs locally.
+        db = self.database(os.path.join(self.dir, 'no-such-python'))
+        stats = db.getRowCacheStats()
+        self.assertEqual(stats['size'], 0)
+        self.assertTrue(db._local_db is not None)
+        self.assertFalse(db._client.available())
+
+
+if __name__ == "__main__":
+    unittest.main()
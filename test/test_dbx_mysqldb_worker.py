@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Tests for dbx_mysqldb_worker, run against the stand-in server in
+mysqlstub.  They need Komodo's dbxlib and MySQLdb on sys.path:
+
+    python test/test_dbx_mysqldb_worker.py
+"""
+
+import os
+import sys
+import unittest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+sys.path.insert(0, _here)
+
+try:
+    import dbxlib
+except ImportError:
+    dbxlib = None
+else:
+    import dbx_mysqldb
+    import dbx_mysqldb_worker
+import mysqlstub
+
+
+class _ResultsManager(object):
+    pass
+
+
+@unittest.skipIf(dbxlib is None, "dbxlib isn't available")
+class WorkerTests(unittest.TestCase):
+    def setUp(self):
+        self.server = mysqlstub.Server()
+        self.pool = dbx_mysqldb_worker.WorkerPool(size=1)
+        self.args = {'host': self.server.host, 'port': self.server.port,
+                     'username': 'test', 'password': 'secret',
+                     'driver': 'python', 'auto_socket': False}
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.close()
+
+    def test_open_query(self):
+        result = self.pool.openQuery(self.args, 'db', "select rows 1000")
+        try:
+            self.assertEqual(result.column_names, ['n'])
+            self.assertEqual(len(result), 1000)
+            self.assertEqual(result.getWindow(998, 5), [['998'], ['999']])
+            self.assertEqual(result[3:5], [['3'], ['4']])
+            self.assertEqual(result[-1], ['999'])
+        finally:
+            result.close()
+        self.assertEqual(self.pool.openQuery(self.args, 'db', "update t"), 3)
+
+    def test_custom_query(self):
+        # With worker_process, the rows come from the worker's result.
+        args = dict(self.args, worker_process=True)
+        db = dbx_mysqldb.Database(args, 'db')
+        opened = []
+        def openQuery(*args):
+            result = dbx_mysqldb_worker.WorkerPool.openQuery(self.pool, *args)
+            opened.append(result)
+            return result
+        self.pool.openQuery = openQuery
+        saved_pool, dbx_mysqldb_worker._pool = dbx_mysqldb_worker._pool, self.pool
+        try:
+            db.runCustomQuery(_ResultsManager(), "select types")
+        finally:
+            dbx_mysqldb_worker._pool = saved_pool
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(opened[0].column_names, ['a', 'b', 'd'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# Copyright (c) 2009-2010 ActiveState Software Inc.
+# See the file LICENSE.txt for licensing information.
+
+"""
+Tests for dbx_mysqlproto, run against the stand-in server in mysqlstub:
+
+    python test/test_dbx_mysqlproto.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import datetime
+import unittest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_here), 'pylib'))
+sys.path.insert(0, _here)
+
+import dbx_mysqlproto
+import mysqlstub
+
+
+class _ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mysqlstub.Server()
+        self.conn = self.connect()
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.close()
+
+    def connect(self, **kwargs):
+        return dbx_mysqlproto.connect(host=self.server.host,
+                                      port=self.server.port, user='test',
+                                      passwd='secret', read_timeout=10,
+                                      **kwargs)
+
+
+class ConnectionTests(_ServerTestCase):
+    def test_bad_password(self):
+        self.assertRaises(dbx_mysqlproto.OperationalError,
+                          dbx_mysqlproto.connect, host=self.server.host,
+                          port=self.server.port, user='test', passwd='wrong')
+
+    def test_server_info(self):
+        self.assertEqual(self.conn.get_server_info(), '5.7.0-stub')
+        self.conn.ping()
+
+    def test_closed(self):
+        self.conn.close()
+        self.assertTrue(self.conn.query_async("echo").error)
+
+    def test_multiplexed(self):
+        loop = dbx_mysqlproto.Loop()
+        conns = [self.connect(loop=loop) for i in range(5)]
+        requests = [conn.query_async("echo %d" % i)
+                    for i, conn in enumerate(conns)]
+        self.assertTrue(loop.wait(*requests, timeout=10))
+        self.assertEqual([r.results[0].rows[0][0] for r in requests],
+                         ["echo %d" % i for i in range(5)])
+        for conn in conns:
+            conn.close()
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "no Unix sockets")
+    def test_unix_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'mysql.sock')
+            server = mysqlstub.Server(unix_socket=path)
+            try:
+                conn = dbx_mysqlproto.connect(unix_socket=path, user='test',
+                                              passwd='secret', read_timeout=10)
+                cu = conn.cursor()
+                cu.execute("echo socket")
+                self.assertEqual(cu.fetchall(), [("echo socket",)])
+                conn.close()
+            finally:
+                server.close()
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class CursorTests(_ServerTestCase):
+    def test_types(self):
+        cu = self.conn.cursor()
+        self.assertEqual(cu.execute("select types"), 2)
+        self.assertEqual([d[0] for d in cu.description], ['a', 'b', 'd'])
+        self.assertEqual(cu.fetchall(),
+                         [(1, "x'y", datetime.datetime(2020, 1, 2, 3, 4, 5)),
+                          (2, None, None)])
+
+    def test_charsets(self):
+        cu = self.conn.cursor()
+        cu.execute("select types")
+        self.assertEqual(cu.description_charsets, (33, 33, 33))
+        cu.execute("select binary")
+        self.assertEqual(cu.description_charsets, (63, 83, 63))
+        self.assertEqual(cu.fetchall(), [('\0\1', 'abc', '\xff')])
+
+    def test_literals(self):
+        cu = self.conn.cursor()
+        cu.execute("echo %s %s %s", ("it's", 2, None))
+        self.assertEqual(cu.fetchone(), ("echo 'it\\'s' 2 NULL",))
+
+    def test_multiple_results(self):
+        cu = self.conn.cursor()
+        cu.execute("select types; update t; select rows 10")
+        self.assertEqual(len(cu.fetchall()), 2)
+        self.assertEqual(cu.nextset(), 1)
+        self.assertEqual((cu.rowcount, cu.lastrowid), (3, 7))
+        self.assertEqual(cu.nextset(), 1)
+        self.assertEqual(len(cu.fetchall()), 10)
+        self.assertEqual(cu.nextset(), None)
+
+    def test_errors(self):
+        cu = self.conn.cursor()
+        self.assertRaises(dbx_mysqlproto.ProgrammingError, cu.execute, "bogus")
+        cu.execute("select types; bogus")
+        self.assertEqual(len(cu.fetchall()), 2)
+        self.assertRaises(dbx_mysqlproto.ProgrammingError, cu.nextset)
+        # The connection is still usable.
+        cu.execute("echo")
+        self.assertEqual(cu.fetchone(), ("echo",))
+
+    def test_dict_rows(self):
+        cu = self.conn.cursor(dbx_mysqlproto.DictCursor)
+        cu.execute("select types")
+        self.assertEqual(cu.fetchone()['a'], 1)
+
+    def test_warnings(self):
+        cu = self.conn.cursor()
+        cu.lazy_warnings = True
+        cu.execute("warn")
+        cu.execute("warn")
+        self.assertEqual(cu.warning_count, 4)
+        warnings = cu.fetch_warnings()
+        self.assertEqual(len(warnings), 2)
+        self.assertEqual(len(cu.messages), 2)
+        self.assertEqual(cu.fetch_warnings(), ())
+
+    def test_fetchcolumns(self):
+        cu = self.conn.cursor()
+        cu.execute("select types")
+        a, b, d = cu.fetchcolumns(block_rows=1)
+        self.assertEqual(a.typecode, 'l')
+        self.assertEqual(list(a), [1, 2])
+        self.assertEqual(b, ["x'y", None])
+
+
+class PreparedStatementTests(_ServerTestCase):
+    def test_types(self):
+        cu = self.conn.cursor()
+        self.assertEqual(cu.execute_prepared("select types"), 2)
+        self.assertEqual(cu.description_flags, (3, 0, 0))
+        self.assertEqual(cu.fetchall(),
+                         [(1, "x'y", datetime.datetime(2020, 1, 2, 3, 4, 5)),
+                          (2, None, None)])
+
+    def test_same_as_text(self):
+        cu = self.conn.cursor()
+        for query in ("select temporal 50", "select binary"):
+            cu.execute(query)
+            text_rows = cu.fetchall()
+            cu.execute_prepared(query)
+            self.assertEqual(cu.fetchall(), text_rows)
+        conn = self.connect(conv={})
+        cu = conn.cursor()
+        cu.execute("select temporal 50")
+        text_rows = cu.fetchall()
+        cu.execute_prepared("select temporal 50")
+        self.assertEqual(cu.fetchall(), text_rows)
+        conn.close()
+
+    def test_params(self):
+        cu = self.conn.cursor()
+        cu.execute_prepared("echo %s %s %s %s", ("it's", 2, None, 1.5))
+        self.assertEqual(cu.fetchone(), ("echo 'it\\'s' 2 NULL 1.5",))
+        self.assertRaises(dbx_mysqlproto.ProgrammingError,
+                          cu.execute_prepared, "echo %s", ())
+
+    def test_statement_cache(self):
+        cu = self.conn.cursor()
+        self.conn.max_statements = 2
+        for n in (3, 4, 3):
+            cu.execute_prepared("select rows %s", (n,))
+            self.assertEqual(len(cu.fetchall()), n)
+        first = self.conn.prepare("select rows %s")
+        self.assertTrue(self.conn.prepare("select rows %s") is first)
+        cu.execute_prepared("echo a")
+        cu.execute_prepared("echo b")
+        # The least recently used statement was closed to make room.
+        self.assertFalse(self.conn.prepare("select rows %s") is first)
+        cu.execute_prepared("select rows %s", (2,))
+        self.assertEqual(cu.fetchall(), [(0,), (1,)])
+
+    def test_unbuffered(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.execute_prepared("select rows %s", (5000,))
+        self.assertEqual(sum([1 for row in cu]), 5000)
+        cu.close()
+
+
+class UnbufferedCursorTests(_ServerTestCase):
+    def test_fetch(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.execute("select rows 5000")
+        self.assertEqual(cu.rowcount, -1)
+        self.assertEqual(cu.fetchmany(3), [(0,), (1,), (2,)])
+        self.assertEqual(len(cu.fetchall()), 4997)
+        self.assertEqual(cu.rowcount, 5000)
+
+    def test_iterbatched(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.execute("select rows 5000")
+        self.assertEqual([row[0] for row in cu.iterbatched()], range(5000))
+        cu.batched_iteration = True
+        cu.execute("select rows 10")
+        self.assertEqual(len(list(cu)), 10)
+
+    def test_reading_stops(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.max_pending_rows = 100
+        cu.execute("select rows 1000000")
+        cu.fetchmany(10)
+        result = cu._result
+        # Give the server time to send more than the limit.
+        for i in range(20):
+            time.sleep(0.01)
+            self.conn.loop.run_once(0.01)
+        self.assertFalse(result.complete)
+        # The limit, plus at most one socket read of rows.
+        self.assertTrue(len(result.rows) < 100 + 10000, len(result.rows))
+        self.assertEqual(len(cu.fetchmany(500)), 500)
+
+    def test_drain_drops_rows(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.execute("select rows 100000")
+        cu.fetchmany(10)
+        result = cu._result
+        cu.execute("echo")
+        self.assertTrue(result.complete)
+        self.assertEqual(result.rows, [])
+        self.assertEqual(result.affected_rows, 100000)
+        self.assertEqual(cu.fetchone(), ("echo",))
+
+    def test_abort_on_close(self):
+        cu = self.conn.cursor(dbx_mysqlproto.SSCursor)
+        cu.abort_on_close = True
+        cu.execute("select rows 100000000")
+        cu.fetchmany(10)
+        cu.close()
+        self.assertEqual(self.conn.close_stats['aborted'], 1)
+        cu = self.conn.cursor()
+        cu.execute("echo")
+        self.assertEqual(cu.fetchone(), ("echo",))
+
+
+if __name__ == "__main__":
+    unittest.main()